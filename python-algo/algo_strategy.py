@@ -3,7 +3,6 @@ import random
 import math
 import warnings
 from sys import maxsize
-import json
 
 
 """
@@ -16,10 +15,13 @@ Advanced strategy tips:
 
   - The GameState.map object can be manually manipulated to create hypothetical
   board states. Though, we recommended making a copy of the map to preserve
-  the actual current map state.
+  the actual current map state. GameState.fork() makes a cheap copy.
 """
 
 class AlgoStrategy(gamelib.AlgoCore):
+    # Get turn and frame messages as dicts, so they are only decoded once
+    decoded_messages = True
+
     def __init__(self):
         super().__init__()
         seed = random.randrange(maxsize)
@@ -266,15 +268,10 @@ class AlgoStrategy(gamelib.AlgoCore):
         # By asking attempt_spawn to spawn 1000 units, it will essentially spawn as many as we have resources for
         game_state.attempt_spawn(self.DEMOLISHER, [24, 10], 1)
     def detect_enemy_unit(self, game_state, unit_type=None, valid_x = None, valid_y = None):
-        total_units = 0
-        for location in game_state.game_map:
-            if game_state.contains_stationary_unit(location):
-                for unit in game_state.game_map[location]:
-                    if unit.player_index == 1 and (unit_type is None or unit.unit_type == unit_type) and (valid_x is None or location[0] in valid_x) and (valid_y is None or location[1] in valid_y):
-                        total_units += 1
-        return total_units
-
-    def on_action_frame(self, turn_string):
+        region = game_state.game_map.region_mask(valid_x, valid_y)
+        return game_state.game_map.count_structures(1, unit_type, region)
+
+    def on_action_frame(self, state):
         """
         This is the action frame of the game. This function could be called
         hundreds of times per turn and could slow the algo down so avoid putting slow code here.
@@ -282,7 +279,6 @@ class AlgoStrategy(gamelib.AlgoCore):
         Full doc on format of a game frame at in json-docs.html in the root of the Starterkit.
         """
         # Let's record at what position we get scored on
-        state = json.loads(turn_string)
         events = state["events"]
         breaches = events["breach"]
         for breach in breaches:
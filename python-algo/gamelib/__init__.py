@@ -10,20 +10,36 @@ Investigating it is useful for any player that wants to access more information
 The GameUnit class in unit.py represetns a single unit. 
 Investigating it is useful for any player that wants to access information about units. \n
 
+The UnitStore class in unit_store.py holds the units of a game state as parallel columns instead of GameUnit objects.
+It is useful for advanced players who process every unit at once, for example with NumPy. \n
+
 The AlgoCore class in algocore.py handles communication with the game engine, and forms the bones of an algo. AlgoStrategy inherits from it. 
 Investigating it is useful for advanced players interested in getting data from the action phase or communicating directly with the game engine. \n
 
+The AsyncAlgoCore class in async_algocore.py does the same on an asyncio event loop, with coroutine handlers.
+It is useful for players who want analysis tasks to keep running across action frames. \n
+
 The Navigation class in navigation.py contains functions related to pathfinding, which are used by GameState in pathing related functions. 
 Investigating it is useful for advanced player who want to optimize the slow default pathing algorithm we provide. \n 
 
+The Rules class in rules.py holds the unit types, costs and resource schedule compiled from the game config.
+GameState and GameMap share one Rules object per config, and GameUnits share its stat records. \n
+
+The Simulator class in simulator.py plays out the action phase that follows a game state, frame by frame, following the engine's rules.
+It is useful for players who want to see how a turn will play out before submitting it. \n
+
 util.py contains a small handful of functions that help with communication, including the debug-printing function, debug_write().
 """
 
-from .algocore import AlgoCore
+from .algocore import AlgoCore, DeadlineExceeded
+from .async_algocore import AsyncAlgoCore
 from .util import debug_write
 from .game_state import GameState
 from .unit import GameUnit
 from .game_map import GameMap
+from .unit_store import UnitStore
+from .rules import Rules, compile_rules
+from .simulator import Simulator
 
-__all__ = ["algocore", "game_state", "game_map", "navigation", "unit", "util"]
+__all__ = ["algocore", "async_algocore", "game_state", "game_map", "navigation", "rules", "simulator", "unit", "unit_store", "util"]
  
\ No newline at end of file
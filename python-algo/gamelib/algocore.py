@@ -1,19 +1,74 @@
-import json
+import traceback
+from concurrent.futures import Future
+from threading import Event, Thread
+from time import monotonic
 
 from .game_state import GameState
-from .util import get_command, debug_write, BANNER_TEXT, send_command
+from .game_map import reset_range_tables
+from .rules import compile_rules
+from .util import get_command, debug_write, decode_json, BANNER_TEXT, send_command
+
+#The turn budget used when the config has no waitTimeBotSoft, in seconds
+DEFAULT_TURN_BUDGET = 4.0
+
+#The share of the engine's soft time limit used as the default turn budget, leaving time to send the turn
+TURN_BUDGET_SHARE = 0.8
+
+
+class DeadlineExceeded(Exception):
+    """Raised by AlgoCore.check_deadline when the turn budget has run out
+
+    Attributes :
+        * phase (str): The phase that was running when the budget ran out
+
+    """
+    def __init__(self, phase=None):
+        super().__init__("Turn budget exceeded in phase {}".format(phase))
+        self.phase = phase
+
 
 class AlgoCore(object):
     """
     This class handles communication with the game engine. \n
     algo_strategy.py subclasses it. 
 
+    Each turn is timed from the moment its message arrives, so strategies can stop expensive analysis
+    in time with time_remaining, check_deadline and run_anytime.
+
+    Strategies that override plan_ahead get a background thread that plans the next turn during the action phase,
+    while the main thread waits on the engine, and collect its result with get_plan. Each plan runs on its own daemon
+    thread, so a plan that never returns is left behind instead of holding up later plans or the end of the game.
+
+    Set decoded_messages to True in a subclass to get each message as a dict instead of a string,
+    since start has already decoded it to read its turnInfo.
+
     Attributes :
+        * decoded_messages (bool): If true, on_turn and on_action_frame are passed the decoded dict instead of the message string
         * config (JSON): json object containing information about the game
+        * rules (:obj: Rules): The rules compiled from config when the game starts
+        * turn_budget (float): The seconds a turn may take. If None, TURN_BUDGET_SHARE of the config's waitTimeBotSoft,
+          or DEFAULT_TURN_BUDGET if the config has none
+        * turn_started (float): The time.monotonic() at which the current turn's message arrived
+        * phase (str): The name of the part of the turn running now, used when logging overruns
+        * latest_frame (dict): The last action frame received, updated while plan_ahead runs
+        * plan_source (dict): The action frame the current plan was started from
 
     """
+    decoded_messages = False
+
     def __init__(self):
         self.config = None
+        self.rules = None
+        self.turn_budget = None
+        self.turn_started = None
+        self.phase = None
+        self._deadline = None
+        self.latest_frame = None
+        self.plan_source = None
+        self._plan_thread = None
+        self._plan = None
+        self._plan_cancelled = None
+        self._turn_info = None
 
     def on_game_start(self, config):
         """
@@ -26,7 +81,7 @@ class AlgoCore(object):
     def on_turn(self, game_state):
         """
         This step function is called at the start of each turn.
-        It is passed the current game state, which can be used to initiate a new GameState object. 
+        It is passed the current game state string, or its decoded dict if decoded_messages is set, which can be used to initiate a new GameState object. 
         By default, it sends empty commands to the game engine. \n
         algo_strategy.py inherits from AlgoCore and overrides this on turn function. 
         Adjusting the on_turn function in algo_strategy is the main way to adjust your algo's logic. 
@@ -38,11 +93,242 @@ class AlgoCore(object):
         """
         After each deploy phase, the game engine will run the action phase of the round.
         The action phase is made up of a sequence of distinct frames. 
-        Each of these frames is sent to the algo in order. 
+        Each of these frames is sent to the algo in order, as a string or as a dict if decoded_messages is set. 
         They can be handled in this function. 
         """
         pass
 
+    def plan_ahead(self, frame_state, cancelled):
+        """
+        Override this to plan the next turn in the background during the action phase.
+        It is called in a worker thread with the first frame of each action phase, already decoded into a dict,
+        and latest_frame holds the newest frame as more arrive. cancelled, a threading.Event, is set as soon as the
+        next turn message arrives, and plan_ahead should then return with whatever it has found, so it stops
+        competing with on_turn. Collect the result in on_turn with get_plan. \n
+        By default there is no background planning.
+        """
+        return None
+
+    def get_plan(self, timeout=0):
+        """Gets the result of plan_ahead, giving up on it if it has not finished
+
+        Args:
+            timeout: The most seconds to wait for plan_ahead to finish, capped by the time left in this turn
+
+        Returns:
+            What plan_ahead returned, or None if it did not finish, failed, or no plan was started
+
+        """
+        if self._plan is None:
+            return None
+        plan, self._plan = self._plan, None
+        try:
+            return plan.result(max(0, min(timeout, self.time_remaining())))
+        except Exception as e:
+            if not plan.done():
+                debug_write("Cancelled unfinished plan from turn {}".format(self.plan_source.get("turnInfo")))
+            else:
+                debug_write("Plan failed: {}".format(e))
+            return None
+        finally:
+            self._plan_cancelled.set()
+
+    def cancel_plan(self):
+        """Tells the running plan_ahead to stop and drops its result"""
+        if self._plan is not None:
+            self._plan_cancelled.set()
+            self._plan = None
+
+    def _stop_plan(self):
+        """Tells the running plan_ahead to stop, keeping its result for get_plan"""
+        if self._plan_cancelled is not None:
+            self._plan_cancelled.set()
+
+    def _start_plan(self, frame_state):
+        if type(self).plan_ahead is AlgoCore.plan_ahead:
+            return
+        self.cancel_plan()
+        if self._plan_thread is not None and self._plan_thread.is_alive():
+            debug_write("Plan from turn {} ignored being cancelled, leaving it behind".format(self.plan_source.get("turnInfo")))
+        self.plan_source = frame_state
+        self._plan_cancelled = Event()
+        self._plan = Future()
+        #A daemon thread, so a plan that never returns can not keep the algo from exiting
+        self._plan_thread = Thread(target=self._run_plan, args=(self._plan, frame_state, self._plan_cancelled), daemon=True)
+        self._plan_thread.start()
+
+    def _run_plan(self, plan, frame_state, cancelled):
+        if not plan.set_running_or_notify_cancel():
+            return
+        try:
+            result = self.plan_ahead(frame_state, cancelled)
+        except Exception as e:
+            plan.set_exception(e)
+        else:
+            plan.set_result(result)
+
+    def get_turn_budget(self):
+        """Gets the seconds a turn may take, see turn_budget"""
+        if self.turn_budget is not None:
+            return self.turn_budget
+        soft_limit = (self.config or {}).get("timingAndReplay", {}).get("waitTimeBotSoft")
+        if soft_limit is None:
+            return DEFAULT_TURN_BUDGET
+        return soft_limit / 1000 * TURN_BUDGET_SHARE
+
+    def start_turn_clock(self, started=None):
+        """Starts timing a turn. start calls this as soon as a turn message arrives.
+
+        Args:
+            started: The time.monotonic() at which the turn started, now if None
+
+        """
+        self.turn_started = monotonic() if started is None else started
+        self._deadline = self.turn_started + self.get_turn_budget()
+        self.phase = None
+
+    def time_remaining(self):
+        """Gets the seconds left in this turn's budget
+
+        Returns:
+            The seconds left, negative once the budget is used up, or the whole budget if no turn is being timed
+
+        """
+        if self._deadline is None:
+            return self.get_turn_budget()
+        return self._deadline - monotonic()
+
+    def check_deadline(self, phase=None):
+        """Raises DeadlineExceeded if this turn's budget is used up. Call it now and then from expensive analysis.
+
+        Args:
+            phase: The name of the part of the turn running now, if it has changed
+
+        """
+        if phase is not None:
+            self.phase = phase
+        if self.time_remaining() <= 0:
+            raise DeadlineExceeded(self.phase)
+
+    def run_anytime(self, game_state, planners, budget=None):
+        """Runs increasingly expensive planners until the budget runs out, and submits the best turn found
+
+        Each planner is passed a fork of game_state to place its turn on, and returns a score, higher is better, or None
+        if it found nothing. Planners should call check_deadline now and then; a planner that runs out of time is dropped.
+        A planner that raises any other exception is logged and skipped, so a turn is always submitted.
+        A planner is not started if the one before it took longer than the time left, as each is expected to be slower.
+
+        Args:
+            game_state: The GameState for this turn
+            planners: The planners to run, cheapest first
+            budget: The most seconds to spend, the rest of the turn budget if None
+
+        Returns:
+            The fork holding the submitted turn, game_state itself if no planner found anything
+
+        """
+        turn_deadline = self._deadline
+        if self._deadline is None:
+            self._deadline = monotonic() + self.get_turn_budget()
+        if budget is not None:
+            self._deadline = min(self._deadline, monotonic() + budget)
+        best, best_score = game_state, None
+        last_duration = 0
+        try:
+            for planner in planners:
+                name = getattr(planner, "__name__", str(planner))
+                if self.time_remaining() <= last_duration:
+                    debug_write("Skipping planner {}, {:.0f} ms left".format(name, self.time_remaining() * 1000))
+                    break
+                started = monotonic()
+                fork = game_state.fork()
+                try:
+                    self.phase = name
+                    score = planner(fork)
+                except DeadlineExceeded as e:
+                    debug_write("Turn budget ran out in planner {}".format(e.phase))
+                    break
+                except Exception:
+                    debug_write("Planner {} failed, skipping it:\n{}".format(name, traceback.format_exc()))
+                    continue
+                finally:
+                    last_duration = monotonic() - started
+                if score is not None and (best_score is None or score > best_score):
+                    best, best_score = fork, score
+        finally:
+            self._deadline = turn_deadline
+        best.submit_turn()
+        return best
+
+    def _log_overrun(self, turn_info):
+        elapsed = monotonic() - self.turn_started
+        if elapsed > self.get_turn_budget():
+            debug_write("Turn {} took {:.0f} ms, {:.0f} ms over budget, in phase {}".format(
+                turn_info[1], elapsed * 1000, (elapsed - self.get_turn_budget()) * 1000, self.phase))
+
+    def _dispatch(self, game_state_string, received):
+        """Reads a message from the game engine and does the bookkeeping around it, for start and AsyncAlgoCore.run
+
+        Args:
+            game_state_string: The message
+            received: The time.monotonic() at which it arrived
+
+        Returns:
+            The hook to call and its argument, (None, None) if there is nothing to call, or None once the game is over
+
+        """
+        if "replaySave" in game_state_string:
+            """
+            This means this must be the config file. So, load in the config file as a json and add it to your AlgoStrategy class.
+            """
+            parsed_config = decode_json(game_state_string)
+            reset_range_tables(parsed_config)
+            self.rules = compile_rules(parsed_config)
+            return self.on_game_start, parsed_config
+        elif "turnInfo" in game_state_string:
+            state = decode_json(game_state_string)
+            stateType = int(state.get("turnInfo")[0])
+            if stateType == 0:
+                """
+                This is the game turn game state message. Algo must now print to stdout 2 lines, one for build phase one for
+                deploy phase. Printing is handled by the provided functions.
+                """
+                self.start_turn_clock(received)
+                self._stop_plan()
+                self._turn_info = state.get("turnInfo")
+                return self.on_turn, state if self.decoded_messages else game_state_string
+            elif stateType == 1:
+                """
+                If stateType == 1, this game_state_string string represents a single frame of an action phase
+                """
+                if self.latest_frame is None or self.latest_frame.get("turnInfo")[1] != state.get("turnInfo")[1]:
+                    self._start_plan(state)
+                self.latest_frame = state
+                return self.on_action_frame, state if self.decoded_messages else game_state_string
+            elif stateType == 2:
+                """
+                This is the end game message. This means the game is over so break and finish the program.
+                """
+                debug_write("Got end state, game over. Stopping algo.")
+                self.cancel_plan()
+                return None
+            else:
+                """
+                Something is wrong? Received an incorrect or improperly formatted string.
+                """
+                debug_write("Got unexpected string with turnInfo: {}".format(game_state_string))
+        else:
+            """
+            Something is wrong? Received an incorrect or improperly formatted string.
+            """
+            debug_write("Got unexpected string : {}".format(game_state_string))
+        return None, None
+
+    def _finish_hook(self, hook):
+        """Does the bookkeeping after a hook returned by _dispatch has run"""
+        if hook == self.on_turn:
+            self.cancel_plan()
+            self._log_overrun(self._turn_info)
 
     def start(self):
         """ 
@@ -57,39 +343,10 @@ class AlgoCore(object):
             # Note: Python blocks and hangs on stdin. Can cause issues if connections aren't setup properly and may need to
             # manually kill this Python program.
             game_state_string = get_command()
-            if "replaySave" in game_state_string:
-                """
-                This means this must be the config file. So, load in the config file as a json and add it to your AlgoStrategy class.
-                """
-                parsed_config = json.loads(game_state_string)
-                self.on_game_start(parsed_config)
-            elif "turnInfo" in game_state_string:
-                state = json.loads(game_state_string)
-                stateType = int(state.get("turnInfo")[0])
-                if stateType == 0:
-                    """
-                    This is the game turn game state message. Algo must now print to stdout 2 lines, one for build phase one for
-                    deploy phase. Printing is handled by the provided functions.
-                    """
-                    self.on_turn(game_state_string)
-                elif stateType == 1:
-                    """
-                    If stateType == 1, this game_state_string string represents a single frame of an action phase
-                    """
-                    self.on_action_frame(game_state_string)
-                elif stateType == 2:
-                    """
-                    This is the end game message. This means the game is over so break and finish the program.
-                    """
-                    debug_write("Got end state, game over. Stopping algo.")
-                    break
-                else:
-                    """
-                    Something is wrong? Received an incorrect or improperly formatted string.
-                    """
-                    debug_write("Got unexpected string with turnInfo: {}".format(game_state_string))
-            else:
-                """
-                Something is wrong? Received an incorrect or improperly formatted string.
-                """
-                debug_write("Got unexpected string : {}".format(game_state_string))
+            message = self._dispatch(game_state_string, monotonic())
+            if message is None:
+                break
+            hook, argument = message
+            if hook is not None:
+                hook(argument)
+                self._finish_hook(hook)
@@ -0,0 +1,143 @@
+import asyncio
+import sys
+from functools import partial
+from time import monotonic
+
+from .algocore import AlgoCore
+from .util import get_command, debug_write, BANNER_TEXT, send_command
+
+#The longest message the stdin reader accepts, in bytes. Game states with many units are far longer than asyncio's 64 KiB default.
+STREAM_LIMIT = 2 ** 24
+
+
+class AsyncAlgoCore(AlgoCore):
+    """
+    This class handles communication with the game engine on an asyncio event loop. \n
+    Subclass it instead of AlgoCore to write on_game_start, on_turn and on_action_frame as coroutines.
+
+    Messages are read from stdin through an asyncio stream, and each handler is awaited before the next message is handled.
+    Analysis started with spawn_task keeps running between messages, across action frames, whenever a handler awaits,
+    and is cancelled when the next turn message arrives. Turns are sent with send_command and GameState.submit_turn as usual.
+
+    A task only stops at an await, so long-running analysis should await asyncio.sleep(0) now and then.
+    The messages are dispatched as in AlgoCore, so the turn clock, plan_ahead and get_plan work the same way,
+    and run_anytime is a coroutine that runs the planners in a worker thread to keep the event loop free.
+
+    Attributes :
+        * tasks (set): The running tasks started with spawn_task
+
+    """
+    def __init__(self):
+        super().__init__()
+        self.tasks = set()
+
+    async def on_game_start(self, config):
+        """
+        This coroutine is called once at the start of the game.
+        By default, it just initializes the config.
+        """
+        self.config = config
+
+    async def on_turn(self, game_state):
+        """
+        This coroutine is called at the start of each turn, with the turn's game state string, or its dict if decoded_messages is set.
+        By default, it sends empty commands to the game engine.
+        """
+        send_command("[]")
+        send_command("[]")
+
+    async def on_action_frame(self, action_frame_game_state):
+        """
+        This coroutine is called with each frame of the action phase, as a string or as a dict if decoded_messages is set.
+        """
+        pass
+
+    def spawn_task(self, coroutine):
+        """Runs a coroutine alongside the handlers until it finishes or the next turn message arrives
+
+        Args:
+            coroutine: The coroutine to run
+
+        Returns:
+            The asyncio.Task running it
+
+        """
+        task = asyncio.ensure_future(coroutine)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return task
+
+    async def run_anytime(self, game_state, planners, budget=None):
+        """Runs AlgoCore.run_anytime in a worker thread, so tasks keep running while the planners do
+
+        Args:
+            game_state: The GameState for this turn
+            planners: The planners to run, cheapest first
+            budget: The most seconds to spend, the rest of the turn budget if None
+
+        Returns:
+            The fork holding the submitted turn, game_state itself if no planner found anything
+
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, partial(AlgoCore.run_anytime, self, game_state, planners, budget))
+
+    def cancel_tasks(self):
+        """Cancels every task started with spawn_task"""
+        for task in list(self.tasks):
+            task.cancel()
+
+    def _stop_plan(self):
+        """Cancels the tasks along with the running plan_ahead when a turn message arrives"""
+        self.cancel_tasks()
+        super()._stop_plan()
+
+    def start(self):
+        """
+        Start the parsing loop on a new event loop.
+        Returns once it recieves the "End" turn message from the game.
+        """
+        asyncio.run(self.run())
+
+    async def run(self, reader=None):
+        """The parsing loop, see start
+
+        Args:
+            reader: The asyncio.StreamReader to read messages from, stdin if None
+
+        """
+        debug_write(BANNER_TEXT)
+        if reader is None:
+            reader = await self._stdin_reader()
+        loop = asyncio.get_running_loop()
+
+        try:
+            while True:
+                if reader is None:
+                    game_state_string = await loop.run_in_executor(None, get_command)
+                else:
+                    game_state_string = (await reader.readline()).decode()
+                    if game_state_string == "":
+                        debug_write("Got EOF, parent game process must have died, exiting for cleanup")
+                        break
+                message = self._dispatch(game_state_string, monotonic())
+                if message is None:
+                    break
+                hook, argument = message
+                if hook is not None:
+                    await hook(argument)
+                    self._finish_hook(hook)
+        finally:
+            self.cancel_tasks()
+
+    async def _stdin_reader(self):
+        """Connects an asyncio.StreamReader to stdin, or returns None where the event loop can not read pipes,
+        such as on Windows, so run falls back to reading stdin in a thread.
+        """
+        loop = asyncio.get_running_loop()
+        reader = asyncio.StreamReader(limit=STREAM_LIMIT)
+        try:
+            await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), sys.stdin)
+        except (NotImplementedError, OSError, ValueError):
+            return None
+        return reader
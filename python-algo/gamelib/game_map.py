@@ -1,6 +1,130 @@
 import math
+import copy
+from functools import lru_cache
 from .unit import GameUnit
 from .util import debug_write
+from .rules import compile_rules
+
+
+class ArenaTables:
+    """Location tables for the diamond shaped board, built once per arena size
+
+    Attributes :
+        * size (int): The size of the arena
+        * in_arena (list): Indexed by x * size + y, True if [x, y] is on the board
+        * locations (tuple): Every (x, y) on the board, in the order GameMap iterates over them
+        * location_set (frozenset): The same locations, for membership tests
+        * edges (tuple): The (x, y) locations of each edge, indexed by GameMap.TOP_RIGHT, TOP_LEFT, BOTTOM_LEFT and BOTTOM_RIGHT
+        * edge_sets (tuple): The same edges as frozensets
+        * full_mask (int): A bitmask with bit x * size + y set for every location on the board
+        * column_masks (tuple): Indexed by x, the bitmask of the board locations in column x
+        * row_masks (tuple): Indexed by y, the bitmask of the board locations in row y
+
+    """
+    def __init__(self, size):
+        half = size // 2
+        self.size = size
+        self.in_arena = [False] * (size * size)
+        locations = []
+        for y in range(size):
+            for x in range(size):
+                row_size = y + 1 if y < half else size - y
+                if half - row_size <= x < half + row_size:
+                    self.in_arena[x * size + y] = True
+                    locations.append((x, y))
+        self.locations = tuple(locations)
+        self.location_set = frozenset(locations)
+
+        top_right = tuple((half + num, size - 1 - num) for num in range(half))
+        top_left = tuple((half - 1 - num, size - 1 - num) for num in range(half))
+        bottom_left = tuple((half - 1 - num, num) for num in range(half))
+        bottom_right = tuple((half + num, num) for num in range(half))
+        self.edges = (top_right, top_left, bottom_left, bottom_right)
+        self.edge_sets = tuple(frozenset(edge) for edge in self.edges)
+
+        column_masks = [0] * size
+        row_masks = [0] * size
+        for x, y in locations:
+            column_masks[x] |= 1 << (x * size + y)
+            row_masks[y] |= 1 << (x * size + y)
+        self.column_masks = tuple(column_masks)
+        self.row_masks = tuple(row_masks)
+        self.full_mask = sum(column_masks)
+
+
+_ARENA_TABLES = {}
+
+#The range caches are bounded, so looking up many unusual radii can not grow them without limit.
+#A config has a handful of ranges, whose offset tables and per location tables fit well within these sizes.
+RANGE_OFFSETS_CACHE_SIZE = 64
+RANGE_LOCATIONS_CACHE_SIZE = 8192
+
+
+def arena_tables(size):
+    """Gets the shared ArenaTables for an arena size"""
+    tables = _ARENA_TABLES.get(size)
+    if tables is None:
+        tables = _ARENA_TABLES.setdefault(size, ArenaTables(size))
+    return tables
+
+
+@lru_cache(maxsize=RANGE_OFFSETS_CACHE_SIZE)
+def range_offsets(radius, hit_radius):
+    """Gets the relative offsets of the locations in range of a location
+
+    Args:
+        radius: The range of a unit
+        hit_radius: The getHitRadius from the config
+
+    Returns:
+        A tuple of (dx, dy) offsets, ordered by dx then dy, whose distance is less than radius + hit_radius
+
+    """
+    search_radius = math.ceil(radius)
+    return tuple((dx, dy) for dx in range(-search_radius, search_radius + 1) for dy in range(-search_radius, search_radius + 1)
+        if math.sqrt(dx**2 + dy**2) < radius + hit_radius)
+
+
+@lru_cache(maxsize=RANGE_OFFSETS_CACHE_SIZE)
+def attack_offsets(attack_range):
+    """Gets the relative offsets of the locations a unit can attack, the tiles within attack_range inclusive
+
+    Returns:
+        A tuple of (dx, dy) offsets, ordered by dx then dy
+
+    """
+    search_radius = math.ceil(attack_range)
+    return tuple((dx, dy) for dx in range(-search_radius, search_radius + 1) for dy in range(-search_radius, search_radius + 1)
+        if math.sqrt(dx**2 + dy**2) <= attack_range)
+
+
+def _range_locations(size, x, y, radius, hit_radius):
+    """The board locations within radius of an integer location [x, y], as a tuple of (x, y) tuples"""
+    location_set = arena_tables(size).location_set
+    return tuple((x + dx, y + dy) for dx, dy in range_offsets(radius, hit_radius) if (x + dx, y + dy) in location_set)
+
+
+_cached_range_locations = lru_cache(maxsize=RANGE_LOCATIONS_CACHE_SIZE)(_range_locations)
+
+
+def reset_range_tables(config=None):
+    """Clears the cached range tables, and rebuilds the offsets for every attack and shield range in config if given.
+    Call this when the game config changes.
+    """
+    range_offsets.cache_clear()
+    attack_offsets.cache_clear()
+    _cached_range_locations.cache_clear()
+    if config is None:
+        return
+    hit_radius = config["unitInformation"][0].get('getHitRadius', 0)
+    for unit_information in config["unitInformation"]:
+        for stats in (unit_information, unit_information.get("upgrade", {})):
+            for key in ("attackRange", "shieldRange"):
+                if key in stats:
+                    range_offsets(stats[key], hit_radius)
+            if "attackRange" in stats:
+                attack_offsets(stats["attackRange"])
+
 
 class GameMap:
     """Holds data about the current game map and provides functions
@@ -9,8 +133,17 @@ class GameMap:
     game_map[x, y] will return a list of Units located at that location, 
     or an empty list if there are no units at the location
 
+    The map keeps bitmasks of the locations holding structures, overall, per player and per
+    player and unit type, see structure_mask and count_structures.
+    Change units through add_unit, remove_unit or game_map[x, y] = units so the masks
+    stay in sync; appending to the list returned by game_map[x, y] bypasses them.
+    Next to each unit list the map keeps the tile's structure, for constant time lookups.
+    Maps made by fork share their unit lists, so those lists are replaced rather than
+    changed in place. Changes made between checkpoint and rollback are undone by rollback.
+
     Attributes :
         * config (JSON): Contains information about the current game rules
+        * rules (:obj: Rules): The rules compiled from config
         * enable_warnings (bool): If true, debug messages for game_map functions will print out
         * ARENA_SIZE (int): The size of the arena.
         * HALF_ARENA (int): Half of the size of the arena.
@@ -28,6 +161,7 @@ class GameMap:
 
         """
         self.config = config
+        self.rules = compile_rules(config)
         self.enable_warnings = True
         self.ARENA_SIZE = 28
         self.HALF_ARENA = int(self.ARENA_SIZE / 2)
@@ -35,8 +169,17 @@ class GameMap:
         self.TOP_LEFT = 1
         self.BOTTOM_LEFT = 2
         self.BOTTOM_RIGHT = 3
+        self._tables = arena_tables(self.ARENA_SIZE)
         self.__map = self.__empty_grid()
-        self.__start = [13,0]
+        self.__structures = [[None] * self.ARENA_SIZE for _ in range(self.ARENA_SIZE)]
+        self._structure_bits = 0
+        self._player_bits = [0, 0]
+        self._type_bits = {}
+        self._owned_columns = bytearray([1]) * self.ARENA_SIZE
+        #Bit x * ARENA_SIZE + y is set once the units at [x, y] belong to this map alone, rather than being shared with a fork
+        self._owned_units = -1
+        self._undo_log = None
+        self._checkpoint_depth = 0
     
     def __getitem__(self, location):
         if len(location) == 2 and self.in_arena_bounds(location):
@@ -46,26 +189,15 @@ class GameMap:
 
     def __setitem__(self, location, val):
         if type(location) == tuple and len(location) == 2 and self.in_arena_bounds(location):
-            self.__map[location[0]][location[1]] = val
+            self._set_tile(location[0], location[1], val)
             return
         self._invalid_coordinates(location)
 
     def __iter__(self):
-        self.__start = [13,0]
-        return self
-    
-    def __next__(self):
-        location = self.__start
-        if location == [15,27]:
-            raise StopIteration
-        new_location = [location[0]+1, location[1]]
-        while not self.in_arena_bounds(new_location) and not location == [14,27]:
-            if new_location[0] == self.ARENA_SIZE:
-                new_location = [0, new_location[1]+1]
-            else:
-                new_location = [new_location[0]+1, new_location[1]]
-        self.__start = new_location
-        return location 
+        """Iterates over every location on the board, row by row from the bottom.
+        Each iteration is independent, so nested loops over the map work.
+        """
+        return ([x, y] for x, y in self._tables.locations)
 
     def __empty_grid(self):
         grid = []
@@ -75,6 +207,230 @@ class GameMap:
                 grid[x].append([])
         return grid
 
+    def _set_tile(self, x, y, units):
+        """Replaces the units at [x, y] and updates the structure masks
+        """
+        column = self.__writable_column(x, y)
+        bit = 1 << (x * self.ARENA_SIZE + y)
+        if self._structure_bits & bit:
+            for unit in column[y]:
+                if unit.stationary:
+                    self.__clear_structure_bit(unit, bit)
+        self._structure_bits &= ~bit
+        column[y] = units
+        structure = None
+        for unit in units:
+            if unit.stationary:
+                self.__set_structure_bit(unit, bit)
+                if structure is None:
+                    structure = unit
+        self.__structures[x][y] = structure
+
+    def __writable_column(self, x, y):
+        """Gets column x, copying it first if it is shared with a fork, and records the tile at [x, y]
+        in the undo log before the caller replaces it
+        """
+        column = self.__map[x]
+        if not self._owned_columns[x]:
+            column = self.__map[x] = list(column)
+            self.__structures[x] = list(self.__structures[x])
+            self._owned_columns[x] = 1
+        if self._undo_log is not None:
+            self._undo_log.append((x, y, column[y]))
+        return column
+
+    def _place_unit(self, unit):
+        """Adds an existing GameUnit to the map at its own location. Used when parsing the game state,
+        before the map can have been forked.
+        """
+        self.__map[unit.x][unit.y].append(unit)
+        if unit.stationary:
+            self.__set_structure_bit(unit, 1 << (unit.x * self.ARENA_SIZE + unit.y))
+            if self.__structures[unit.x][unit.y] is None:
+                self.__structures[unit.x][unit.y] = unit
+
+    def _add_units(self, x, y, units):
+        """Adds existing GameUnits to the end of [x, y]. Unlike _place_unit it works on forked maps and in a checkpoint,
+        and since the units may be on other maps too, they are copied before being changed in place.
+        """
+        self._set_tile(x, y, self.__map[x][y] + units)
+        self._owned_units &= ~(1 << (x * self.ARENA_SIZE + y))
+
+    def _structure_at(self, x, y):
+        """Gets the structure at [x, y], or None if there is none. x and y must be integers on the board.
+        """
+        return self.__structures[x][y]
+
+    def _occupied_tiles(self):
+        """Gets (x, y, units) for every location with units, in ascending x * ARENA_SIZE + y order.
+        The unit lists must not be changed.
+        """
+        return [(x, y, units) for x, column in enumerate(self.__map) for y, units in enumerate(column) if units]
+
+    def _writable_structure(self, x, y):
+        """Gets the structure at [x, y] so it can be changed in place, as by GameUnit.upgrade.
+        If the tile's units are shared with a fork, or a checkpoint is open, they are copied first
+        so the fork or a rollback sees the unchanged units. Each tile is copied once per fork.
+        A copy made in a checkpoint does not mark the tile as owned, as a rollback puts back the shared units.
+        """
+        bit = 1 << (x * self.ARENA_SIZE + y)
+        if not self._owned_units & bit or self._undo_log is not None:
+            self._set_tile(x, y, [copy.copy(unit) for unit in self.__map[x][y]])
+            if self._undo_log is None:
+                self._owned_units |= bit
+        return self.__structures[x][y]
+
+    def fork(self):
+        """Gets a copy of this map for trying out hypothetical changes
+
+        The copy shares its columns and units with this map until either map changes them,
+        so forking takes microseconds whatever the number of units. Changes made through
+        add_unit, remove_unit or game_map[x, y] = units only affect the map they are made on.
+
+        Returns:
+            A new GameMap with the same units
+
+        """
+        clone = GameMap.__new__(GameMap)
+        clone.__dict__.update(self.__dict__)
+        clone.__map = list(self.__map)
+        clone.__structures = list(self.__structures)
+        clone._player_bits = list(self._player_bits)
+        clone._type_bits = dict(self._type_bits)
+        clone._owned_columns = bytearray(self.ARENA_SIZE)
+        self._owned_columns = bytearray(self.ARENA_SIZE)
+        clone._owned_units = self._owned_units = 0
+        clone._undo_log = None
+        clone._checkpoint_depth = 0
+        return clone
+
+    def checkpoint(self):
+        """Starts recording changes to the map so they can be undone with rollback
+
+        Checkpoints can be nested, and must be closed with rollback or commit in the reverse order they were made.
+
+        Returns:
+            A token to pass to rollback or commit
+
+        """
+        if self._undo_log is None:
+            self._undo_log = []
+        self._checkpoint_depth += 1
+        return len(self._undo_log)
+
+    def rollback(self, token):
+        """Undoes every change made to the map since the checkpoint that returned token, in O(changes)
+
+        Args:
+            token: The value returned by checkpoint
+
+        """
+        log = self._undo_log
+        self._undo_log = None
+        while len(log) > token:
+            x, y, units = log.pop()
+            self._set_tile(x, y, units)
+        self.__close_checkpoint(log)
+
+    def commit(self, token):
+        """Keeps the changes made since the checkpoint that returned token. If it is nested in another
+        checkpoint, rolling back the outer checkpoint still undoes them.
+
+        Args:
+            token: The value returned by checkpoint
+
+        """
+        self.__close_checkpoint(self._undo_log)
+
+    def __close_checkpoint(self, log):
+        self._checkpoint_depth -= 1
+        self._undo_log = log if self._checkpoint_depth > 0 else None
+
+    def __set_structure_bit(self, unit, bit):
+        self._structure_bits |= bit
+        if unit.player_index in (0, 1):
+            self._player_bits[unit.player_index] |= bit
+            key = (unit.player_index, unit.unit_type)
+            self._type_bits[key] = self._type_bits.get(key, 0) | bit
+
+    def __clear_structure_bit(self, unit, bit):
+        if unit.player_index in (0, 1):
+            self._player_bits[unit.player_index] &= ~bit
+            key = (unit.player_index, unit.unit_type)
+            self._type_bits[key] = self._type_bits.get(key, 0) & ~bit
+
+    def structure_mask(self, player_index=None, unit_type=None):
+        """Gets the locations of structures as a bitmask
+
+        Args:
+            player_index: If given, only structures owned by this player, 0 for you 1 for the enemy
+            unit_type: If given, only structures of this type. Use the constants provided in algo_strategy.
+
+        Returns:
+            An integer where bit x * ARENA_SIZE + y is set if there is a matching structure at [x, y].
+            Two maps with the same structure layout return the same mask, so it can be used as a cache key.
+
+        """
+        if unit_type is not None:
+            if player_index is None:
+                return self._type_bits.get((0, unit_type), 0) | self._type_bits.get((1, unit_type), 0)
+            return self._type_bits.get((player_index, unit_type), 0)
+        if player_index is not None:
+            return self._player_bits[player_index]
+        return self._structure_bits
+
+    def region_mask(self, x_values=None, y_values=None):
+        """Gets a bitmask of the board locations in the given columns and rows, for use with count_structures
+
+        Args:
+            x_values: The x coordinates to include, or None for every column
+            y_values: The y coordinates to include, or None for every row
+
+        Returns:
+            An integer where bit x * ARENA_SIZE + y is set for every matching location on the board
+
+        """
+        mask = self._tables.full_mask
+        if x_values is not None:
+            columns = 0
+            for x in x_values:
+                if 0 <= x < self.ARENA_SIZE:
+                    columns |= self._tables.column_masks[x]
+            mask &= columns
+        if y_values is not None:
+            rows = 0
+            for y in y_values:
+                if 0 <= y < self.ARENA_SIZE:
+                    rows |= self._tables.row_masks[y]
+            mask &= rows
+        return mask
+
+    def locations_mask(self, locations):
+        """Gets a bitmask of the given locations, for use with count_structures. Locations off the board are skipped.
+        """
+        mask = 0
+        for location in locations:
+            if self.in_arena_bounds(location):
+                mask |= 1 << (location[0] * self.ARENA_SIZE + location[1])
+        return mask
+
+    def count_structures(self, player_index=None, unit_type=None, mask=None):
+        """Counts structures without scanning the map
+
+        Args:
+            player_index: If given, only count structures owned by this player, 0 for you 1 for the enemy
+            unit_type: If given, only count structures of this type
+            mask: If given, only count structures inside this bitmask, see region_mask and locations_mask
+
+        Returns:
+            The number of matching structures
+
+        """
+        structures = self.structure_mask(player_index, unit_type)
+        if mask is not None:
+            structures &= mask
+        return bin(structures).count("1")
+
     def _invalid_coordinates(self, location):
         self.warn("{} is out of bounds.".format(str(location)))
 
@@ -89,19 +445,7 @@ class GameMap:
         
         """
         x, y = location
-        half_board = self.HALF_ARENA
-
-        row_size = y + 1
-        startx = half_board - row_size
-        endx = startx + (2 * row_size) - 1
-        top_half_check = (y < self.HALF_ARENA and x >= startx and x <= endx)
-
-        row_size = (self.ARENA_SIZE - 1 - y) + 1
-        startx = half_board - row_size
-        endx = startx + (2 * row_size) - 1
-        bottom_half_check = (y >= self.HALF_ARENA and x >= startx and x <= endx)
-
-        return bottom_half_check or top_half_check
+        return (x, y) in self._tables.location_set
 
     def get_edge_locations(self, quadrant_description):
         """Takes in an edge description and returns a list of locations.
@@ -117,8 +461,7 @@ class GameMap:
             self.warn("Passed invalid quadrant_description '{}'. See the documentation for valid inputs for get_edge_locations.".format(quadrant_description))
             return
 
-        edges = self.get_edges()
-        return edges[quadrant_description]
+        return [[x, y] for x, y in self._tables.edges[quadrant_description]]
 
     def get_edges(self):
         """Gets all of the edges and their edge locations
@@ -127,27 +470,21 @@ class GameMap:
             A list with four lists inside of it of locations corresponding to the four edges.
             [0] = top_right, [1] = top_left, [2] = bottom_left, [3] = bottom_right.
         """
-        top_right = []
-        for num in range(0, self.HALF_ARENA):
-            x = self.HALF_ARENA + num
-            y = self.ARENA_SIZE - 1 - num
-            top_right.append([int(x), int(y)])
-        top_left = []
-        for num in range(0, self.HALF_ARENA):
-            x = self.HALF_ARENA - 1 - num
-            y = self.ARENA_SIZE - 1 - num
-            top_left.append([int(x), int(y)])
-        bottom_left = []
-        for num in range(0, self.HALF_ARENA):
-            x = self.HALF_ARENA - 1 - num
-            y = num
-            bottom_left.append([int(x), int(y)])
-        bottom_right = []
-        for num in range(0, self.HALF_ARENA):
-            x = self.HALF_ARENA + num
-            y = num
-            bottom_right.append([int(x), int(y)])
-        return [top_right, top_left, bottom_left, bottom_right]
+        return [[[x, y] for x, y in edge] for edge in self._tables.edges]
+
+    def is_on_edge(self, location, quadrant_description):
+        """Checks if a location is on one of the four edges
+
+        Args:
+            location: A map location
+            quadrant_description: A constant corresponding to one of the 4 edges. See game_map.TOP_LEFT, game_map.BOTTOM_RIGHT, and similar constants.
+
+        Returns:
+            True if the location is on the given edge, False otherwise
+
+        """
+        x, y = location
+        return (x, y) in self._tables.edge_sets[quadrant_description]
     
     def add_unit(self, unit_type, location, player_index=0):
         """Add a single GameUnit to the map at the given location.
@@ -163,15 +500,18 @@ class GameMap:
         """
         if not self.in_arena_bounds(location):
             self._invalid_coordinates(location)
+            return
         if player_index < 0 or player_index > 1:
             self.warn("Player index {} is invalid. Player index should be 0 or 1.".format(player_index))
 
         x, y = location
         new_unit = GameUnit(unit_type, self.config, player_index, None, location[0], location[1])
         if not new_unit.stationary:
-            self.__map[x][y].append(new_unit)
+            #Mobile units leave the structure masks unchanged
+            column = self.__writable_column(x, y)
+            column[y] = column[y] + [new_unit]
         else:
-            self.__map[x][y] = [new_unit]
+            self._set_tile(x, y, [new_unit])
 
     def remove_unit(self, location):
         """Remove all units on the map in the given location.
@@ -184,9 +524,10 @@ class GameMap:
         """
         if not self.in_arena_bounds(location):
             self._invalid_coordinates(location)
+            return
         
         x, y = location
-        self.__map[x][y] = []
+        self._set_tile(x, y, [])
 
     def get_locations_in_range(self, location, radius):
         """Gets locations in a circular area around a location
@@ -204,17 +545,28 @@ class GameMap:
         if not self.in_arena_bounds(location):
             self._invalid_coordinates(location)
 
+        return [[i, j] for i, j in self._locations_in_range(location, radius)]
+
+    def _locations_in_range(self, location, radius):
+        """get_locations_in_range without warnings, as a tuple of (x, y) tuples.
+        Results for integer locations on the board come from a shared cache built from range_offsets.
+        """
         x, y = location
-        locations = []
-        search_radius = math.ceil(radius)
-        getHitRadius = self.config["unitInformation"][0]['getHitRadius']
-        for i in range(int(x - search_radius), int(x + search_radius + 1)):
-            for j in range(int(y - search_radius), int(y + search_radius + 1)):
-                new_location = [i, j]
-                # A unit with a given range affects all locations who's centers are within that range + get hit radius
-                if self.in_arena_bounds(new_location) and self.distance_between_locations(location, new_location) < radius + getHitRadius:
-                    locations.append(new_location)
-        return locations
+        hit_radius = self.rules.hit_radius
+        if type(x) is not int or type(y) is not int:
+            locations = []
+            search_radius = math.ceil(radius)
+            for i in range(int(x - search_radius), int(x + search_radius + 1)):
+                for j in range(int(y - search_radius), int(y + search_radius + 1)):
+                    # A unit with a given range affects all locations who's centers are within that range + get hit radius
+                    if self.in_arena_bounds([i, j]) and self.distance_between_locations(location, [i, j]) < radius + hit_radius:
+                        locations.append((i, j))
+            return tuple(locations)
+
+        # Only cache locations on the board so bad input does not evict useful entries
+        if (x, y) in self._tables.location_set:
+            return _cached_range_locations(self.ARENA_SIZE, x, y, radius, hit_radius)
+        return _range_locations(self.ARENA_SIZE, x, y, radius, hit_radius)
 
     def distance_between_locations(self, location_1, location_2):
         """Euclidean distance
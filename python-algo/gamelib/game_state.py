@@ -1,21 +1,71 @@
 import math
 import json
 import sys
+import warnings
+from contextlib import contextmanager
 
-from .navigation import ShortestPathFinder
-from .util import send_command, debug_write
+from .navigation import ShortestPathFinder, PYTHON_ENGINE
+from .util import send_command, debug_write, decode_json
 from .unit import GameUnit
-from .game_map import GameMap
+from .game_map import GameMap, attack_offsets, range_offsets
+from .rules import compile_rules, recent_rules, SP, MP
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Once this many paths are cached the path cache is emptied
+PATH_CACHE_SIZE = 2048
+
+#The deprecated module level unit constants, see __getattr__
+DEPRECATED_NAMES = ("WALL", "SUPPORT", "TURRET", "SCOUT", "DEMOLISHER", "INTERCEPTOR", "REMOVE", "UPGRADE",
+    "STRUCTURE_TYPES", "ALL_UNITS", "UNIT_TYPE_TO_INDEX")
+
+def _deprecated_rules(name):
+    """Warns that a module level name is deprecated and gets the Rules it reads from, or None if no config is loaded"""
+    warnings.warn("game_state.{0} is deprecated, use GameState.rules.{0} instead".format(name), DeprecationWarning, stacklevel=3)
+    return recent_rules()
+
+def _no_rules_message(name):
+    return "game_state.{} needs the game config, but none has been loaded yet. Use GameState.rules instead".format(name)
 
 def is_stationary(unit_type):
     """
+    Deprecated, use GameState.rules.is_stationary, which follows that GameState's config.
+
         Args:
             unit_type: A unit type
         
         Returns: 
             Boolean, True if the unit is stationary, False otherwise.
+
+        Raises:
+            RuntimeError: If no config has been loaded yet
     """
-    return unit_type in STRUCTURE_TYPES
+    rules = _deprecated_rules("is_stationary")
+    if rules is None:
+        raise RuntimeError(_no_rules_message("is_stationary"))
+    return rules.is_stationary(unit_type)
+
+def __getattr__(name):
+    """
+    Provides the deprecated module level unit constants in DEPRECATED_NAMES for algos that import them from game_state.
+    They come from the most recently compiled config, so code should use GameState.rules instead.
+    Raises AttributeError if no config has been loaded yet.
+    """
+    if name not in DEPRECATED_NAMES:
+        raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+    rules = _deprecated_rules(name)
+    if rules is None:
+        raise AttributeError(_no_rules_message(name))
+    if name == "STRUCTURE_TYPES":
+        return [rules.WALL, rules.SUPPORT, rules.TURRET]
+    if name == "ALL_UNITS":
+        return [rules.SCOUT, rules.DEMOLISHER, rules.INTERCEPTOR, rules.WALL, rules.SUPPORT, rules.TURRET]
+    if name == "UNIT_TYPE_TO_INDEX":
+        return {unit_type: i for i, unit_type in enumerate(rules.unit_types[:8])}
+    return getattr(rules, name)
 
 class GameState:
     """Represents the entire gamestate for a given turn
@@ -38,72 +88,104 @@ class GameState:
         * MP (int): A constant representing the Mobile Points resource, used in the get_resource function
         * SP (int): A constant representing the SP resource, used in the get_resource function
          
-        * game_map (:obj: GameMap): The current GameMap. To retrieve a list of GameUnits at a location, use game_map[x, y]
+        * rules (:obj: Rules): The rules compiled from config, shared with every GameState for the same config
+        * game_map (:obj: GameMap): The current GameMap. To retrieve a list of GameUnits at a location, use game_map[x, y].
+          In a lazy GameState, the units are parsed the first time game_map is used.
         * turn_number (int): The current turn number. Starts at 0.
         * my_health (int): Your current remaining health
         * my_time (int): The time you took to submit your previous turn
         * enemy_health (int): Your opponents current remaining health
         * enemy_time (int): Your opponents current remaining time
+        * path_cache_hits (int): The number of find_path_to_edge calls answered from the path cache
+        * path_cache_misses (int): The number of find_path_to_edge calls that had to run the pathfinder
 
     """
 
-    def __init__(self, config, serialized_string):
+    def __init__(self, config, serialized_string, pathing_engine=PYTHON_ENGINE, lazy=False):
         """ Setup a turns variables using arguments passed
 
         Args:
             * config (JSON): A json object containing information about the game
-            * serialized_string (string): A string containing information about the game state at the start of this turn
+            * serialized_string (string): A string containing information about the game state at the start of this turn,
+              or the dict it decodes to, as passed to on_turn when AlgoCore.decoded_messages is set.
+              The serialized_string attribute is always a string, encoded from the dict the first time it is read.
+            * pathing_engine (string): The engine used by find_path_to_edge. navigation.PYTHON_ENGINE, or navigation.NUMPY_ENGINE
+              to expand the search a whole level at a time on bitmasks, about twice as fast. Falls back to python if NumPy is not installed.
+            * lazy (bool): If true, only turn info, health and resources are parsed here. Units are parsed the first time
+              game_map or a function that looks at the map is used, or one player at a time with load_units.
 
         """
-        self.serialized_string = serialized_string
+        self._serialized_string = None if isinstance(serialized_string, dict) else serialized_string
+        self._decoded_state = serialized_string if isinstance(serialized_string, dict) else None
         self.config = config
         self.enable_warnings = True
 
-        global WALL, SUPPORT, TURRET, SCOUT, DEMOLISHER, INTERCEPTOR, REMOVE, UPGRADE, STRUCTURE_TYPES, ALL_UNITS, UNIT_TYPE_TO_INDEX
-        UNIT_TYPE_TO_INDEX = {}
-        WALL = config["unitInformation"][0]["shorthand"]
-        UNIT_TYPE_TO_INDEX[WALL] = 0
-        SUPPORT = config["unitInformation"][1]["shorthand"]
-        UNIT_TYPE_TO_INDEX[SUPPORT] = 1
-        TURRET = config["unitInformation"][2]["shorthand"]
-        UNIT_TYPE_TO_INDEX[TURRET] = 2
-        SCOUT = config["unitInformation"][3]["shorthand"]
-        UNIT_TYPE_TO_INDEX[SCOUT] = 3
-        DEMOLISHER = config["unitInformation"][4]["shorthand"]
-        UNIT_TYPE_TO_INDEX[DEMOLISHER] = 4
-        INTERCEPTOR = config["unitInformation"][5]["shorthand"]
-        UNIT_TYPE_TO_INDEX[INTERCEPTOR] = 5
-        REMOVE = config["unitInformation"][6]["shorthand"]
-        UNIT_TYPE_TO_INDEX[REMOVE] = 6
-        UPGRADE = config["unitInformation"][7]["shorthand"]
-        UNIT_TYPE_TO_INDEX[UPGRADE] = 7
-
-        ALL_UNITS = [SCOUT, DEMOLISHER, INTERCEPTOR, WALL, SUPPORT, TURRET]
-        STRUCTURE_TYPES = [WALL, SUPPORT, TURRET]
+        self.rules = compile_rules(config)
 
         self.ARENA_SIZE = 28
         self.HALF_ARENA = int(self.ARENA_SIZE / 2)
         self.MP = 1
         self.SP = 0
-        global MP, SP
-        MP = self.MP
-        SP = self.SP
 
-        self.game_map = GameMap(self.config)
-        self._shortest_path_finder = ShortestPathFinder()
+        self._game_map = GameMap(self.config)
+        self._unparsed_units = [None, None]
+        self._units_pending = False
+        self._shortest_path_finder = ShortestPathFinder(engine=pathing_engine)
+        self._path_cache = {}
+        self.path_cache_hits = 0
+        self.path_cache_misses = 0
         self._build_stack = []
         self._deploy_stack = []
         self._player_resources = [
                 {'SP': 0, 'MP': 0},  # player 0, which is you
                 {'SP': 0, 'MP': 0}]  # player 1, which is the opponent
-        self.__parse_state(serialized_string)
+        self.__parse_state(serialized_string, lazy)
+
+    @property
+    def serialized_string(self):
+        if self._serialized_string is None:
+            self._serialized_string = json.dumps(self._decoded_state)
+        return self._serialized_string
+
+    @property
+    def game_map(self):
+        if self._units_pending:
+            self.load_units()
+        return self._game_map
+
+    @game_map.setter
+    def game_map(self, game_map):
+        self._game_map = game_map
+        self._unparsed_units = [None, None]
+        self._units_pending = False
+
+    def load_units(self, player_index=None):
+        """Parses units that a lazy GameState has not parsed yet. Does nothing for units already parsed.
+
+        Loading only the enemy's units is enough for questions about the enemy's structures,
+        but units on a tile are then listed in the order the players were loaded.
+
+        Args:
+            player_index: If given, only parse this player's units, 0 for you 1 for the enemy
+
+        Returns:
+            The GameMap, without parsing the other player's units
 
-    def __parse_state(self, state_line):
+        """
+        for index in ((0, 1) if player_index is None else (player_index,)):
+            units = self._unparsed_units[index]
+            if units is not None:
+                self._unparsed_units[index] = None
+                self.__create_parsed_units(units, index)
+        self._units_pending = self._unparsed_units[0] is not None or self._unparsed_units[1] is not None
+        return self._game_map
+
+    def __parse_state(self, state_line, lazy=False):
         """
         Fills in map based on the serialized game state so that self.game_map[x,y] is a list of GameUnits at that location.
-        state_line is the game state as a json string.
+        state_line is the game state as a json string or an already decoded dict. If lazy, the units are kept for load_units instead.
         """
-        state = json.loads(state_line)
+        state = state_line if isinstance(state_line, dict) else decode_json(state_line)
 
         turn_info = state["turnInfo"]
         self.turn_number = int(turn_info[1])
@@ -123,14 +205,18 @@ class GameState:
         p1units = state["p1Units"]
         p2units = state["p2Units"]
 
-        self.__create_parsed_units(p1units, 0)
-        self.__create_parsed_units(p2units, 1)
+        self._unparsed_units = [p1units, p2units]
+        self._units_pending = True
+        if not lazy:
+            self.load_units()
 
     def __create_parsed_units(self, units, player_number):
         """
         Helper function for __parse_state to add units to the map.
         """
         typedef = self.config.get("unitInformation")
+        game_map = self._game_map
+        rules = self.rules
         for i, unit_types in enumerate(units):
             for uinfo in unit_types:
                 unit_type = typedef[i].get("shorthand")
@@ -138,19 +224,28 @@ class GameState:
                 x, y = map(int, [sx, sy])
                 hp = float(shp)
                 # This depends on RM and UP always being the last types to be processed
-                if unit_type == REMOVE:
+                if unit_type == rules.REMOVE:
                     # Quick fix will deploy engine fix soon
-                    if self.contains_stationary_unit([x,y]):
-                        self.game_map[x,y][0].pending_removal = True
-                elif unit_type == UPGRADE:
-                    if self.contains_stationary_unit([x,y]):
-                        self.game_map[x,y][0].upgrade()
+                    if self.__parsed_structure_at(x, y):
+                        game_map[x,y][0].pending_removal = True
+                elif unit_type == rules.UPGRADE:
+                    if self.__parsed_structure_at(x, y):
+                        game_map[x,y][0].upgrade()
                 else:
                     unit = GameUnit(unit_type, self.config, player_number, hp, x, y)
-                    self.game_map[x,y].append(unit)
+                    game_map._place_unit(unit)
+
+    def __parsed_structure_at(self, x, y):
+        """
+        contains_stationary_unit for __create_parsed_units, which must not trigger load_units.
+        """
+        if not self._game_map.in_arena_bounds([x, y]):
+            self.warn('Checked for stationary unit outside of arena bounds')
+            return False
+        return any(unit.stationary for unit in self._game_map[x, y])
 
     def __resource_required(self, unit_type):
-        return self.SP if is_stationary(unit_type) else self.MP
+        return self.SP if self.rules.is_stationary(unit_type) else self.MP
 
     def __set_resource(self, resource_type, amount, player_index=0):
         """
@@ -180,6 +275,93 @@ class GameState:
         send_command(build_string)
         send_command(deploy_string)
 
+    def fork(self, share_pathfinder=False):
+        """Gets a copy of this game state for trying out hypothetical turns
+
+        Much cheaper than copy.deepcopy. The copy's map shares units with this one until either
+        changes them (see GameMap.fork), and resources and the build and deploy stacks are copied,
+        so spawning, upgrading and editing the map on the copy leave this state unchanged.
+        The config, rules and path cache are shared, and are safe to share because
+        cached paths are keyed by structure layout.
+
+        Args:
+            share_pathfinder: If true, the copy shares this state's pathfinder, saving its setup when many forks are
+                searched one after another. A pathfinder holds the scratch state of its search, so shared pathfinders
+                are not safe to use concurrently; only share one between forks used from the same thread.
+
+        Returns:
+            A new GameState for the same turn
+
+        """
+        clone = GameState.__new__(GameState)
+        clone.__dict__.update(self.__dict__)
+        if not share_pathfinder:
+            clone._shortest_path_finder = ShortestPathFinder(self._shortest_path_finder.incremental, self._shortest_path_finder.engine)
+        clone.game_map = self.game_map.fork()
+        clone._build_stack = list(self._build_stack)
+        clone._deploy_stack = list(self._deploy_stack)
+        clone._player_resources = [dict(resources) for resources in self._player_resources]
+        return clone
+
+    def checkpoint(self):
+        """Starts recording changes so they can be undone with rollback. Covers the map, including
+        changes from game_map.add_unit and remove_unit, resources, upgrades and the build and deploy stacks.
+
+        Checkpoints can be nested, and must be closed with rollback or commit in the reverse order they were made.
+
+        Returns:
+            A token to pass to rollback or commit
+
+        """
+        resources = [dict(player_resources) for player_resources in self._player_resources]
+        return (self.game_map.checkpoint(), len(self._build_stack), len(self._deploy_stack), resources)
+
+    def rollback(self, token):
+        """Undoes every change made since the checkpoint that returned token, in O(changes)
+
+        Args:
+            token: The value returned by checkpoint
+
+        """
+        map_token, build_length, deploy_length, resources = token
+        self.game_map.rollback(map_token)
+        del self._build_stack[build_length:]
+        del self._deploy_stack[deploy_length:]
+        self._player_resources = [dict(player_resources) for player_resources in resources]
+
+    def commit(self, token):
+        """Keeps the changes made since the checkpoint that returned token
+
+        Args:
+            token: The value returned by checkpoint
+
+        """
+        self.game_map.commit(token[0])
+
+    @contextmanager
+    def transaction(self, rollback=True):
+        """Context manager around checkpoint, for trying out changes::
+
+            with game_state.transaction():
+                game_state.attempt_spawn(WALL, [13, 10])
+                damage = evaluate(game_state)
+
+        Args:
+            rollback: If true, changes are always undone when the block exits. If false, they are
+                kept unless the block raises an exception.
+
+        """
+        token = self.checkpoint()
+        try:
+            yield token
+        except BaseException:
+            self.rollback(token)
+            raise
+        if rollback:
+            self.rollback(token)
+        else:
+            self.commit(token)
+
     def get_resource(self, resource_type, player_index = 0):
         """Gets a players resources
 
@@ -234,11 +416,13 @@ class GameState:
             The number of units affordable of the given unit_type.
 
         """
-        if unit_type not in ALL_UNITS:
+        if unit_type not in self.rules.ALL_UNITS:
             self._invalid_unit(unit_type)
             return
 
-        costs = self.type_cost(unit_type)
+        return self.__number_affordable(self.rules.costs[unit_type])
+
+    def __number_affordable(self, costs):
         player_held = self.get_resources()
         if costs[MP] > 0 and costs[SP] > 0:
             return min(math.floor(player_held[SP] / costs[SP]), math.floor(player_held[MP] / costs[MP]))
@@ -271,16 +455,38 @@ class GameState:
             self.warn("Invalid current MP ({}). Current MP cannot be negative.".format(current_MP))
 
         MP = self.get_resource(self.MP, player_index) if not current_MP else current_MP
-        for increment in range(1, turns_in_future + 1):
-            current_turn = self.turn_number + increment
-            MP *= (1 - self.config["resources"]["bitDecayPerRound"])
-            MP_per_round = self.config["resources"]["bitsPerRound"]
-            MP_ramp_ups = current_turn // self.config["resources"]["turnIntervalForBitSchedule"]
-            MP_per_round_growth = self.config["resources"]["bitGrowthRate"]
-            MP_gained = MP_per_round + (MP_per_round_growth * MP_ramp_ups)
-            MP += MP_gained
-            MP = round(MP, 1)
-        return MP
+        return self.__project_MP(MP, turns_in_future)[-1] if turns_in_future >= 1 else MP
+
+    def project_future_MP_horizon(self, turns_in_future=10, current_MP=None):
+        """Predicts the MP both players will have on each of the next turns, in one call
+
+        Uses the same decay and rounding as project_future_MP, so entry [player_index][turns - 1] equals
+        project_future_MP(turns, player_index).
+
+        Args:
+            turns_in_future: The number of turns to predict
+            current_MP: If given, a [your MP, enemy MP] list to use instead of the players' current MP
+
+        Returns:
+            A list with a list for each player of the MP they will have after 1, 2, ... turns_in_future turns
+
+        """
+        if turns_in_future < 1 or turns_in_future > 99:
+            self.warn("Invalid turns in future used ({}). Turns in future should be between 1 and 99".format(turns_in_future))
+        projections = []
+        for player_index in (0, 1):
+            MP = current_MP[player_index] if current_MP and current_MP[player_index] else self._player_resources[player_index]['MP']
+            projections.append(self.__project_MP(MP, turns_in_future))
+        return projections
+
+    def __project_MP(self, MP, turns_in_future):
+        decay = 1 - self.rules.mp_decay
+        mp_income = self.rules.mp_income
+        projection = []
+        for current_turn in range(self.turn_number + 1, self.turn_number + turns_in_future + 1):
+            MP = round(MP * decay + mp_income(current_turn), 1)
+            projection.append(MP)
+        return projection
 
     def type_cost(self, unit_type, upgrade=False):
         """Gets the cost of a unit based on its type
@@ -292,16 +498,13 @@ class GameState:
             The units costs as a list [SP, MP]
 
         """
-        if unit_type == REMOVE:
+        if unit_type == self.rules.REMOVE:
             self._invalid_unit(unit_type)
             return
-        
-        unit_def = self.config["unitInformation"][UNIT_TYPE_TO_INDEX[unit_type]]
-        cost_base = [unit_def.get('cost1', 0), unit_def.get('cost2', 0)]
-        if upgrade:
-            return [unit_def.get('upgrade', {}).get('cost1', cost_base[SP]), unit_def.get('upgrade', {}).get('cost2', cost_base[MP])]
 
-        return cost_base
+        if upgrade:
+            return list(self.rules.upgrade_costs[unit_type])
+        return list(self.rules.costs[unit_type])
 
 
     def can_spawn(self, unit_type, location, num=1):
@@ -320,7 +523,8 @@ class GameState:
             True if we can spawn the unit(s)
 
         """
-        if unit_type not in ALL_UNITS:
+        rules = self.rules
+        if unit_type not in rules.ALL_UNITS:
             self._invalid_unit(unit_type)
             return
         
@@ -329,11 +533,12 @@ class GameState:
                 self.warn("Could not spawn {} at location {}. Location invalid.".format(unit_type, location))
             return False
 
-        affordable = self.number_affordable(unit_type) >= num
-        stationary = is_stationary(unit_type)
-        blocked = self.contains_stationary_unit(location) or (stationary and len(self.game_map[location[0],location[1]]) > 0)
+        affordable = self.__number_affordable(rules.costs[unit_type]) >= num
+        stationary = unit_type in rules.STRUCTURE_TYPES
+        x, y = int(location[0]), int(location[1])
+        blocked = self.game_map._structure_at(x, y) is not None or (stationary and len(self.game_map[x, y]) > 0)
         correct_territory = location[1] < self.HALF_ARENA
-        on_edge = location in (self.game_map.get_edge_locations(self.game_map.BOTTOM_LEFT) + self.game_map.get_edge_locations(self.game_map.BOTTOM_RIGHT))
+        on_edge = (location[0], location[1]) in rules.spawn_locations
 
         if self.enable_warnings:
             fail_reason = ""
@@ -364,7 +569,7 @@ class GameState:
             The number of units successfully spawned
 
         """
-        if unit_type not in ALL_UNITS:
+        if unit_type not in self.rules.ALL_UNITS:
             self._invalid_unit(unit_type)
             return
         if num < 1 or not locations:
@@ -375,22 +580,60 @@ class GameState:
             locations = [locations]
         spawned_units = 0
         for location in locations:
-            for i in range(num):
-                if self.can_spawn(unit_type, location, 1):
-                    x, y = map(int, location)
-                    costs = self.type_cost(unit_type)
-                    self.__set_resource(SP, 0 - costs[SP])
-                    self.__set_resource(MP, 0 - costs[MP])
-                    self.game_map.add_unit(unit_type, location, 0)
-                    if is_stationary(unit_type):
-                        self._build_stack.append((unit_type, x, y))
-                    else:
-                        self._deploy_stack.append((unit_type, x, y))
-                    spawned_units += 1
-                else:
-                    break
+            spawned_units += self.__spawn_at(unit_type, location, num)
         return spawned_units
 
+    def attempt_spawn_many(self, spawns):
+        """Attempts many spawns in one call, such as a whole wall template or several scout stacks.
+        Equivalent to calling attempt_spawn for each entry in order, with less overhead per unit.
+
+        Args:
+            spawns: A list of (unit_type, location, num) entries. num can be left out to spawn one unit.
+
+        Returns:
+            A list with the number of units successfully spawned for each entry
+
+        """
+        spawned = []
+        for spawn in spawns:
+            unit_type, location = spawn[0], spawn[1]
+            num = spawn[2] if len(spawn) > 2 else 1
+            if unit_type not in self.rules.ALL_UNITS:
+                self._invalid_unit(unit_type)
+                spawned.append(0)
+            elif num < 1:
+                self.warn("Attempted to spawn fewer than one units! ({})".format(num))
+                spawned.append(0)
+            else:
+                spawned.append(self.__spawn_at(unit_type, location, num))
+        return spawned
+
+    def __spawn_at(self, unit_type, location, num):
+        """
+        Spawns up to num units of a valid unit_type at one location. The location is checked once, then units are
+        charged for one at a time while they can be afforded, so fractional costs round as they did unit by unit.
+        Structures can not stack, so at most one is spawned.
+        """
+        if not self.can_spawn(unit_type, location, 1):
+            return 0
+        stationary = unit_type in self.rules.STRUCTURE_TYPES
+        costs = self.rules.costs[unit_type]
+        spawned = 0
+        while spawned < num:
+            if spawned and (stationary or self.__number_affordable(costs) < 1):
+                break
+            self.__set_resource(SP, 0 - costs[SP])
+            self.__set_resource(MP, 0 - costs[MP])
+            spawned += 1
+        if spawned < num and self.enable_warnings:
+            reason = "Location is blocked." if stationary else "Not enough resources."
+            self.warn("Could not spawn {} at location {}. {}".format(unit_type, location, reason))
+        x, y = map(int, location)
+        for _ in range(spawned):
+            self.game_map.add_unit(unit_type, location, 0)
+        (self._build_stack if stationary else self._deploy_stack).extend([(unit_type, x, y)] * spawned)
+        return spawned
+
     def attempt_remove(self, locations):
         """Attempts to remove existing friendly structures in the given locations.
 
@@ -406,13 +649,34 @@ class GameState:
         removed_units = 0
         for location in locations:
             if location[1] < self.HALF_ARENA and self.contains_stationary_unit(location):
-                x, y = map(int, location)
-                self._build_stack.append((REMOVE, x, y))
+                self.__remove_at(location)
                 removed_units += 1
             else:
                 self.warn("Could not remove a unit from {}. Location has no structures or is enemy territory.".format(location))
         return removed_units
 
+    def attempt_remove_many(self, locations):
+        """Attempts to remove existing friendly structures in the given locations, without a warning per location
+
+        Args:
+            locations: A list of locations we want to remove structures from
+
+        Returns:
+            A list with True for each location whose structure was flagged for removal, and False otherwise
+
+        """
+        removed = [self.__friendly_structure_at(location) is not None for location in locations]
+        for location, is_removed in zip(locations, removed):
+            if is_removed:
+                self.__remove_at(location)
+        if not all(removed):
+            self.warn("Could not remove units from {} of {} locations.".format(removed.count(False), len(locations)))
+        return removed
+
+    def __remove_at(self, location):
+        x, y = map(int, location)
+        self._build_stack.append((self.rules.REMOVE, x, y))
+
     def attempt_upgrade(self, locations):
         """Attempts to upgrade units in the given locations.
 
@@ -433,25 +697,53 @@ class GameState:
         spawned_units = 0
         for location in locations:
             if location[1] < self.HALF_ARENA and self.contains_stationary_unit(location):
-                x, y = map(int, location)
-                existing_unit = None
-                for unit in self.game_map[x,y]:
-                    if unit.stationary:
-                        existing_unit = unit
-
-                if not existing_unit.upgraded and self.config["unitInformation"][UNIT_TYPE_TO_INDEX[existing_unit.unit_type]].get("upgrade", None) is not None:
-                    costs = self.type_cost(existing_unit.unit_type, True)
-                    resources = self.get_resources()
-                    if resources[SP] >= costs[SP] and resources[MP] >= costs[MP]:
-                        self.__set_resource(SP, 0 - costs[SP])
-                        self.__set_resource(MP, 0 - costs[MP])
-                        existing_unit.upgrade()
-                        self._build_stack.append((UPGRADE, x, y))
-                        spawned_units += 1
+                if self.__upgrade_at(location):
+                    spawned_units += 1
             else:
                 self.warn("Could not upgrade a unit from {}. Location has no structures or is enemy territory.".format(location))
         return spawned_units
 
+    def attempt_upgrade_many(self, locations):
+        """Attempts to upgrade units in the given locations, without a warning per location
+
+        Args:
+            locations: A list of locations to upgrade units at
+
+        Returns:
+            A list with True for each location whose unit was upgraded, and False otherwise
+
+        """
+        upgraded = [self.__friendly_structure_at(location) is not None and self.__upgrade_at(location) for location in locations]
+        if not all(upgraded):
+            self.warn("Could not upgrade units at {} of {} locations.".format(upgraded.count(False), len(locations)))
+        return upgraded
+
+    def __upgrade_at(self, location):
+        """
+        Upgrades the structure at a location on your side of the map if it can be upgraded and you can afford it.
+        """
+        x, y = map(int, location)
+        existing_unit = self.game_map._structure_at(x, y)
+        if existing_unit.upgraded or existing_unit.unit_type not in self.rules.UPGRADABLE_TYPES:
+            return False
+        costs = self.rules.upgrade_costs[existing_unit.unit_type]
+        resources = self._player_resources[0]
+        if resources['SP'] >= costs[SP] and resources['MP'] >= costs[MP]:
+            resources['SP'] = resources['SP'] - costs[SP]
+            resources['MP'] = resources['MP'] - costs[MP]
+            self.game_map._writable_structure(x, y).upgrade()
+            self._build_stack.append((self.rules.UPGRADE, x, y))
+            return True
+        return False
+
+    def __friendly_structure_at(self, location):
+        """
+        Gets the structure at a location on your side of the map without warnings, or None.
+        """
+        if location[1] >= self.HALF_ARENA or not self.game_map.in_arena_bounds(location):
+            return None
+        return self.game_map._structure_at(int(location[0]), int(location[1]))
+
     def get_target_edge(self, start_location):
         """Gets the target edge given a starting location
 
@@ -487,6 +779,9 @@ class GameState:
             A list of locations corresponding to the path the unit would take 
             to get from it's starting location to the best available end location
 
+        Paths are cached by structure layout, start location and target edge. Placing or removing
+        a structure changes the layout, so a cached path is never returned for a different layout.
+
         """
         if self.contains_stationary_unit(start_location):
             self.warn("Attempted to perform pathing from blocked starting location {}".format(start_location))
@@ -495,8 +790,70 @@ class GameState:
         if target_edge is None:
             target_edge = self.get_target_edge(start_location)
 
+        key = (self.game_map.structure_mask(), start_location[0], start_location[1], target_edge)
+        cached_path = self._path_cache.get(key)
+        if cached_path is not None:
+            self.path_cache_hits += 1
+            return [list(location) for location in cached_path]
+
+        self.path_cache_misses += 1
         end_points = self.game_map.get_edge_locations(target_edge)
-        return self._shortest_path_finder.navigate_multiple_endpoints(start_location, end_points, self)
+        path = self._shortest_path_finder.navigate_multiple_endpoints(start_location, end_points, self)
+        self.__cache_path(key, path)
+        return path
+
+    def find_paths_to_edge_many(self, start_locations=None, target_edge=None, player_index=0):
+        """Gets the paths units at many locations would take, sharing work between them.
+        Equivalent to calling find_path_to_edge for each location, but much faster.
+
+        Args:
+            start_locations: A list of locations of hypothetical units. If None, every spawn location on player_index's edges is used.
+            target_edge: The edge the units want to reach. Induced from each start location if None.
+            player_index: The player whose spawn locations are used when start_locations is None, 0 for you 1 for the enemy
+
+        Returns:
+            A list with the path for each start location, in the same order as start_locations.
+            Blocked start locations get None.
+
+        """
+        if start_locations is None:
+            if player_index == 0:
+                spawn_edges = [self.game_map.BOTTOM_LEFT, self.game_map.BOTTOM_RIGHT]
+            else:
+                spawn_edges = [self.game_map.TOP_LEFT, self.game_map.TOP_RIGHT]
+            start_locations = [location for edge in spawn_edges for location in self.game_map.get_edge_locations(edge)]
+
+        paths = [None] * len(start_locations)
+        structure_mask = self.game_map.structure_mask()
+        pending = {}
+        for i, location in enumerate(start_locations):
+            if self.contains_stationary_unit(location):
+                continue
+            edge = target_edge if target_edge is not None else self.get_target_edge(location)
+            key = (structure_mask, location[0], location[1], edge)
+            cached_path = self._path_cache.get(key)
+            if cached_path is not None:
+                self.path_cache_hits += 1
+                paths[i] = [list(step) for step in cached_path]
+            else:
+                self.path_cache_misses += 1
+                pending.setdefault(edge, []).append((i, key, location))
+
+        #Starts heading to the same edge share the pathfinder's distance field
+        for edge, entries in pending.items():
+            end_points = self.game_map.get_edge_locations(edge)
+            found = self._shortest_path_finder.navigate_many([location for _, _, location in entries], end_points, self)
+            for (i, key, _), path in zip(entries, found):
+                self.__cache_path(key, path)
+                paths[i] = path
+        return paths
+
+    def __cache_path(self, key, path):
+        if path is None:
+            return
+        if len(self._path_cache) >= PATH_CACHE_SIZE:
+            self._path_cache.clear()
+        self._path_cache[key] = tuple(tuple(location) for location in path)
 
     def contains_stationary_unit(self, location):
         """Check if a location is blocked, return structures unit if it is
@@ -512,10 +869,8 @@ class GameState:
             self.warn('Checked for stationary unit outside of arena bounds')
             return False
         x, y = map(int, location)
-        for unit in self.game_map[x,y]:
-            if unit.stationary:
-                return unit
-        return False
+        structure = self.game_map._structure_at(x, y)
+        return structure if structure is not None else False
 
     def warn(self, message):
         """ Used internally by game_state to print warnings
@@ -524,6 +879,19 @@ class GameState:
         if(self.enable_warnings):
             debug_write(message)
 
+    def enable_incremental_pathing(self, enable=True):
+        """Keep the pathfinder's distance field between find_path_to_edge calls
+
+        When only a few structures change between calls, as when trying wall placements one at a time
+        with game_map.add_unit, the previous distance field is repaired instead of recomputed.
+        Paths are the same either way.
+
+        Args:
+            enable: If true, enable incremental pathing. If false, disable it.
+
+        """
+        self._shortest_path_finder.incremental = enable
+
     def suppress_warnings(self, suppress):
         """Suppress all warnings
 
@@ -533,7 +901,7 @@ class GameState:
         """
 
         self.enable_warnings = not suppress
-        self.game_map.enable_warnings = not suppress
+        self._game_map.enable_warnings = not suppress
 
     def get_target(self, attacking_unit):
         """Returns target of given unit based on current map of the game board. 
@@ -555,7 +923,7 @@ class GameState:
             return
 
         attacker_location = [attacking_unit.x, attacking_unit.y]
-        possible_locations = self.game_map.get_locations_in_range(attacker_location, attacking_unit.attackRange)
+        possible_locations = self.game_map._locations_in_range(attacker_location, attacking_unit.attackRange)
         target = None
         target_stationary = True
         target_distance = sys.maxsize
@@ -565,7 +933,7 @@ class GameState:
 
         for location in possible_locations:
             for unit in self.game_map[location]:
-                if unit.player_index == attacking_unit.player_index or (attacking_unit.damage_f == 0 and is_stationary(unit.unit_type)) or (attacking_unit.damage_i == 0 and not(is_stationary(unit.unit_type))):
+                if unit.player_index == attacking_unit.player_index or (attacking_unit.damage_f == 0 and unit.stationary) or (attacking_unit.damage_i == 0 and not unit.stationary):
                     continue
 
                 new_target = False
@@ -614,6 +982,65 @@ class GameState:
                     target_x_distance = unit_x_distance
         return target
 
+    def get_targets(self, player_index=None):
+        """Gets the target of every unit that can attack, in one pass over the map.
+        Picks the same targets as calling get_target for each unit, including how ties are broken.
+
+        Args:
+            player_index: If given, only get targets for units controlled by this player, 0 for you 1 for the enemy
+
+        Returns:
+            A list of (attacking unit, target) pairs, with attackers ordered by x and then y.
+            The target is None if the attacker has nothing to attack.
+
+        """
+        if player_index is not None and not player_index == 0 and not player_index == 1:
+            self._invalid_player_index(player_index)
+            return
+
+        size = self.ARENA_SIZE
+        hit_radius = self.rules.hit_radius
+        center_x = self.HALF_ARENA - 0.5
+        occupied = self.game_map._occupied_tiles()
+        tiles = {x * size + y: units for x, y, units in occupied}
+        #Maps an attack range to its offsets, as (dx, dy, flat offset, squared distance), and the set of (dx, dy)
+        range_tables = {}
+        targets = []
+        for x, y, units in occupied:
+            for attacker in units:
+                if attacker.damage_i + attacker.damage_f <= 0 or (player_index is not None and attacker.player_index != player_index):
+                    continue
+                table = range_tables.get(attacker.attackRange)
+                if table is None:
+                    offsets = range_offsets(attacker.attackRange, hit_radius)
+                    table = range_tables[attacker.attackRange] = (
+                        [(dx, dy, dx * size + dy, dx * dx + dy * dy) for dx, dy in offsets], frozenset(offsets))
+                offsets, offset_set = table
+
+                #Candidate tiles in ascending flat index order, the order get_target visits them in
+                flat = x * size + y
+                if len(occupied) < len(offsets):
+                    candidates = [(tile_units, (tx - x) ** 2 + (ty - y) ** 2) for tx, ty, tile_units in occupied if (tx - x, ty - y) in offset_set]
+                else:
+                    candidates = [(tiles[flat + offset], distance) for dx, dy, offset, distance in offsets
+                        if 0 <= x + dx < size and 0 <= y + dy < size and flat + offset in tiles]
+
+                #get_target keeps the first unit with the lowest (stationary, distance, health, y, -x distance),
+                #with y negated for player 1. Squared distances order the same as distances.
+                target = None
+                best = None
+                y_sign = 1 if attacker.player_index == 0 else -1
+                for candidate_units, distance in candidates:
+                    for unit in candidate_units:
+                        if unit.player_index == attacker.player_index or (attacker.damage_f == 0 and unit.stationary) or (attacker.damage_i == 0 and not unit.stationary):
+                            continue
+                        key = (unit.stationary, distance, unit.health, y_sign * unit.y, -abs(center_x - unit.x))
+                        if best is None or key < best:
+                            target = unit
+                            best = key
+                targets.append((attacker, target))
+        return targets
+
     def get_attackers(self, location, player_index):
         """Gets the stationary units threatening a given location
 
@@ -635,13 +1062,67 @@ class GameState:
         """
         Get locations in the range of TURRET units
         """
-        max_range = 0
-        for unit in self.config["unitInformation"]:
-            if unit.get('attackRange', 0) >= max_range:
-                max_range = unit.get('attackRange', 0)
-        possible_locations= self.game_map.get_locations_in_range(location, max_range)
+        possible_locations = self.game_map._locations_in_range(location, self.rules.max_attack_range)
         for location_unit in possible_locations:
             for unit in self.game_map[location_unit]:
                 if unit.damage_i + unit.damage_f > 0 and unit.player_index != player_index and self.game_map.distance_between_locations(location, location_unit) <= unit.attackRange:
                     attackers.append(unit)
         return attackers
+
+    def threat_map(self, player_index, as_numpy=False):
+        """Gets the damage per frame the given player's mobile units would take at every location
+
+        Computed in one pass over the opposing player's structures, adding each structure's current
+        damage_i to the precomputed offsets within its attackRange (so upgrades are included).
+        The damage a unit takes along a path is sum(threat[x][y] for x, y in path).
+
+        Args:
+            player_index: The index corresponding to the defending player, 0 for you 1 for the enemy
+            as_numpy: If true, return an ARENA_SIZE x ARENA_SIZE NumPy array of floats. Requires NumPy.
+
+        Returns:
+            An ARENA_SIZE x ARENA_SIZE list of lists indexed as threat[x][y]. Locations off the board are 0.
+
+        """
+        return self.__threat_map(player_index, "damage_i", as_numpy)
+
+    def structure_threat_map(self, player_index, as_numpy=False):
+        """Gets the damage per frame the given player's structures would take at every location
+        from the opposing player's structures, using damage_f. See threat_map.
+
+        Args:
+            player_index: The index corresponding to the defending player, 0 for you 1 for the enemy
+            as_numpy: If true, return a NumPy array. Requires NumPy.
+
+        Returns:
+            An ARENA_SIZE x ARENA_SIZE list of lists indexed as threat[x][y]
+
+        """
+        return self.__threat_map(player_index, "damage_f", as_numpy)
+
+    def __threat_map(self, player_index, damage_attribute, as_numpy):
+        if not player_index == 0 and not player_index == 1:
+            self._invalid_player_index(player_index)
+            return
+        if as_numpy and np is None:
+            raise ImportError("as_numpy requires NumPy")
+
+        size = self.ARENA_SIZE
+        in_arena = self.game_map._tables.in_arena
+        threat = [0] * (size * size)
+        structures = self.game_map.structure_mask()
+        while structures:
+            lowest = structures & -structures
+            structures ^= lowest
+            x, y = divmod(lowest.bit_length() - 1, size)
+            for unit in self.game_map[x, y]:
+                damage = getattr(unit, damage_attribute)
+                if not unit.stationary or unit.player_index == player_index or damage <= 0:
+                    continue
+                for dx, dy in attack_offsets(unit.attackRange):
+                    tx, ty = x + dx, y + dy
+                    if 0 <= tx < size and 0 <= ty < size and in_arena[tx * size + ty]:
+                        threat[tx * size + ty] += damage
+        if as_numpy:
+            return np.array(threat, dtype=float).reshape(size, size)
+        return [threat[x * size:(x + 1) * size] for x in range(size)]
@@ -1,24 +1,93 @@
 import heapq
-import math
 import sys
-import queue
+from collections import deque
+from itertools import repeat
 from .util import debug_write
+from .game_map import arena_tables
 
-class Node:
-    """A pathfinding node
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+PYTHON_ENGINE = "python"
+NUMPY_ENGINE = "numpy"
+
+# Incremental mode repairs at most this many changed locations before falling back to a full search
+INCREMENTAL_REPAIR_LIMIT = 8
+
+
+class _FlatGrid:
+    """Lookup tables for a square arena stored as a flat array
+
+    A location [x, y] is stored at index x * arena_size + y. The tables are
+    built once per arena size and shared by every ShortestPathFinder.
 
     Attributes :
-        * visited_idealness (bool): Have we visited this node during the idealness search step?
-        * visited_validate (bool): Have we visited this node during the validation step?
-        * blocked (bool): Is there a structures at this node's location
-        * pathlength: The distance between this node and the target location
+        * size (int): The width and height of the arena
+        * half (int): Half of the size of the arena
+        * in_arena (list): True at every index that is inside the diamond shaped board
+        * arena_indices (tuple): Every index inside the board
+        * neighbors (list): For each index, a tuple of the in-arena neighbor indices in [up, down, right, left] order
+        * xs (list): The x coordinate of each index
+        * ys (list): The y coordinate of each index
+        * idealness (dict): Maps a direction (see _get_direction_from_endpoints) to a list with the idealness of each index
+        * arena_bits (int): A bitmask with bit index set for every index inside the board
+        * up_bits (int), down_bits (int): arena_bits without the top row and without the bottom row,
+          the tiles whose up or down neighbor is in the same column
 
     """
-    def __init__(self):
-        self.visited_idealness = False
-        self.visited_validate = False
-        self.blocked = False
-        self.pathlength = -1
+    def __init__(self, size):
+        self.size = size
+        self.half = size // 2
+        count = size * size
+        self.xs = [index // size for index in range(count)]
+        self.ys = [index % size for index in range(count)]
+        self.in_arena = arena_tables(size).in_arena
+        self.arena_indices = tuple(index for index in range(count) if self.in_arena[index])
+
+        self.neighbors = [()] * count
+        for index in self.arena_indices:
+            x, y = self.xs[index], self.ys[index]
+            candidates = [[x, y + 1], [x, y - 1], [x + 1, y], [x - 1, y]]
+            self.neighbors[index] = tuple(cx * size + cy for cx, cy in candidates if self.contains(cx, cy))
+
+        self.idealness = {}
+        for direction in ([1, 1], [1, -1], [-1, 1], [-1, -1]):
+            table = [0] * count
+            for index in self.arena_indices:
+                x, y = self.xs[index], self.ys[index]
+                table[index] = size * (y if direction[1] == 1 else (size - 1 - y)) + (x if direction[0] == 1 else (size - 1 - x))
+            self.idealness[tuple(direction)] = table
+
+        self.arena_bits = sum(1 << index for index in self.arena_indices)
+        self.up_bits = sum(1 << index for index in self.arena_indices if self.ys[index] < size - 1)
+        self.down_bits = sum(1 << index for index in self.arena_indices if self.ys[index] > 0)
+
+    def contains(self, x, y):
+        """True if [x, y] is inside the board"""
+        return 0 <= x < self.size and 0 <= y < self.size and self.in_arena[x * self.size + y]
+
+    def index_of(self, location):
+        """The flat index of a location, or None if it is not on the board"""
+        x, y = location
+        if x != int(x) or y != int(y):
+            return None
+        x, y = int(x), int(y)
+        if not self.contains(x, y):
+            return None
+        return x * self.size + y
+
+
+_GRIDS = {}
+
+
+def _flat_grid(size):
+    grid = _GRIDS.get(size)
+    if grid is None:
+        grid = _GRIDS.setdefault(size, _FlatGrid(size))
+    return grid
+
 
 """
 This class helps with pathfinding. We guarantee the results will
@@ -28,18 +97,37 @@ code to maximise time efficiency
 class ShortestPathFinder:
     """Handles pathfinding
 
+    The grid is kept as preallocated flat arrays indexed by x * ARENA_SIZE + y.
+    Instead of clearing the visited arrays before every search, each search
+    stamps the tiles it visits with a new generation number.
+
     Attributes :
         * HORIZONTAL (int): A constant representing a horizontal movement
         * VERTICAL (int): A constant representing a vertical movement
+        * incremental (bool): If true, keep the distance field between searches and repair it when a few structures change
+        * engine (str): PYTHON_ENGINE or NUMPY_ENGINE, the implementation used for the validation search
 
         * game_state (:obj: GameState): The current gamestate
-        * game_map (:obj: GameMap): The current gamemap
 
     """
-    def __init__(self):
+    def __init__(self, incremental=False, engine=PYTHON_ENGINE):
         self.HORIZONTAL = 1
         self.VERTICAL = 2
         self.initialized = False
+        self.incremental = incremental
+        if engine == NUMPY_ENGINE and np is None:
+            debug_write("NumPy is not installed, using the python pathfinding engine")
+            engine = PYTHON_ENGINE
+        elif engine not in (PYTHON_ENGINE, NUMPY_ENGINE):
+            debug_write("Unknown pathfinding engine '{}', using the python pathfinding engine".format(engine))
+            engine = PYTHON_ENGINE
+        self.engine = engine
+        self._grid = None
+        self._generation = 0
+        self._field_end_points = None
+        #The last tuple of end points looked up and their indices, since a unit stepping along its path passes the same ones each step
+        self._end_points_seen = None
+        self._end_indices_seen = None
 
     def initialize_map(self, game_state):
         """Initializes the map
@@ -47,10 +135,48 @@ class ShortestPathFinder:
         Args:
             game_state: A GameState object representing the gamestate we want to traverse
         """
-        #Initialize map 
+        self._prepare(game_state)
+        self._generation += 1
+        self._field_end_points = None
+
+    def _prepare(self, game_state):
+        """Allocates the grid on first use and brings the blocked tiles up to date
+
+        The distance field of the previous search is kept while it is still valid for the
+        current structures, which in incremental mode includes repairing it.
+        """
         self.initialized = True
         self.game_state = game_state
-        self.game_map = [[Node() for x in range(self.game_state.ARENA_SIZE)] for y in range(self.game_state.ARENA_SIZE)]
+        if self._grid is None or self._grid.size != game_state.ARENA_SIZE:
+            self._grid = _flat_grid(game_state.ARENA_SIZE)
+            count = self._grid.size * self._grid.size
+            self._blocked = bytearray(count)
+            self._visited_idealness = [0] * count
+            self._visited_validate = [0] * count
+            self._pathlength = [-1] * count
+            self._blocked_mask = 0
+            self._field_end_points = None
+            self._end_points_seen = None
+        changed = self._load_blocked(game_state)
+        if changed and self._field_end_points is not None:
+            if not (self.incremental and self._repair_field(changed)):
+                self._field_end_points = None
+
+    def _load_blocked(self, game_state):
+        """Marks every location holding a structure as blocked
+
+        Only the locations whose structures changed since the previous search are updated.
+        """
+        mask = game_state.game_map.structure_mask()
+        changed = mask ^ self._blocked_mask
+        blocked = self._blocked
+        remaining = changed
+        while remaining:
+            lowest = remaining & -remaining
+            blocked[lowest.bit_length() - 1] ^= 1
+            remaining ^= lowest
+        self._blocked_mask = mask
+        return changed
 
     def navigate_multiple_endpoints(self, start_point, end_points, game_state):
         """Finds the path a unit would take to reach a set of endpoints
@@ -64,62 +190,285 @@ class ShortestPathFinder:
             The path a unit at start_point would take when trying to reach end_points given the current game state.
             Note that this path can change if a tower is destroyed during pathing, or if you or your enemy places structures.
 
+        In incremental mode the distance field of the previous search is repaired around the
+        structures that changed since, instead of being recomputed from scratch.
+
         """
         if game_state.contains_stationary_unit(start_point):
             return
 
-        #Initialize map 
-        self.initialize_map(game_state)
-        #Fill in walls
-        for location in self.game_state.game_map:
-            if self.game_state.contains_stationary_unit(location):
-                self.game_map[location[0]][location[1]].blocked = True
+        #Initialize map
+        self._prepare(game_state)
+        return self._navigate(start_point, end_points)
+
+    def navigate_many(self, start_points, end_points, game_state):
+        """Finds the paths units at several locations would take to reach the same set of endpoints
+
+        Args:
+            * start_points: A list of starting locations
+            * end_points: The end points of the units, should be a list of edge locations
+            * game_state: The current game state
+
+        Returns:
+            A list with the path for each starting location, in the same order. Blocked starting locations get None.
+            Starts in the same pocket of pathable space share one distance field, so this is much faster than
+            calling navigate_multiple_endpoints for each start.
+
+        """
+        self._prepare(game_state)
+        paths = []
+        for start_point in start_points:
+            if game_state.contains_stationary_unit(start_point):
+                paths.append(None)
+            else:
+                paths.append(self._navigate(start_point, end_points))
+        return paths
+
+    def next_move(self, start_point, end_points, game_state, previous_move_direction=0):
+        """Finds the next step of a unit following its path, as used to step units one at a time
+
+        Args:
+            * start_point: The current location of the unit
+            * end_points: The end points of the unit, should be a list of edge locations
+            * game_state: The current game state
+            * previous_move_direction: The direction of the unit's last step, HORIZONTAL, VERTICAL or 0 if it has not moved
+
+        Returns:
+            The location the unit steps to, or None if it has reached the end of its path or start_point is blocked.
+            Following next_move from the start of a path gives the same steps as navigate_multiple_endpoints.
+
+        """
+        self._prepare(game_state)
+        start = self._grid.index_of(start_point)
+        if start is None or self._blocked[start]:
+            return
+        self._ensure_field(start, end_points)
+        if self._get_pathlength(start) == 0:
+            return
+        next_move = self._choose_next_move(start, previous_move_direction)
+        return [self._grid.xs[next_move], self._grid.ys[next_move]]
+
+    def _navigate(self, start_point, end_points):
+        """Finds a path on the prepared grid, reusing the current distance field if it is valid for start_point
+        """
+        start = self._grid.index_of(start_point)
+        if start is None:
+            return
+        self._ensure_field(start, end_points)
+        return self._get_path(start_point, start)
+
+    def _ensure_field(self, start, end_points):
+        """Makes self._pathlength hold the distance field a unit at start follows, keeping the current one if it is valid
+        """
+        if end_points is self._end_points_seen:
+            end_indices = self._end_indices_seen
+        else:
+            end_indices = tuple(self._grid.index_of(location) for location in end_points)
+            if isinstance(end_points, tuple):
+                self._end_points_seen, self._end_indices_seen = end_points, end_indices
+        if self._field_end_points == end_indices and self._get_pathlength(start) >= 0:
+            #The field is seeded from the most ideal tile of start's pocket, or the whole edge if start can reach it
+            return
+
+        self._generation += 1
+        self._direction = self._get_direction_from_endpoints(end_points)
         #Do pathfinding
-        ideal_endpoints = self._idealness_search(start_point, end_points)
-        self._validate(ideal_endpoints, end_points)
-        return self._get_path(start_point, end_points)
+        ideal_endpoint = self._idealness_search(start, end_indices)
+        self._validate(ideal_endpoint, end_indices)
+        self._remember_field(ideal_endpoint, end_indices)
+
+    def _remember_field(self, ideal_tile, end_indices):
+        """Records what the distance field in self._pathlength was seeded from, so it can be repaired later
+        """
+        self._field_end_points = end_indices
+        self._field_end_set = frozenset(end_indices)
+        if ideal_tile in self._field_end_set:
+            self._field_seed = None
+            self._field_idealness = sys.maxsize
+        else:
+            self._field_seed = ideal_tile
+            self._field_idealness = self._grid.idealness[tuple(self._direction)][ideal_tile]
+
+    def _repair_field(self, changed):
+        """Repairs the previous distance field after the structures in changed were added or removed
+
+        Returns:
+            True if the field now holds the pathlengths a full search would produce.
+            False if a full search is needed, for example because the most ideal tile changed.
+        """
+        if INCREMENTAL_REPAIR_LIMIT < bin(changed).count("1"):
+            return False
+        remaining = changed
+        while remaining:
+            lowest = remaining & -remaining
+            remaining ^= lowest
+            location = lowest.bit_length() - 1
+            if self._blocked[location]:
+                repaired = self._repair_blocked(location)
+            else:
+                repaired = self._repair_unblocked(location)
+            if not repaired:
+                return False
+        return True
+
+    def _is_seed(self, location):
+        if self._field_seed is None:
+            return location in self._field_end_set
+        return location == self._field_seed
+
+    def _set_pathlength(self, location, pathlength):
+        self._pathlength[location] = pathlength
+        self._visited_validate[location] = self._generation
+
+    def _repair_unblocked(self, location):
+        """Lowers the pathlengths that can now route through a location that is no longer blocked
+
+        Returns:
+            False if the newly reachable tiles contain a more ideal tile than the current target
+        """
+        blocked = self._blocked
+        neighbors = self._grid.neighbors
+        newly_reached = []
+        if not self._is_seed(location):
+            best = -1
+            for neighbor in neighbors[location]:
+                pathlength = self._get_pathlength(neighbor)
+                if not blocked[neighbor] and pathlength >= 0 and (best == -1 or pathlength < best):
+                    best = pathlength
+            if best == -1:
+                return True
+            self._set_pathlength(location, best + 1)
+            newly_reached.append(location)
+
+        current = deque([location])
+        while current:
+            current_location = current.popleft()
+            next_pathlength = self._get_pathlength(current_location) + 1
+            for neighbor in neighbors[current_location]:
+                if blocked[neighbor]:
+                    continue
+                old_pathlength = self._get_pathlength(neighbor)
+                if old_pathlength == -1 or old_pathlength > next_pathlength:
+                    if old_pathlength == -1:
+                        newly_reached.append(neighbor)
+                    self._set_pathlength(neighbor, next_pathlength)
+                    current.append(neighbor)
+
+        if self._field_seed is not None:
+            idealness = self._grid.idealness[tuple(self._direction)]
+            for reached in newly_reached:
+                if reached in self._field_end_set or idealness[reached] > self._field_idealness:
+                    return False
+        return True
+
+    def _repair_blocked(self, location):
+        """Raises the pathlengths of the tiles whose shortest routes went through a newly blocked location
+
+        Returns:
+            False if the location was the tile the field is seeded from
+        """
+        if location == self._field_seed:
+            return False
+        blocked = self._blocked
+        neighbors = self._grid.neighbors
+        old_pathlength = self._get_pathlength(location)
+        if not self._is_seed(location):
+            self._visited_validate[location] = 0
+        if old_pathlength == -1:
+            return True
+
+        #Find the tiles left without a neighbor one step closer to the target, in order of pathlength
+        affected = set()
+        seen = set()
+        current = deque()
+        for neighbor in neighbors[location]:
+            if not blocked[neighbor] and not self._is_seed(neighbor) and self._get_pathlength(neighbor) == old_pathlength + 1:
+                seen.add(neighbor)
+                current.append(neighbor)
+        while current:
+            current_location = current.popleft()
+            pathlength = self._get_pathlength(current_location)
+            supported = False
+            for neighbor in neighbors[current_location]:
+                if not blocked[neighbor] and neighbor not in affected and self._get_pathlength(neighbor) == pathlength - 1:
+                    supported = True
+                    break
+            if supported:
+                continue
+            affected.add(current_location)
+            for neighbor in neighbors[current_location]:
+                if neighbor not in seen and not blocked[neighbor] and not self._is_seed(neighbor) and self._get_pathlength(neighbor) == pathlength + 1:
+                    seen.add(neighbor)
+                    current.append(neighbor)
+
+        #Recompute the affected tiles from the unaffected tiles around them
+        tentative = {}
+        for affected_location in affected:
+            best = -1
+            for neighbor in neighbors[affected_location]:
+                if blocked[neighbor] or neighbor in affected:
+                    continue
+                pathlength = self._get_pathlength(neighbor)
+                if pathlength >= 0 and (best == -1 or pathlength + 1 < best):
+                    best = pathlength + 1
+            if best != -1:
+                tentative[affected_location] = best
+        heap = [(pathlength, affected_location) for affected_location, pathlength in tentative.items()]
+        heapq.heapify(heap)
+        for affected_location in affected:
+            self._visited_validate[affected_location] = 0
+        done = set()
+        while heap:
+            pathlength, current_location = heapq.heappop(heap)
+            if current_location in done or tentative[current_location] != pathlength:
+                continue
+            done.add(current_location)
+            self._set_pathlength(current_location, pathlength)
+            for neighbor in neighbors[current_location]:
+                if neighbor in affected and neighbor not in done and (neighbor not in tentative or pathlength + 1 < tentative[neighbor]):
+                    tentative[neighbor] = pathlength + 1
+                    heapq.heappush(heap, (pathlength + 1, neighbor))
+        return True
 
-    def _idealness_search(self, start, end_points):
+    def _idealness_search(self, start, end_indices):
         """
-        Finds the most ideal tile in our 'pocket' of pathable space. 
+        Finds the most ideal tile in our 'pocket' of pathable space.
         The edge if it is available, or the best self destruct location otherwise
         """
-        current = queue.Queue()
-        current.put(start)
-        best_idealness = self._get_idealness(start, end_points)
-        self.game_map[start[0]][start[1]].visited_idealness = True
+        generation = self._generation
+        visited = self._visited_idealness
+        blocked = self._blocked
+        neighbors = self._grid.neighbors
+        idealness = self._grid.idealness[tuple(self._direction)]
+        end_set = set(end_indices)
+
+        current = deque([start])
+        best_idealness = sys.maxsize if start in end_set else idealness[start]
+        visited[start] = generation
         most_ideal = start
 
-        while not current.empty():
-            search_location = current.get()
-            for neighbor in self._get_neighbors(search_location):
-                if not self.game_state.game_map.in_arena_bounds(neighbor) or self.game_map[neighbor[0]][neighbor[1]].blocked:
+        while current:
+            search_location = current.popleft()
+            for neighbor in neighbors[search_location]:
+                if blocked[neighbor]:
                     continue
 
-                x, y = neighbor
-                current_idealness = self._get_idealness(neighbor, end_points)
-
+                current_idealness = sys.maxsize if neighbor in end_set else idealness[neighbor]
                 if current_idealness > best_idealness:
                     best_idealness = current_idealness
                     most_ideal = neighbor
 
-                if not self.game_map[x][y].visited_idealness and not self.game_map[x][y].blocked:
-                    self.game_map[x][y].visited_idealness = True
-                    current.put(neighbor)
+                if visited[neighbor] != generation:
+                    visited[neighbor] = generation
+                    current.append(neighbor)
 
         return most_ideal
 
-    def _get_neighbors(self, location):
-        """Get the locations adjacent to a location
-        """
-        x, y = location
-        return [[x, y + 1], [x, y - 1], [x + 1, y], [x - 1, y]]
-
     def _get_direction_from_endpoints(self, end_points):
         """Prints a message to the games debug output
 
         Args:
-            * end_points: A set of endpoints, should be an edge 
+            * end_points: A set of endpoints, should be an edge
 
         Returns:
             A direction [x,y] representing the edge. For example, [1,1] for the top right and [-1, 1] for the top left
@@ -134,157 +483,165 @@ class ShortestPathFinder:
             direction[1] = -1
         return direction
 
-    def _get_idealness(self, location, end_points):
-        """Get the idealness of a tile, the reachable tile the unit most wants to path to.
-        Better self destruct locations are more ideal. The endpoints are perfectly ideal. 
+    def _validate(self, ideal_tile, end_indices):
+        """Breadth first search of the grid, setting the pathlengths of each node
 
-        Returns:
-            A location the unit will attempt to reach
         """
-        if location in end_points:
-            return sys.maxsize
-
-        direction = self._get_direction_from_endpoints(end_points)
-
-        idealness = 0
-        if direction[1] == 1:
-            idealness += 28 * location[1]
-        else: 
-            idealness += 28 * (27 - location[1])
-        if direction[0] == 1:
-            idealness += location[0]
-        else: 
-            idealness += (27 - location[0])
-
-        return idealness
+        if self.engine == NUMPY_ENGINE:
+            self._validate_numpy(ideal_tile, end_indices)
+            return
 
-    def _validate(self, ideal_tile, end_points):
-        """Breadth first search of the grid, setting the pathlengths of each node
+        generation = self._generation
+        visited = self._visited_validate
+        pathlength = self._pathlength
+        blocked = self._blocked
+        neighbors = self._grid.neighbors
 
-        """
-        #VALDIATION
         #Add our most ideal tiles to current
-        current = queue.Queue()
-        if ideal_tile in end_points:
-            for location in end_points:
-               current.put(location)
-               #Set current pathlength to 0
-               self.game_map[location[0]][location[1]].pathlength = 0
-               self.game_map[location[0]][location[1]].visited_validate = True
+        if ideal_tile in end_indices:
+            current = deque(end_indices)
         else:
-            current.put(ideal_tile)
-            self.game_map[ideal_tile[0]][ideal_tile[1]].pathlength = 0
-            self.game_map[ideal_tile[0]][ideal_tile[1]].visited_validate = True
-
-        #While current is not empty
-        while not current.empty():
-            current_location = current.get()
-            current_node = self.game_map[current_location[0]][current_location[1]]
-            for neighbor in self._get_neighbors(current_location):
-                if not self.game_state.game_map.in_arena_bounds(neighbor) or self.game_map[neighbor[0]][neighbor[1]].blocked:
+            current = deque([ideal_tile])
+        for location in current:
+            pathlength[location] = 0
+            visited[location] = generation
+
+        while current:
+            current_location = current.popleft()
+            #Blocked endpoints are targets but can not be walked through
+            if blocked[current_location]:
+                continue
+            next_pathlength = pathlength[current_location] + 1
+            for neighbor in neighbors[current_location]:
+                if blocked[neighbor] or visited[neighbor] == generation:
                     continue
+                pathlength[neighbor] = next_pathlength
+                visited[neighbor] = generation
+                current.append(neighbor)
 
-                neighbor_node = self.game_map[neighbor[0]][neighbor[1]]
-                if not neighbor_node.visited_validate and not current_node.blocked:
-                    neighbor_node.pathlength = current_node.pathlength + 1
-                    neighbor_node.visited_validate = True
-                    current.put(neighbor)
+    def _validate_numpy(self, ideal_tile, end_indices):
+        """The same search as _validate, expanding the whole frontier at once
 
-        #debug_write("Print after validate")
-        #self.print_map()
-        return
+        Each level of the search is a bitmask over the flat indices, so a step is a few integer shifts.
+        The levels are unpacked into pathlengths with NumPy once the search is done.
+        """
+        grid = self._grid
+        size = grid.size
+        count = size * size
+        passable = grid.arena_bits & ~self._blocked_mask
+        up_bits, down_bits = grid.up_bits, grid.down_bits
+
+        seeds = end_indices if ideal_tile in end_indices else (ideal_tile,)
+        frontier = 0
+        for location in seeds:
+            frontier |= 1 << location
+        visited = frontier
+        #The locations reached within each number of steps
+        reached = [visited]
+        while True:
+            #Blocked endpoints are targets but can not be walked through
+            frontier &= passable
+            frontier = ((frontier << size) | (frontier >> size) | ((frontier & up_bits) << 1) | ((frontier & down_bits) >> 1)) & passable & ~visited
+            if not frontier:
+                break
+            visited |= frontier
+            reached.append(visited)
+
+        #A location's pathlength is the number of levels that had not reached it yet
+        level_bytes = (count + 7) // 8
+        bits = np.unpackbits(np.frombuffer(b"".join(level.to_bytes(level_bytes, "little") for level in reached), dtype=np.uint8)
+            .reshape(len(reached), level_bytes), axis=1, count=count, bitorder="little")
+        pathlength = len(reached) - bits.sum(axis=0, dtype=np.int16)
+        pathlength[bits[-1] == 0] = -1
+        self._pathlength[:] = pathlength.tolist()
+        self._visited_validate[:] = repeat(self._generation, count)
+
+    def _get_pathlength(self, index):
+        """The pathlength found by the last validation search, or -1 if the location was not reached
+        """
+        if self._visited_validate[index] != self._generation:
+            return -1
+        return self._pathlength[index]
 
-    def _get_path(self, start_point, end_points):
+    def _get_path(self, start_point, start):
         """Once all nodes are validated, and a target is found, the unit can path to its target
 
         """
         #GET THE PATH
+        xs, ys = self._grid.xs, self._grid.ys
         path = [start_point]
-        current = start_point
+        current = start
         move_direction = 0
 
-        while not self.game_map[current[0]][current[1]].pathlength == 0:
-            #debug_write("current tile {} has cost {}".format(current, self.game_map[current[0]][current[1]].pathlength))
-            next_move = self._choose_next_move(current, move_direction, end_points)
-            #debug_write(next_move)
+        while not self._get_pathlength(current) == 0:
+            next_move = self._choose_next_move(current, move_direction)
 
-            if current[0] == next_move[0]:
+            if xs[current] == xs[next_move]:
                 move_direction = self.VERTICAL
             else:
                 move_direction = self.HORIZONTAL
-            path.append(next_move)
+            path.append([xs[next_move], ys[next_move]])
             current = next_move
-        
-        #debug_write(path)
+
         return path
-  
-    def _choose_next_move(self, current_point, previous_move_direction, end_points):
+
+    def _choose_next_move(self, current_point, previous_move_direction):
         """Given the current location and adjacent locations, return the best 'next step' for a given unit to take
         """
-        neighbors = self._get_neighbors(current_point)
-        #debug_write("Unit at {} previously moved {} and has these neighbors {}".format(current_point, previous_move_direction, neighbors))
-
+        blocked = self._blocked
         ideal_neighbor = current_point
-        best_pathlength = self.game_map[current_point[0]][current_point[1]].pathlength
-        for neighbor in neighbors:
-            #debug_write("Comparing champ {} and contender {}".format(ideal_neighbor, neighbor))
-            if not self.game_state.game_map.in_arena_bounds(neighbor) or self.game_map[neighbor[0]][neighbor[1]].blocked:
+        best_pathlength = self._get_pathlength(current_point)
+        for neighbor in self._grid.neighbors[current_point]:
+            if blocked[neighbor]:
                 continue
 
-            new_best = False
-            x, y = neighbor
-            current_pathlength = self.game_map[x][y].pathlength
+            current_pathlength = self._get_pathlength(neighbor)
 
             #Filter by pathlength
             if current_pathlength > best_pathlength:
                 continue
-            elif current_pathlength < best_pathlength:
-                #debug_write("Contender has better pathlength at {} vs champs {}".format(current_pathlength, best_pathlength))
-                new_best = True
-
             #Filter by direction based on prev move
-            if not new_best and not self._better_direction(current_point, neighbor, ideal_neighbor, previous_move_direction, end_points):
+            if current_pathlength == best_pathlength and not self._better_direction(current_point, neighbor, ideal_neighbor, previous_move_direction):
                 continue
 
             ideal_neighbor = neighbor
             best_pathlength = current_pathlength
 
-        #debug_write("Gave unit at {} new tile {}".format(current_point, ideal_neighbor))
         return ideal_neighbor
 
-    def _better_direction(self, prev_tile, new_tile, prev_best, previous_move_direction, end_points):
+    def _better_direction(self, prev_tile, new_tile, prev_best, previous_move_direction):
         """Compare two tiles and return True if the unit would rather move to the new one
 
         """
+        xs, ys = self._grid.xs, self._grid.ys
         #True if we are moving in a different direction than prev move and prev is not
         #If we previously moved horizontal, and now one of our options has a different x position then the other (the two options are not up/down)
-        if previous_move_direction == self.HORIZONTAL and not new_tile[0] == prev_best[0]:
+        if previous_move_direction == self.HORIZONTAL and not xs[new_tile] == xs[prev_best]:
             #We want to go up now. If we have not changed our y, we are not going up
-            if prev_tile[1] == new_tile[1]:
-                return False 
+            if ys[prev_tile] == ys[new_tile]:
+                return False
             return True
-        if previous_move_direction == self.VERTICAL and not new_tile[1] == prev_best[1]:
-            if prev_tile[0] == new_tile[0]:
-                #debug_write("contender {} has the same x coord as prev tile {} so we will keep best move {}".format(new_tile, prev_tile, prev_best))
+        if previous_move_direction == self.VERTICAL and not ys[new_tile] == ys[prev_best]:
+            if xs[prev_tile] == xs[new_tile]:
                 return False
             return True
-        if previous_move_direction == 0: 
-            if prev_tile[1] == new_tile[1]: 
+        if previous_move_direction == 0:
+            if ys[prev_tile] == ys[new_tile]:
                 return False
             return True
-        
-        #To make it here, both moves are on the same axis 
-        direction = self._get_direction_from_endpoints(end_points)
-        if new_tile[1] == prev_best[1]: #If they both moved horizontal...
-            if direction[0] == 1 and new_tile[0] > prev_best[0]: #If we moved right and right is our direction, we moved towards our direction
-                return True 
-            if direction[0] == -1 and new_tile[0] < prev_best[0]: #If we moved left and left is our direction, we moved towards our direction
-                return True 
-            return False 
-        if new_tile[0] == prev_best[0]: #If they both moved vertical...
-            if direction[1] == 1 and new_tile[1] > prev_best[1]: #If we moved up and up is our direction, we moved towards our direction
+
+        #To make it here, both moves are on the same axis
+        direction = self._direction
+        if ys[new_tile] == ys[prev_best]: #If they both moved horizontal...
+            if direction[0] == 1 and xs[new_tile] > xs[prev_best]: #If we moved right and right is our direction, we moved towards our direction
+                return True
+            if direction[0] == -1 and xs[new_tile] < xs[prev_best]: #If we moved left and left is our direction, we moved towards our direction
+                return True
+            return False
+        if xs[new_tile] == xs[prev_best]: #If they both moved vertical...
+            if direction[1] == 1 and ys[new_tile] > ys[prev_best]: #If we moved up and up is our direction, we moved towards our direction
                 return True
-            if direction[1] == -1 and new_tile[1] < prev_best[1]: #If we moved down and down is our direction, we moved towards our direction
+            if direction[1] == -1 and ys[new_tile] < ys[prev_best]: #If we moved down and down is our direction, we moved towards our direction
                 return True
             return False
         return True
@@ -297,11 +654,13 @@ class ShortestPathFinder:
             debug_write("Attempted to print_map before pathfinder initialization. Use 'this_object.initialize_map(game_state)' to initialize the map first")
             return
 
-        for y in range(28):
-            for x in range(28):
-                node = self.game_map[x][28 - y - 1]
-                if not node.blocked and not node.pathlength == -1:
-                    self._print_justified(node.pathlength)
+        size = self._grid.size
+        for y in range(size):
+            for x in range(size):
+                index = x * size + (size - y - 1)
+                pathlength = self._get_pathlength(index)
+                if self._grid.in_arena[index] and not self._blocked[index] and not pathlength == -1:
+                    self._print_justified(pathlength)
                 else:
                     sys.stderr.write("   ")
             debug_write("")
@@ -0,0 +1,200 @@
+from collections import namedtuple, deque
+from types import MappingProxyType
+from weakref import WeakValueDictionary
+
+# Indexes of the two resources in [SP, MP] cost and resource lists
+SP = 0
+MP = 1
+
+#The number of turns covered by Rules.mp_income_table
+MP_TABLE_TURNS = 200
+
+#Maps id(config) to the Rules compiled from it, for as long as something uses those Rules.
+#Rules hold their config, so its id can not be reused by another config while the entry exists.
+_RULES = WeakValueDictionary()
+
+#The most recently compiled Rules are kept alive even when nothing else uses them,
+#so GameUnits made from a config outside any GameState do not compile it again each time
+RECENT_RULES_KEPT = 4
+_RECENT_RULES = deque(maxlen=RECENT_RULES_KEPT)
+
+UnitStats = namedtuple("UnitStats", ["stationary", "speed", "damage_f", "damage_i", "attackRange", "shieldRange",
+    "max_health", "shieldPerUnit", "shieldBonusPerY", "cost"])
+UnitStats.__doc__ = """The stats shared by every unit of one type and upgrade level, see Rules.stats"""
+
+
+def compile_rules(config):
+    """Gets the Rules for a config, compiling them the first time the config is seen
+
+    Args:
+        config (JSON): Contains information about the game
+
+    Returns:
+        The Rules shared by everything built from this config
+
+    """
+    rules = _RULES.get(id(config))
+    if rules is None:
+        #setdefault makes threads compiling the same config at once agree on one Rules
+        rules = _RULES.setdefault(id(config), Rules(config))
+        _RECENT_RULES.append(rules)
+    return rules
+
+
+def recent_rules():
+    """Gets the most recently compiled Rules
+
+    Returns:
+        The Rules, or None if no config has been compiled yet
+
+    """
+    try:
+        return _RECENT_RULES[-1]
+    except IndexError:
+        return None
+
+
+def _build_stats_table(config):
+    table = {}
+    for type_config in config["unitInformation"]:
+        unit_type = type_config.get("shorthand")
+        base = UnitStats(
+            stationary=type_config.get("unitCategory") == 0,
+            speed=type_config.get("speed", 0),
+            damage_f=type_config.get("attackDamageTower", 0),
+            damage_i=type_config.get("attackDamageWalker", 0),
+            attackRange=type_config.get("attackRange", 0),
+            shieldRange=type_config.get("shieldRange", 0),
+            max_health=type_config.get("startHealth", 0),
+            shieldPerUnit=type_config.get("shieldPerUnit", 0),
+            shieldBonusPerY=type_config.get("shieldBonusPerY", 0),
+            cost=(type_config.get("cost1", 0), type_config.get("cost2", 0)))
+        upgrade_config = type_config.get("upgrade", {})
+        upgraded = base._replace(
+            speed=upgrade_config.get("speed", base.speed),
+            damage_f=upgrade_config.get("attackDamageTower", base.damage_f),
+            damage_i=upgrade_config.get("attackDamageWalker", base.damage_i),
+            attackRange=upgrade_config.get("attackRange", base.attackRange),
+            shieldRange=upgrade_config.get("shieldRange", base.shieldRange),
+            max_health=upgrade_config.get("startHealth", base.max_health),
+            shieldPerUnit=upgrade_config.get("shieldPerUnit", base.shieldPerUnit),
+            shieldBonusPerY=upgrade_config.get("shieldBonusPerY", base.shieldBonusPerY),
+            cost=(upgrade_config.get("cost1", 0) + base.cost[0], upgrade_config.get("cost2", 0) + base.cost[1]))
+        table[unit_type, False] = base
+        table[unit_type, True] = upgraded
+    return table
+
+
+class Rules:
+    """The rules of one game, compiled once from its config. Use compile_rules to get them.
+
+    A Rules object is read-only. GameState and GameMap share the one for their config and GameUnits
+    share its stat records, so game states built from different configs can be used side by side.
+
+    Attributes :
+        * config (JSON): The config the rules were compiled from
+        * WALL, SUPPORT, TURRET, SCOUT, DEMOLISHER, INTERCEPTOR, REMOVE, UPGRADE (str): The shorthand of each unit type and action
+        * stats (dict): Maps (shorthand, upgraded) to the UnitStats record shared by every unit of that type and upgrade level
+        * unit_types (tuple): The shorthands in config order, indexed by type id
+        * UNIT_TYPE_TO_INDEX (dict): Maps a shorthand to its type id
+        * ALL_UNITS (frozenset): The unit types that can be spawned
+        * STRUCTURE_TYPES (frozenset): The structure types
+        * MOBILE_TYPES (frozenset): The mobile unit types
+        * UPGRADABLE_TYPES (frozenset): The unit types that have an upgrade
+        * costs (dict): Maps a shorthand to its (SP, MP) cost
+        * upgrade_costs (dict): Maps a shorthand to the (SP, MP) cost of upgrading it
+        * upgrade_deltas (dict): Maps a shorthand to {stat: (base value, upgraded value)} for the stats its upgrade changes
+        * max_attack_range (float): The largest attackRange of any unit, upgraded or not
+        * hit_radius (float): The getHitRadius used by range queries
+        * ARENA_SIZE (int): The size of the arena
+        * HALF_ARENA (int): Half the size of the arena
+        * SP (int): The index of SP in cost and resource lists
+        * MP (int): The index of MP in cost and resource lists
+        * edges (tuple): The (x, y) locations of each edge, indexed by GameMap.TOP_RIGHT, TOP_LEFT, BOTTOM_LEFT and BOTTOM_RIGHT
+        * spawn_locations (frozenset): The (x, y) locations on the bottom edges, where you can deploy mobile units
+        * mp_per_round (float), mp_growth_rate (float), mp_schedule_interval (int), mp_decay (float), sp_per_round (float):
+          The resource schedule, see mp_income
+        * mp_income_table (tuple): mp_income for turns 0 to MP_TABLE_TURNS - 1
+
+    """
+    def __init__(self, config):
+        from .game_map import arena_tables
+
+        self.config = config
+        unit_information = config["unitInformation"]
+        self.unit_types = tuple(type_config.get("shorthand") for type_config in unit_information)
+        self.UNIT_TYPE_TO_INDEX = MappingProxyType({unit_type: i for i, unit_type in enumerate(self.unit_types)})
+        self.WALL, self.SUPPORT, self.TURRET, self.SCOUT, self.DEMOLISHER, self.INTERCEPTOR, self.REMOVE, self.UPGRADE = self.unit_types[:8]
+        self.STRUCTURE_TYPES = frozenset((self.WALL, self.SUPPORT, self.TURRET))
+        self.MOBILE_TYPES = frozenset((self.SCOUT, self.DEMOLISHER, self.INTERCEPTOR))
+        self.ALL_UNITS = self.STRUCTURE_TYPES | self.MOBILE_TYPES
+        self.UPGRADABLE_TYPES = frozenset(type_config.get("shorthand") for type_config in unit_information[:6]
+            if type_config.get("upgrade", None) is not None)
+
+        self.stats = MappingProxyType(_build_stats_table(config))
+        costs = {}
+        upgrade_costs = {}
+        upgrade_deltas = {}
+        self.max_attack_range = 0
+        for type_config in unit_information:
+            unit_type = type_config.get("shorthand")
+            cost = (type_config.get("cost1", 0), type_config.get("cost2", 0))
+            upgrade = type_config.get("upgrade", {})
+            costs[unit_type] = cost
+            upgrade_costs[unit_type] = (upgrade.get("cost1", cost[SP]), upgrade.get("cost2", cost[MP]))
+            if unit_type in self.ALL_UNITS:
+                base, upgraded = self.stats[unit_type, False], self.stats[unit_type, True]
+                upgrade_deltas[unit_type] = MappingProxyType({stat: (base_value, upgraded_value)
+                    for stat, base_value, upgraded_value in zip(base._fields, base, upgraded) if base_value != upgraded_value})
+                self.max_attack_range = max(self.max_attack_range, base.attackRange, upgraded.attackRange)
+        self.costs = MappingProxyType(costs)
+        self.upgrade_costs = MappingProxyType(upgrade_costs)
+        self.upgrade_deltas = MappingProxyType(upgrade_deltas)
+        self.hit_radius = unit_information[0].get("getHitRadius", 0)
+
+        self.ARENA_SIZE = 28
+        self.HALF_ARENA = self.ARENA_SIZE // 2
+        self.SP = SP
+        self.MP = MP
+        tables = arena_tables(self.ARENA_SIZE)
+        self.edges = tables.edges
+        self.spawn_locations = tables.edge_sets[2] | tables.edge_sets[3]
+
+        resources = config.get("resources", {})
+        self.mp_per_round = resources.get("bitsPerRound", 0)
+        self.mp_growth_rate = resources.get("bitGrowthRate", 0)
+        self.mp_schedule_interval = resources.get("turnIntervalForBitSchedule", 1)
+        self.mp_decay = resources.get("bitDecayPerRound", 0)
+        self.sp_per_round = resources.get("coresPerRound", 0)
+        self.mp_income_table = tuple(self.mp_per_round + (self.mp_growth_rate * (turn_number // self.mp_schedule_interval))
+            for turn_number in range(MP_TABLE_TURNS))
+        self._frozen = True
+
+    def __setattr__(self, name, value):
+        if getattr(self, "_frozen", False):
+            raise AttributeError("Rules are read-only")
+        object.__setattr__(self, name, value)
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        #Rules are read-only, so copies of a GameState keep sharing them
+        return self
+
+    def __reduce__(self):
+        return (compile_rules, (self.config,))
+
+    def is_stationary(self, unit_type):
+        """Checks if a unit type is a structure"""
+        return unit_type in self.STRUCTURE_TYPES
+
+    def unit_stats(self, unit_type, upgraded=False):
+        """Gets the shared UnitStats record for a unit type, see stats"""
+        return self.stats[unit_type, upgraded]
+
+    def mp_income(self, turn_number):
+        """Gets the MP each player gains at the start of the given turn. MP already held decays by mp_decay first."""
+        if 0 <= turn_number < MP_TABLE_TURNS:
+            return self.mp_income_table[turn_number]
+        return self.mp_per_round + (self.mp_growth_rate * (turn_number // self.mp_schedule_interval))
@@ -0,0 +1,510 @@
+from .game_map import range_offsets
+from .navigation import ShortestPathFinder
+from .unit import GameUnit
+
+#The keys of the events block the engine sends with each action frame
+EVENT_TYPES = ("selfDestruct", "breach", "damage", "shield", "move", "spawn", "death", "attack", "melee")
+
+#The move directions used by ShortestPathFinder
+HORIZONTAL = 1
+VERTICAL = 2
+
+#The most frames run will simulate, so units that never finish can not hang an algo
+MAX_FRAMES = 1000
+
+
+class SimulatedUnit:
+    """A unit taking part in a simulated action phase
+
+    Attributes :
+        * unit (:obj: GameUnit): The unit's type, owner, location and health
+        * unit_id (str): The id of the unit in the simulated events
+        * type_index (int): The index of the unit's type in config["unitInformation"], as used in events
+        * target_edge (int): The edge a mobile unit is heading for, None for structures
+        * steps (int): The number of steps a mobile unit has taken
+        * move_direction (int): The direction of the last step, HORIZONTAL or VERTICAL, 0 before the first
+        * shielded_by (set): The ids of the supports that have shielded this unit
+
+    """
+    __slots__ = ("unit", "unit_id", "type_index", "target_edge", "end_points", "end_set", "frames_per_move",
+        "frames", "steps", "move_direction", "shielded_by", "removed")
+
+    def __init__(self, unit, unit_id, type_index):
+        self.unit = unit
+        self.unit_id = unit_id
+        self.type_index = type_index
+        self.target_edge = None
+        self.end_points = None
+        self.end_set = None
+        self.frames_per_move = 0
+        self.frames = 0
+        self.steps = 0
+        self.move_direction = 0
+        self.shielded_by = set()
+        self.removed = False
+
+    def __repr__(self):
+        return "{} {}".format(self.unit_id, self.unit)
+
+
+class Simulator:
+    """Plays out the action phase of a turn locally, frame by frame, following the engine's rules
+
+    Each frame, in order:
+        1. Supports shield friendly mobile units in their shieldRange that they have not shielded before,
+           by shieldPerUnit plus shieldBonusPerY for each row the support is from its owner's edge
+        2. Mobile units whose turn it is to move act. A unit standing on its target edge breaches and leaves the board.
+           Otherwise it takes one step along its path, repathing around structures that died. A unit that can not
+           move any further self destructs, damaging enemy units in its selfDestructRange if it took at least
+           selfDestructStepsRequired steps, and still attacks this frame.
+        3. Every unit with a target in range attacks it, using the same targeting rules as GameState.get_target
+        4. Units left with no health are removed
+
+    A mobile unit moves every 1 / speed frames, counting the frame it was spawned in.
+    Structures marked for removal stay on the board for the whole action phase.
+
+    The GameState passed in is not changed. The simulation runs on a fork of it, available as game_state,
+    which holds the surviving structures, the players' health and the SP earned by breaching.
+
+    Attributes :
+        * game_state (:obj: GameState): The simulated game state
+        * frame (int): The number of frames simulated so far
+        * units (list): The SimulatedUnits still on the board, structures and mobile units, in the order they act
+        * events (list): The events of each simulated frame, as dicts shaped like the engine's "events" block
+
+    """
+    def __init__(self, game_state, spawns=None):
+        """Sets up a simulation of the action phase that follows game_state
+
+        Mobile units on game_state's map, such as those placed by attempt_spawn, are spawned at the start of the action phase.
+        Structures upgraded this turn with attempt_upgrade get the extra health of their upgrade.
+
+        Args:
+            game_state: The GameState at the end of the deploy phase
+            spawns: More units to spawn at the start of the action phase, such as a prediction of the enemy's turn.
+                A list of [unit_type, location, player_index] entries, 0 for you 1 for the enemy.
+                UPGRADE upgrades the structure at location and REMOVE marks it for removal.
+
+        """
+        self.game_state = game_state.fork(share_pathfinder=False)
+        self.config = game_state.config
+        self.rules = game_state.rules
+        self.frame = 0
+        self.units = []
+        self.events = []
+        self._game_map = self.game_state.game_map
+        self._size = self.game_state.ARENA_SIZE
+        self._center_x = self.game_state.HALF_ARENA - 0.5
+        #For each player, the SimulatedUnits on each tile by flat index x * ARENA_SIZE + y, mobile units and structures apart
+        self._mobile_tiles = ({}, {})
+        self._structure_tiles = ({}, {})
+        self._next_id = 1
+        self._spawn_events = []
+        self._copied_structures = set()
+        self._edges = {}
+        self._pathfinders = {}
+        #Maps (flat index, move direction, target edge) to the next step, for the current structure layout
+        self._next_steps = {}
+        #Maps (flat index, attack range) to the tiles in range, see __tiles_in_range. Only kept for this simulation.
+        self._in_range = {}
+        #Maps (flat index, attack range, enemy index) to the enemy structure tiles in range, for the current structures
+        self._structures_in_range = {}
+        self._SP_per_damage = self.config.get("resources", {}).get("coresForPlayerDamage", 1)
+
+        #The map keeps only the structures, mobile units are tracked in the tiles above
+        mobile_units = []
+        for x, y, units in self._game_map._occupied_tiles():
+            if any(not unit.stationary for unit in units):
+                mobile_units.extend(unit for unit in units if not unit.stationary)
+                self._game_map._set_tile(x, y, [unit for unit in units if unit.stationary])
+        built = set((x, y) for unit_type, x, y in self.game_state._build_stack if unit_type in self.rules.STRUCTURE_TYPES)
+        for x, y, units in self._game_map._occupied_tiles():
+            for unit in units:
+                sim_unit = self.__add(unit)
+                if (x, y) in built and unit.player_index == 0:
+                    self.__spawn_event([x, y], sim_unit.type_index, sim_unit.unit_id, 0)
+        for unit_type, x, y in self.game_state._build_stack:
+            if unit_type == self.rules.UPGRADE:
+                structure = self.__writable_structure(x, y)
+                structure.health += structure.max_health - self.rules.unit_stats(structure.unit_type).max_health
+            if unit_type == self.rules.UPGRADE or unit_type == self.rules.REMOVE:
+                self.__spawn_event([x, y], self.rules.UNIT_TYPE_TO_INDEX[unit_type], self.__new_id(), 0)
+        for unit in mobile_units:
+            self.__spawn_mobile(GameUnit(unit.unit_type, self.config, unit.player_index, unit.health, unit.x, unit.y))
+        for unit_type, location, player_index in spawns or ():
+            self.__spawn(unit_type, location, player_index)
+
+        #The units that take part in each part of a frame, in the order they act.
+        #Units are only spawned above, so these are filtered as units die and never added to.
+        self._movers = [sim_unit for sim_unit in self.units if sim_unit.frames_per_move]
+        self._attackers = [sim_unit for sim_unit in self.units if sim_unit.unit._stats.damage_i > 0 or sim_unit.unit._stats.damage_f > 0]
+        self._supports = [sim_unit for sim_unit in self.units if sim_unit.unit._stats.stationary and sim_unit.unit._stats.shieldRange > 0]
+        #The units damaged, breached or self destructed this frame, the only ones that can need removing
+        self._hit = []
+
+    def __new_id(self):
+        self._next_id += 1
+        return str(self._next_id - 1)
+
+    def __spawn_event(self, location, type_index, unit_id, player_index):
+        self._spawn_events.append([location, type_index, unit_id, player_index + 1])
+
+    def __add(self, unit):
+        sim_unit = SimulatedUnit(unit, self.__new_id(), self.rules.UNIT_TYPE_TO_INDEX[unit.unit_type])
+        self.units.append(sim_unit)
+        self.__tiles(unit).setdefault(unit.x * self._size + unit.y, []).append(sim_unit)
+        return sim_unit
+
+    def __tiles(self, unit):
+        return (self._structure_tiles if unit.stationary else self._mobile_tiles)[unit.player_index]
+
+    def __spawn_mobile(self, unit):
+        sim_unit = self.__add(unit)
+        edge = self.game_state.get_target_edge([unit.x, unit.y])
+        if edge not in self._edges:
+            #A tuple, so the pathfinder can reuse its indices from step to step
+            end_points = tuple(self._game_map.get_edge_locations(edge))
+            self._edges[edge] = (end_points, frozenset(x * self._size + y for x, y in end_points))
+        sim_unit.target_edge = edge
+        sim_unit.end_points, sim_unit.end_set = self._edges[edge]
+        sim_unit.frames_per_move = max(1, int(round(1 / unit.speed))) if unit.speed > 0 else 0
+        self.__spawn_event([unit.x, unit.y], sim_unit.type_index, sim_unit.unit_id, unit.player_index)
+
+    def __spawn(self, unit_type, location, player_index):
+        x, y = map(int, location)
+        rules = self.rules
+        if not self._game_map.in_arena_bounds([x, y]):
+            return
+        structure = self._game_map._structure_at(x, y)
+        if unit_type == rules.UPGRADE or unit_type == rules.REMOVE:
+            if structure is None or structure.player_index != player_index:
+                return
+            structure = self.__writable_structure(x, y)
+            if unit_type == rules.UPGRADE:
+                if structure.upgraded:
+                    return
+                max_health = structure.max_health
+                structure.upgrade()
+                structure.health += structure.max_health - max_health
+            else:
+                structure.pending_removal = True
+            self.__spawn_event([x, y], rules.UNIT_TYPE_TO_INDEX[unit_type], self.__new_id(), player_index)
+        elif structure is not None:
+            return
+        elif unit_type in rules.STRUCTURE_TYPES:
+            unit = GameUnit(unit_type, self.config, player_index, None, x, y)
+            self._game_map._set_tile(x, y, [unit])
+            self._copied_structures.add(x * self._size + y)
+            self._next_steps.clear()
+            self._structures_in_range.clear()
+            sim_unit = self.__add(unit)
+            self.__spawn_event([x, y], sim_unit.type_index, sim_unit.unit_id, player_index)
+        elif unit_type in rules.MOBILE_TYPES:
+            self.__spawn_mobile(GameUnit(unit_type, self.config, player_index, None, x, y))
+
+    def __writable_structure(self, x, y):
+        """Gets the structure at [x, y], copied the first time so the GameState the simulation was forked from is unchanged
+        """
+        flat = x * self._size + y
+        structure = self._game_map._structure_at(x, y)
+        if flat in self._copied_structures:
+            return structure
+        self._copied_structures.add(flat)
+        copied = self._game_map._writable_structure(x, y)
+        for sim_unit in self._structure_tiles[structure.player_index].get(flat, ()):
+            if sim_unit.unit is structure:
+                sim_unit.unit = copied
+        return copied
+
+    def run(self, max_frames=MAX_FRAMES):
+        """Simulates frames until no mobile units are left
+
+        Args:
+            max_frames: The most frames to simulate in total
+
+        Returns:
+            The events of every frame simulated, see events
+
+        """
+        while self.frame < max_frames:
+            self.step()
+            if not self._mobile_tiles[0] and not self._mobile_tiles[1]:
+                break
+        return self.events
+
+    def step(self):
+        """Simulates one frame
+
+        Returns:
+            The events of the frame, a dict shaped like the engine's "events" block
+
+        """
+        events = {name: [] for name in EVENT_TYPES}
+        if self.frame == 0:
+            events["spawn"].extend(self._spawn_events)
+        self.__shield(events)
+        self.__move(events)
+        self.__attack(events)
+        self.__remove_dead(events)
+        self.frame += 1
+        self.events.append(events)
+        return events
+
+    def __shield(self, events):
+        size = self._size
+        for support in self._supports:
+            unit = support.unit
+            if not self._mobile_tiles[unit.player_index]:
+                continue
+            rows_from_edge = unit.y if unit.player_index == 0 else size - 1 - unit.y
+            shield = unit.shieldPerUnit + unit.shieldBonusPerY * rows_from_edge
+            if shield <= 0:
+                continue
+            for sim_unit in self.__units_in_range(self._mobile_tiles[unit.player_index], unit.x, unit.y, unit.shieldRange):
+                if support.unit_id in sim_unit.shielded_by:
+                    continue
+                sim_unit.shielded_by.add(support.unit_id)
+                target = sim_unit.unit
+                target.health += shield
+                events["shield"].append([[unit.x, unit.y], [target.x, target.y], float(shield), sim_unit.type_index,
+                    support.unit_id, sim_unit.unit_id, unit.player_index + 1])
+
+    def __move(self, events):
+        size = self._size
+        next_steps = self._next_steps
+        mobile_tiles = self._mobile_tiles
+        moves = events["move"]
+        for sim_unit in self._movers:
+            sim_unit.frames += 1
+            if sim_unit.frames % sim_unit.frames_per_move:
+                continue
+            unit = sim_unit.unit
+            if unit.health <= 0:
+                continue
+            x, y = unit.x, unit.y
+            flat = x * size + y
+            if flat in sim_unit.end_set:
+                self.__breach(sim_unit, events)
+                continue
+            key = (flat, sim_unit.move_direction, sim_unit.target_edge)
+            next_location = next_steps.get(key, False)
+            if next_location is False:
+                next_location = next_steps[key] = self.__find_next_step(sim_unit)
+            if next_location is None:
+                self.__self_destruct(sim_unit, events)
+                continue
+            next_x, next_y = next_location
+            tiles = mobile_tiles[unit.player_index]
+            tile = tiles[flat]
+            if len(tile) == 1:
+                del tiles[flat]
+            else:
+                tile.remove(sim_unit)
+            next_flat = next_x * size + next_y
+            if next_flat in tiles:
+                tiles[next_flat].append(sim_unit)
+            else:
+                tiles[next_flat] = [sim_unit]
+            moves.append([[x, y], [next_x, next_y], [0, 0], sim_unit.type_index, sim_unit.unit_id, unit.player_index + 1])
+            sim_unit.move_direction = VERTICAL if next_x == x else HORIZONTAL
+            unit.x, unit.y = next_x, next_y
+            sim_unit.steps += 1
+
+    def __find_next_step(self, sim_unit):
+        pathfinder = self._pathfinders.get(sim_unit.target_edge)
+        if pathfinder is None:
+            #One pathfinder per edge keeps each edge's distance field between calls
+            pathfinder = self._pathfinders[sim_unit.target_edge] = ShortestPathFinder()
+        unit = sim_unit.unit
+        return pathfinder.next_move([unit.x, unit.y], sim_unit.end_points, self.game_state, sim_unit.move_direction)
+
+    def __breach(self, sim_unit, events):
+        unit = sim_unit.unit
+        damage = self.__type_config(unit).get("playerBreachDamage", 1)
+        events["breach"].append([[unit.x, unit.y], float(damage), sim_unit.type_index, sim_unit.unit_id, unit.player_index + 1])
+        if unit.player_index == 0:
+            self.game_state.enemy_health -= damage
+        else:
+            self.game_state.my_health -= damage
+        self.game_state._player_resources[unit.player_index]['SP'] += damage * self._SP_per_damage
+        unit.health = 0
+        #A breaching unit leaves the board at once, so it does not attack this frame
+        self.__remove(sim_unit, events)
+        self._hit.append(sim_unit)
+
+    def __self_destruct(self, sim_unit, events):
+        unit = sim_unit.unit
+        type_config = self.__type_config(unit)
+        targets = []
+        if sim_unit.steps >= type_config.get("selfDestructStepsRequired", 0):
+            radius = type_config.get("selfDestructRange", 0)
+            damage_f = type_config.get("selfDestructDamageTower", 0)
+            damage_i = type_config.get("selfDestructDamageWalker", 0)
+            enemy = 1 - unit.player_index
+            for tiles, damage in ((self._structure_tiles[enemy], damage_f), (self._mobile_tiles[enemy], damage_i)):
+                if damage > 0:
+                    targets.extend((target, damage) for target in self.__units_in_range(tiles, unit.x, unit.y, radius))
+            #The engine reports one damage per self destruct, the damage its targets took
+            damage = max(damage for _, damage in targets) if targets else max(damage_f, damage_i)
+            events["selfDestruct"].append([[unit.x, unit.y], [[target.unit.x, target.unit.y] for target, _ in targets], float(damage),
+                sim_unit.type_index, sim_unit.unit_id, unit.player_index + 1])
+        for target, damage in targets:
+            self.__damage(target, damage, events)
+        unit.health = 0
+        self._hit.append(sim_unit)
+
+    def __type_config(self, unit):
+        type_config = self.config["unitInformation"][self.rules.UNIT_TYPE_TO_INDEX[unit.unit_type]]
+        if unit.upgraded and "upgrade" in type_config:
+            type_config = dict(type_config, **type_config["upgrade"])
+        return type_config
+
+    def __units_in_range(self, tiles, x, y, radius):
+        """Gets the SimulatedUnits in tiles within radius of [x, y], the same locations as GameMap.get_locations_in_range
+        """
+        if not tiles:
+            return []
+        size = self._size
+        found = []
+        for dx, dy in range_offsets(radius, self.rules.hit_radius):
+            if 0 <= x + dx < size and 0 <= y + dy < size:
+                tile = tiles.get((x + dx) * size + y + dy)
+                if tile:
+                    found.extend(tile)
+        return found
+
+    def __attack(self, events):
+        #Bounds of each player's mobile units, so attackers far from all of them skip searching for one
+        bounds = [self.__bounds(tiles) for tiles in self._mobile_tiles]
+        hit_radius = self.rules.hit_radius
+        for sim_unit in self._attackers:
+            if sim_unit.removed:
+                continue
+            unit = sim_unit.unit
+            stats = unit._stats
+            mobile_near = False
+            enemy_bounds = bounds[1 - unit.player_index]
+            if stats.damage_i > 0 and enemy_bounds is not None:
+                min_x, max_x, min_y, max_y = enemy_bounds
+                reach = stats.attackRange + hit_radius
+                mobile_near = min_x - unit.x < reach and unit.x - max_x < reach and min_y - unit.y < reach and unit.y - max_y < reach
+            if not mobile_near and stats.damage_f <= 0:
+                continue
+            target = self.__choose_target(unit, stats, mobile_near)
+            if target is None:
+                continue
+            target_unit = target.unit
+            damage = stats.damage_f if target_unit._stats.stationary else stats.damage_i
+            events["attack"].append([[unit.x, unit.y], [target_unit.x, target_unit.y], float(damage), sim_unit.type_index,
+                sim_unit.unit_id, target.unit_id, unit.player_index + 1])
+            self.__damage(target, damage, events)
+
+    def __bounds(self, tiles):
+        if not tiles:
+            return None
+        size = self._size
+        xs = [flat // size for flat in tiles]
+        ys = [flat % size for flat in tiles]
+        return min(xs), max(xs), min(ys), max(ys)
+
+    def __damage(self, sim_unit, damage, events):
+        unit = sim_unit.unit
+        if unit._stats.stationary and unit.x * self._size + unit.y not in self._copied_structures:
+            unit = self.__writable_structure(unit.x, unit.y)
+        unit.health -= damage
+        self._hit.append(sim_unit)
+        events["damage"].append([[unit.x, unit.y], float(damage), sim_unit.type_index, sim_unit.unit_id, unit.player_index + 1])
+
+    def __choose_target(self, attacker, stats, mobile_near):
+        """Picks the same target as GameState.get_target, from the units that still have health.
+
+        Mobile units are always preferred, so structures are only searched when no mobile unit is in range.
+        Units on different tiles can not tie on every targeting rule, as that would need an attacker halfway
+        between two columns, so the tiles can be searched in any order.
+        mobile_near is False when no enemy mobile unit can be in range, so they are not searched.
+        """
+        enemy = 1 - attacker.player_index
+        x, y = attacker.x, attacker.y
+        size = self._size
+        if mobile_near:
+            in_range = self.__tiles_in_range(x, y, stats.attackRange)
+            tiles = self._mobile_tiles[enemy]
+            if len(tiles) < len(in_range):
+                candidates = [(tile, in_range[flat]) for flat, tile in tiles.items() if flat in in_range]
+            else:
+                candidates = [(tiles[flat], distance) for flat, distance in in_range.items() if flat in tiles]
+            target = self.__best_target(attacker, candidates)
+            if target is not None:
+                return target
+        if stats.damage_f > 0 and self._structure_tiles[enemy]:
+            #Structures only leave the board when they die, which clears these
+            key = (x * size + y, stats.attackRange, enemy)
+            candidates = self._structures_in_range.get(key)
+            if candidates is None:
+                tiles = self._structure_tiles[enemy]
+                candidates = self._structures_in_range[key] = [(tiles[flat], distance)
+                    for flat, distance in self.__tiles_in_range(x, y, stats.attackRange).items() if flat in tiles]
+            return self.__best_target(attacker, candidates)
+        return None
+
+    def __best_target(self, attacker, candidates):
+        """Picks the target GameState.get_target would from (tile, squared distance) pairs, or None if none have health
+        """
+        center_x = self._center_x
+        y_sign = 1 if attacker.player_index == 0 else -1
+        target = None
+        best = None
+        for tile, distance in candidates:
+            for candidate in tile:
+                unit = candidate.unit
+                if unit.health <= 0:
+                    continue
+                key = (distance, unit.health, y_sign * unit.y, -abs(center_x - unit.x))
+                if best is None or key < best:
+                    target = candidate
+                    best = key
+        return target
+
+    def __tiles_in_range(self, x, y, radius):
+        """Maps the flat index of each location on the board within radius of [x, y] to its squared distance, which orders the same as distance
+        """
+        size = self._size
+        key = (x * size + y, radius)
+        in_range = self._in_range.get(key)
+        if in_range is None:
+            in_range = self._in_range[key] = {tx * size + ty: (tx - x) ** 2 + (ty - y) ** 2
+                for tx, ty in self._game_map._locations_in_range((x, y), radius)}
+        return in_range
+
+    def __remove_dead(self, events):
+        hit = self._hit
+        self._hit = []
+        if not any(sim_unit.removed or sim_unit.unit.health <= 0 for sim_unit in hit):
+            return
+        survivors = []
+        for sim_unit in self.units:
+            if sim_unit.removed:
+                continue
+            if sim_unit.unit.health > 0:
+                survivors.append(sim_unit)
+            else:
+                self.__remove(sim_unit, events)
+        self.units = survivors
+        self._movers = [sim_unit for sim_unit in self._movers if not sim_unit.removed]
+        self._attackers = [sim_unit for sim_unit in self._attackers if not sim_unit.removed]
+        self._supports = [sim_unit for sim_unit in self._supports if not sim_unit.removed]
+
+    def __remove(self, sim_unit, events):
+        unit = sim_unit.unit
+        sim_unit.removed = True
+        flat = unit.x * self._size + unit.y
+        events["death"].append([[unit.x, unit.y], sim_unit.type_index, sim_unit.unit_id, unit.player_index + 1, False])
+        tiles = self.__tiles(unit)
+        tile = tiles[flat]
+        tile.remove(sim_unit)
+        if not tile:
+            del tiles[flat]
+        if unit.stationary:
+            self._game_map._set_tile(unit.x, unit.y, [])
+            self._next_steps.clear()
+            self._structures_in_range.clear()
@@ -1,11 +1,31 @@
 import unittest
+from unittest import mock
+import asyncio
 import json
+import os
+import glob
+import collections
+import sys
+import copy
+import gc
+import pickle
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from .algocore import AlgoCore
+from .async_algocore import AsyncAlgoCore
 from .game_state import GameState
 from .unit import GameUnit
+from .simulator import Simulator
+from . import navigation
+from . import game_map
+from . import game_state
+from .unit_store import UnitStore
+from .rules import compile_rules
+from . import rules
 
 class BasicTests(unittest.TestCase):
 
-    def make_turn_0_map(self):
+    def make_turn_0_map(self, **kwargs):
         config = """
             {
             "seasonCompatibilityModeP1": 5,
@@ -188,7 +208,7 @@ class BasicTests(unittest.TestCase):
         """
         turn_0 = """{"p2Units":[[],[],[],[],[],[],[]],"turnInfo":[0,0,-1],"p1Stats":[30.0,25.0,5.0,0],"p1Units":[[],[],[],[],[],[],[]],"p2Stats":[30.0,25.0,5.0,0],"events":{"selfDestruct":[],"breach":[],"damage":[],"shield":[],"move":[],"spawn":[],"death":[],"attack":[],"melee":[]}}"""
         
-        state = GameState(json.loads(config), turn_0)
+        state = GameState(json.loads(config), turn_0, **kwargs)
         state.suppress_warnings(True)
         return state
 
@@ -215,6 +235,46 @@ class BasicTests(unittest.TestCase):
         self.assertEqual([("DF", 13, 6)], game._build_stack, "Build queue is wrong!")
         self.assertEqual([("SI", 13, 0), ("SI", 13, 0), ("SI", 13, 0)], game._deploy_stack, "Deploy queue is wrong!")
 
+    def test_spawn_many(self):
+        game = self.make_turn_0_map()
+        single = self.make_turn_0_map()
+        spawns = [("FF", [12, 10]), ("FF", [12, 10]), ("DF", [13, 9], 1), ("PI", [13, 0], 3), ("PI", (14, 0), 10), ("EF", [14, 20]), ("XX", [13, 0], 1)]
+        with mock.patch.object(game, "can_spawn", wraps=game.can_spawn) as can_spawn:
+            self.assertEqual([1, 0, 1, 3, 2, 0, 0], game.attempt_spawn_many(spawns), "Wrong number spawned per entry")
+        self.assertEqual(6, can_spawn.call_count, "Each entry should be validated once")
+        for spawn in spawns:
+            if spawn[0] != "XX":
+                single.attempt_spawn(spawn[0], spawn[1], spawn[2] if len(spawn) > 2 else 1)
+        self.assertEqual(single.get_resources(), game.get_resources(), "Batch spawning charged different resources")
+        self.assertEqual(single._build_stack + single._deploy_stack, game._build_stack + game._deploy_stack, "Batch spawning queued different actions")
+        self.assertEqual(5, len(game.game_map[13, 0]) + len(game.game_map[14, 0]), "Expected five scouts on the map")
+
+        config = json.loads(json.dumps(game.config))
+        next(unit for unit in config["unitInformation"] if unit.get("shorthand") == "PI")["cost2"] = 0.1
+        stacked, single = (GameState(config, self.make_turn_0_map().serialized_string) for _ in range(2))
+        for state in (stacked, single):
+            state._player_resources[0]["MP"] = 1.0
+        self.assertEqual(sum(single.attempt_spawn("PI", [13, 0]) for _ in range(10)), stacked.attempt_spawn("PI", [13, 0], 10), "Fractional costs should round as when spawning one at a time")
+        self.assertEqual(single.get_resources(), stacked.get_resources(), "Stacked spawning charged different fractional resources")
+
+    def test_upgrade_and_remove_many(self):
+        game = self.make_turn_0_map()
+        game.attempt_spawn("FF", [[12, 10], [13, 10], [14, 10]])
+        game.game_map.add_unit("FF", [14, 20], 1)
+        locations = [[12, 10], [13, 10], [12, 10], [13, 11], [14, 20], [30, 30]]
+        self.assertEqual([True, True, False, False, False, False], game.attempt_upgrade_many(locations), "Wrong upgrade outcomes")
+        self.assertEqual([True, False, True], game.attempt_remove_many([[14, 10], [13, 11], [12, 10]]), "Wrong removal outcomes")
+        self.assertEqual([("UP", 12, 10), ("UP", 13, 10), ("RM", 14, 10), ("RM", 12, 10)], game._build_stack[3:], "Wrong build stack")
+        self.assertTrue(game.contains_stationary_unit([12, 10]).upgraded, "Expected the upgraded wall")
+
+        with game.transaction():
+            game.game_map.remove_unit([13, 10])
+            self.assertFalse(game.contains_stationary_unit([13, 10]), "Removed structure is still found")
+        self.assertIs(game.game_map[13, 10][0], game.contains_stationary_unit([13, 10]), "Rollback did not restore the structure")
+        fork = game.fork()
+        fork.game_map.add_unit("DF", [5, 10])
+        self.assertFalse(game.contains_stationary_unit([5, 10]), "Structure added to a fork was found on the original")
+
     def test_trivial_functions(self):
         game = self.make_turn_0_map()
 
@@ -225,6 +285,117 @@ class BasicTests(unittest.TestCase):
         self.assertEqual(0, len(game.game_map.get_locations_in_range([-500,-500], 10)), "Invalid tiles are being marked as in range")
         self.assertEqual(1, len(game.game_map.get_locations_in_range([13,13], 0)), "A location should be in range of itself")
     
+    def test_map_iteration(self):
+        game = self.make_turn_0_map()
+        locations = list(game.game_map)
+        self.assertEqual(420, len(locations), "The board should have 420 locations")
+        self.assertEqual([13, 0], locations[0], "Iteration should start at the bottom of the board")
+        self.assertEqual([14, 27], locations[-1], "Iteration should end at the top of the board")
+        pairs = sum(1 for _ in game.game_map for _ in game.game_map)
+        self.assertEqual(420 * 420, pairs, "Nested iteration over the map should visit every pair of locations")
+
+        self.assertTrue(game.game_map.in_arena_bounds([0, 13]), "[0, 13] is on the left corner of the board")
+        self.assertFalse(game.game_map.in_arena_bounds([0, 12]), "[0, 12] is off the board")
+        self.assertFalse(game.game_map.in_arena_bounds([28, 14]), "[28, 14] is off the board")
+        self.assertTrue(game.game_map.is_on_edge([13, 0], game.game_map.BOTTOM_LEFT), "[13, 0] is on the bottom left edge")
+        self.assertFalse(game.game_map.is_on_edge([13, 1], game.game_map.BOTTOM_LEFT), "[13, 1] is not on an edge")
+
+    def test_structure_masks(self):
+        game = self.make_turn_0_map()
+        game_map = game.game_map
+        game_map.add_unit("FF", [13, 14], 1)
+        game_map.add_unit("DF", [14, 15], 1)
+        game_map.add_unit("DF", [5, 20], 1)
+        game_map.add_unit("EF", [13, 13], 0)
+        game_map.add_unit("PI", [14, 14], 1)
+        game_map.add_unit("FF", [13, 13], 0)
+        game_map.remove_unit([5, 20])
+        game_map[13, 14] = []
+
+        self.assertEqual(1, game_map.count_structures(1), "Expected one enemy structure")
+        self.assertEqual(1, game_map.count_structures(0, "FF"), "Replacing a structure should update its type")
+        self.assertEqual(0, game_map.count_structures(0, "EF"), "Replaced structure is still counted")
+        self.assertEqual(1, game_map.count_structures(1, mask=game_map.region_mask(y_values=[14, 15])), "Expected one enemy structure in rows 14-15")
+        self.assertEqual(0, game_map.count_structures(1, mask=game_map.region_mask(x_values=range(14))), "Expected no enemy structures on the left")
+        self.assertEqual(1, game_map.count_structures(mask=game_map.locations_mask([[13, 13], [0, 0]])), "Expected one structure at the given locations")
+        self.assertEqual(game.game_map.structure_mask(), game_map.structure_mask(0) | game_map.structure_mask(1), "Player masks should cover all structures")
+
+    def test_fork(self):
+        game = self.make_turn_0_map()
+        game.game_map.add_unit("DF", [13, 10], 0)
+        game.game_map.add_unit("FF", [14, 20], 1)
+        path = game.find_path_to_edge([13, 0])
+        resources = game.get_resources()
+
+        fork = game.fork()
+        fork.game_map.add_unit("FF", [12, 10], 0)
+        fork.game_map.add_unit("PI", [3, 10], 0)
+        fork.game_map.remove_unit([14, 20])
+        self.assertEqual(1, fork.attempt_upgrade([13, 10]), "Expected the forked turret to upgrade")
+        self.assertEqual(1, fork.attempt_spawn("PI", [13, 0]), "Expected to spawn on the fork")
+
+        self.assertFalse(game.game_map[13, 10][0].upgraded, "Upgrading on the fork changed the original unit")
+        self.assertTrue(fork.game_map[13, 10][0].upgraded, "Upgrade missing on the fork")
+        self.assertEqual([], game.game_map[12, 10], "Unit added to the fork appeared on the original")
+        self.assertEqual([], game.game_map[3, 10], "Mobile unit added to the fork appeared on the original")
+        self.assertEqual(1, len(game.game_map[14, 20]), "Unit removed from the fork disappeared from the original")
+        self.assertEqual(resources, game.get_resources(), "Spending on the fork changed the original resources")
+        self.assertEqual([], game._build_stack + game._deploy_stack, "Fork actions were added to the original stacks")
+        self.assertEqual(1, game.game_map.count_structures(1), "Fork changed the original structure masks")
+        self.assertEqual(path, game.find_path_to_edge([13, 0]), "Original path changed after editing the fork")
+
+        game.game_map.add_unit("FF", [5, 10], 0)
+        self.assertEqual([], fork.game_map[5, 10], "Unit added to the original appeared on the fork")
+
+        writable = game.game_map._writable_structure(13, 10)
+        self.assertIsNot(fork.game_map[13, 10][0], writable, "The original should copy a structure it shares with the fork")
+        self.assertIs(writable, game.game_map._writable_structure(13, 10), "A tile should only be copied once after a fork")
+        self.assertIsNot(game._shortest_path_finder, fork._shortest_path_finder, "Forks should get their own pathfinder by default")
+
+    def test_rollback(self):
+        game = self.make_turn_0_map()
+        game.game_map.add_unit("DF", [13, 10], 0)
+        game.game_map.add_unit("PI", [14, 0], 0)
+        game.game_map.add_unit("SI", [14, 0], 0)
+        turret = game.game_map[13, 10][0]
+        resources = game.get_resources()
+        mask = game.game_map.structure_mask()
+        path = game.find_path_to_edge([13, 0])
+
+        outer = game.checkpoint()
+        game.attempt_spawn("FF", [[12, 10], [11, 10]])
+        with game.transaction(rollback=False):
+            game.attempt_upgrade([13, 10])
+        self.assertTrue(game.game_map[13, 10][0].upgraded, "Committed upgrade was undone")
+        with game.transaction():
+            game.game_map.remove_unit([14, 0])
+            game.attempt_spawn("PI", [13, 0], 2)
+            game.attempt_remove([13, 10])
+        self.assertEqual(2, len(game.game_map[14, 0]), "Inner rollback did not restore the mobile units")
+        self.assertEqual(3, len(game._build_stack), "Inner rollback did not truncate the build stack")
+        game.rollback(outer)
+
+        self.assertIs(turret, game.game_map[13, 10][0], "Rollback did not restore the original unit")
+        self.assertFalse(turret.upgraded, "Upgrade was applied to the original unit")
+        self.assertEqual([], game.game_map[12, 10], "Rollback did not remove the spawned wall")
+        self.assertEqual(resources, game.get_resources(), "Rollback did not restore resources")
+        self.assertEqual([], game._build_stack + game._deploy_stack, "Rollback did not empty the stacks")
+        self.assertEqual(mask, game.game_map.structure_mask(), "Rollback did not restore the structure mask")
+        self.assertEqual(path, game.find_path_to_edge([13, 0]), "Path changed after rollback")
+        self.assertIsNone(game.game_map._undo_log, "Changes are still being recorded after the last checkpoint closed")
+
+    def test_fork_then_rollback(self):
+        game = self.make_turn_0_map()
+        game.game_map.add_unit("DF", [13, 10], 0)
+        fork = game.fork()
+        token = game.checkpoint()
+        game.attempt_upgrade([13, 10])
+        game.rollback(token)
+        self.assertIs(fork.game_map[13, 10][0], game.game_map[13, 10][0], "Rollback should restore the unit shared with the fork")
+        game.attempt_upgrade([13, 10])
+        self.assertTrue(game.game_map[13, 10][0].upgraded, "Upgrade missing on the original")
+        self.assertFalse(fork.game_map[13, 10][0].upgraded, "Upgrading after a rollback changed the fork's unit")
+
     def test_get_units(self):
         game = self.make_turn_0_map()
         self.assertEqual(0, len(game.game_map[13,13]), "There should not be a unit on this location")
@@ -240,6 +411,21 @@ class BasicTests(unittest.TestCase):
         self.assertEqual(1, len(game.game_map.get_locations_in_range([13,13], 0)), "We should be in 0 range of ourself")
         self.assertEqual(37, len(game.game_map.get_locations_in_range([13,13], 3.5)), "Wrong number of tiles in range")
 
+    def test_range_tables(self):
+        game = self.make_turn_0_map()
+        for location in ([13, 13], [0, 13], [13, 0], [20, 20], [-1, 13]):
+            for radius in (0, 1, 2.5, 3.5, 4.5, 9):
+                expected = []
+                for i in range(location[0] - 10, location[0] + 11):
+                    for j in range(location[1] - 10, location[1] + 11):
+                        if game.game_map.in_arena_bounds([i, j]) and game.game_map.distance_between_locations(location, [i, j]) < radius + 0.01:
+                            expected.append([i, j])
+                self.assertEqual(expected, game.game_map.get_locations_in_range(location, radius), "Wrong tiles in range {} of {}".format(radius, location))
+                self.assertEqual(expected, game.game_map.get_locations_in_range(location, radius), "Cached tiles in range {} of {} changed".format(radius, location))
+        for step in range(200):
+            game.game_map.get_locations_in_range([13, 13], step / 50)
+        self.assertGreaterEqual(game_map.RANGE_OFFSETS_CACHE_SIZE, game_map.range_offsets.cache_info().currsize, "The range offset cache should stay bounded")
+
     def _test_get_attackers(self):
         game = self.make_turn_0_map()
         
@@ -256,6 +442,384 @@ class BasicTests(unittest.TestCase):
         game.game_map.add_unit("DF", [14,14], 1)
         self.assertEqual(3, len(game.get_attackers([13,13], 0)), "We should be in danger from 3 places")
 
+    def test_decoded_state(self):
+        game = self.make_turn_0_map()
+        config = dict(game.config, replaySave=0)
+        turn = json.loads(game.serialized_string)
+        frame = dict(turn, turnInfo=[1, 0, 0])
+        end = dict(turn, turnInfo=[2, 0, 0])
+        messages = [json.dumps(message) + "\n" for message in (config, turn, frame, end)]
+
+        for decoded in (False, True):
+            received = []
+
+            class RecordingAlgo(AlgoCore):
+                decoded_messages = decoded
+
+                def on_turn(self, turn_state):
+                    received.append(turn_state)
+                    state = GameState(self.config, turn_state)
+                    received.append(state.get_resources())
+                    received.append(json.loads(state.serialized_string))
+
+                def on_action_frame(self, frame_state):
+                    received.append(frame_state)
+
+            with mock.patch("gamelib.algocore.get_command", side_effect=messages), mock.patch("gamelib.algocore.debug_write"):
+                RecordingAlgo().start()
+            if decoded:
+                expected = [turn, game.get_resources(), turn, frame]
+            else:
+                expected = [messages[1], game.get_resources(), turn, messages[2]]
+            self.assertEqual(expected, received, "Expected the {} turn and frame to be passed through".format("decoded" if decoded else "string"))
+
+    def test_turn_budget(self):
+        game = self.make_turn_0_map()
+        config = dict(game.config, replaySave=0, timingAndReplay={"waitTimeBotSoft": 5000})
+        turn = json.loads(game.serialized_string)
+        end = dict(turn, turnInfo=[2, 0, 0])
+        now = [100.0]
+        submitted = []
+
+        def quick(state):
+            state.attempt_spawn("PI", [13, 0])
+            return 1
+
+        def broken(state):
+            state.attempt_spawn("PI", [14, 0], 5)
+            raise ValueError("planner bug")
+
+        def better(state):
+            now[0] += 1
+            state.attempt_spawn("PI", [13, 0], 2)
+            return 2
+
+        def slow(state):
+            now[0] += 3
+            algo.check_deadline()
+            return 3
+
+        class BudgetAlgo(AlgoCore):
+            def on_turn(self, turn_state):
+                submitted.append(self.time_remaining())
+                submitted.append(self.run_anytime(GameState(self.config, turn_state), [quick, broken, better, slow, quick]))
+                now[0] += 5
+
+        algo = BudgetAlgo()
+        messages = [json.dumps(message) + "\n" for message in (config, turn, end)]
+        with mock.patch("gamelib.algocore.get_command", side_effect=messages), mock.patch("gamelib.algocore.debug_write") as debug, \
+                mock.patch("gamelib.algocore.monotonic", side_effect=lambda: now[0]), mock.patch("gamelib.game_state.send_command"):
+            algo.start()
+        self.assertEqual(4.0, submitted[0], "Expected the budget to be 80% of waitTimeBotSoft")
+        self.assertEqual(2, len(submitted[1].game_map[13, 0]), "Expected the best turn found in time to be submitted")
+        logged = " ".join(str(call) for call in debug.call_args_list)
+        self.assertIn("planner slow", logged, "Expected the planner that ran out of time to be logged")
+        self.assertIn("Planner broken failed", logged, "Expected the planner that raised to be logged")
+        self.assertIn("planner bug", logged, "Expected the planner's traceback to be logged")
+        self.assertEqual(0, len(submitted[1].game_map[14, 0]), "The failed planner's turn should not be submitted")
+        self.assertIn("over budget, in phase slow", logged, "Expected the overrun to be logged with its phase")
+        self.assertGreater(0, algo.time_remaining(), "Expected the budget to be used up")
+
+    def test_plan_ahead(self):
+        game = self.make_turn_0_map()
+        config = dict(game.config, replaySave=0)
+        turn = json.loads(game.serialized_string)
+        messages = [config]
+        for turn_number in range(3):
+            messages.append(dict(turn, turnInfo=[0, turn_number, -1]))
+            messages.extend(dict(turn, turnInfo=[1, turn_number, frame]) for frame in range(3))
+        messages.append(dict(turn, turnInfo=[2, 0, 0]))
+        plans = []
+        stopped = []
+
+        class PlanningAlgo(AlgoCore):
+            decoded_messages = True
+
+            def plan_ahead(self, frame_state, cancelled):
+                if frame_state["turnInfo"][1] == 0:
+                    return "plan for turn 1"
+                stopped.append(cancelled.wait(5))
+                return "late plan"
+
+            def on_turn(self, turn_state):
+                plans.append(self.get_plan(1))
+
+        algo = PlanningAlgo()
+        with mock.patch("gamelib.algocore.get_command", side_effect=[json.dumps(message) + "\n" for message in messages]), \
+                mock.patch("gamelib.algocore.debug_write"):
+            algo.start()
+        algo._plan_thread.join(5)
+        self.assertEqual([None, "plan for turn 1", "late plan"], plans, "Expected each turn to get the plan made during the action phase before it")
+        self.assertEqual([True, True], stopped, "Expected the plans to be cancelled when the next turn and the end of the game arrive")
+        self.assertEqual([1, 2, 0], algo.plan_source["turnInfo"], "Expected planning to start from the first frame of the action phase")
+
+    def test_stuck_plan(self):
+        game = self.make_turn_0_map()
+        config = dict(game.config, replaySave=0)
+        turn = json.loads(game.serialized_string)
+        messages = [config]
+        for turn_number in range(3):
+            messages.append(dict(turn, turnInfo=[0, turn_number, -1]))
+            messages.append(dict(turn, turnInfo=[1, turn_number, 0]))
+        messages.append(dict(turn, turnInfo=[2, 0, 0]))
+        release = threading.Event()
+        plans = []
+        threads = []
+
+        class StuckAlgo(AlgoCore):
+            decoded_messages = True
+
+            def plan_ahead(self, frame_state, cancelled):
+                threads.append(threading.current_thread())
+                if frame_state["turnInfo"][1] == 0:
+                    #Ignores cancelled
+                    release.wait(5)
+                    return "stuck plan"
+                return "plan for turn 2"
+
+            def on_turn(self, turn_state):
+                plans.append(self.get_plan(0.05 if turn_state["turnInfo"][1] == 1 else 1))
+
+        algo = StuckAlgo()
+        try:
+            with mock.patch("gamelib.algocore.get_command", side_effect=[json.dumps(message) + "\n" for message in messages]), \
+                    mock.patch("gamelib.algocore.debug_write") as debug:
+                algo.start()
+            self.assertEqual([None, None, "plan for turn 2"], plans, "A stuck plan should not hold up the next one")
+            self.assertTrue(threads[0].is_alive() and threads[0].daemon, "Expected the stuck plan to be left on a daemon thread")
+            self.assertIn("leaving it behind", " ".join(str(call) for call in debug.call_args_list), "Expected the stuck plan to be logged")
+        finally:
+            release.set()
+
+    def test_async_algocore(self):
+        game = self.make_turn_0_map()
+        config = dict(game.config, replaySave=0)
+        turn = json.loads(game.serialized_string)
+        messages = [config]
+        for turn_number in range(2):
+            messages.append(dict(turn, turnInfo=[0, turn_number, -1]))
+            messages.extend(dict(turn, turnInfo=[1, turn_number, frame]) for frame in range(3))
+        messages.append(dict(turn, turnInfo=[2, 0, 0]))
+        progress = []
+        cancelled = []
+        plans = []
+        planner_threads = []
+
+        def planner(fork):
+            planner_threads.append(threading.current_thread())
+            return 1
+
+        class AnalysingAlgo(AsyncAlgoCore):
+            decoded_messages = True
+
+            def plan_ahead(self, frame_state, cancelled):
+                return "plan from turn {}".format(frame_state["turnInfo"][1])
+
+            async def analyse(self, turn_number):
+                try:
+                    while True:
+                        progress.append(turn_number)
+                        await asyncio.sleep(0)
+                except asyncio.CancelledError:
+                    cancelled.append(turn_number)
+                    raise
+
+            async def on_turn(self, turn_state):
+                plans.append(self.get_plan(1))
+                await self.run_anytime(GameState(self.config, turn_state), [planner])
+                self.spawn_task(self.analyse(turn_state["turnInfo"][1]))
+
+            async def on_action_frame(self, frame_state):
+                await asyncio.sleep(0)
+
+        async def play(algo):
+            reader = asyncio.StreamReader()
+            reader.feed_data("".join(json.dumps(message) + "\n" for message in messages).encode())
+            reader.feed_eof()
+            await algo.run(reader)
+            await asyncio.sleep(0)
+
+        algo = AnalysingAlgo()
+        with mock.patch("gamelib.async_algocore.debug_write"), mock.patch("gamelib.algocore.debug_write"), \
+                mock.patch("gamelib.game_state.send_command") as sent:
+            asyncio.run(play(algo))
+        self.assertEqual(4, sent.call_count, "Expected a build and a deploy command for each turn")
+        self.assertEqual([None, "plan from turn 0"], plans, "Expected plan_ahead to run during the action phase as in AlgoCore")
+        self.assertNotIn(threading.main_thread(), planner_threads, "Expected run_anytime to keep the planners off the event loop")
+        self.assertIsNotNone(algo.turn_started, "Expected the turn clock to be started")
+        self.assertEqual({0, 1}, set(progress), "Expected the analysis to run during the action frames")
+        self.assertEqual([0, 1], cancelled, "Expected analysis to be cancelled by the next turn and the end of the game")
+        self.assertEqual(set(), algo.tasks, "Expected no tasks left running")
+
+    def test_lazy_parsing(self):
+        game = self.make_turn_0_map()
+        state = json.loads(game.serialized_string)
+        state["p1Units"] = [[] for _ in range(8)]
+        state["p2Units"] = [[] for _ in range(8)]
+        state["p1Units"][0] = [[13, 10, 60.0, "1"]]
+        state["p2Units"][2] = [[14, 20, 75.0, "2"]]
+        state["p2Units"][7] = [[14, 20, 0.0, "2"]]
+        eager = GameState(game.config, json.dumps(state))
+        lazy = GameState(game.config, json.dumps(state), lazy=True)
+
+        self.assertEqual(eager.get_resources(1), lazy.get_resources(1), "Resources should be parsed immediately")
+        self.assertEqual(eager.enemy_health, lazy.enemy_health, "Health should be parsed immediately")
+        self.assertEqual(0, lazy._game_map.count_structures(), "Units were parsed before the map was used")
+
+        enemy_map = lazy.load_units(1)
+        self.assertEqual(0, enemy_map.count_structures(0), "Loading the enemy parsed your units")
+        self.assertTrue(enemy_map[14, 20][0].upgraded, "Expected the enemy turret to be upgraded")
+        self.assertTrue(lazy.contains_stationary_unit([13, 10]), "Using the map should parse the remaining units")
+        for location in eager.game_map:
+            self.assertEqual(str(eager.game_map[location]), str(lazy.game_map[location]), "Lazy map differs at {}".format(location))
+
+    def test_rules(self):
+        game = self.make_turn_0_map()
+        self.assertIs(compile_rules(game.config), game.rules, "Rules should be compiled once per config")
+        self.assertIs(game.rules, game.game_map.rules, "GameMap should share the GameState rules")
+        with self.assertRaises(AttributeError):
+            game.rules.WALL = "XX"
+        copied = copy.deepcopy(game)
+        self.assertIs(game.rules, copied.rules, "Copies should share the rules")
+        self.assertEqual(game.rules.costs["DF"], pickle.loads(pickle.dumps(game.rules)).costs["DF"], "Rules should survive pickling")
+
+        config = json.loads(json.dumps(game.config))
+        config["unitInformation"][0]["shorthand"] = "XW"
+        config["unitInformation"][0]["cost1"] = 3.0
+        other = GameState(config, game.serialized_string)
+        self.assertEqual([1.0, 0], game.type_cost("FF"), "Expected the original wall cost")
+        self.assertEqual([3.0, 0], other.type_cost("XW"), "Expected the other config's wall cost")
+        self.assertTrue(game.can_spawn("FF", [13, 0]), "A newer config changed the rules of an existing GameState")
+        self.assertIn("XW", other.rules.STRUCTURE_TYPES, "Expected the renamed wall to be a structure")
+        self.assertEqual(game.config["unitInformation"][2]["upgrade"]["attackRange"], game.rules.upgrade_deltas["DF"]["attackRange"][1], "Expected the upgraded turret range")
+
+        for _ in range(3 * rules.RECENT_RULES_KEPT):
+            compile_rules(json.loads(json.dumps(game.config)))
+        gc.collect()
+        self.assertGreaterEqual(rules.RECENT_RULES_KEPT + 2, len(rules._RULES), "Rules nothing uses should not stay cached")
+        self.assertIs(compile_rules(game.config), game.rules, "Rules in use should stay cached")
+
+    def test_deprecated_names(self):
+        game = self.make_turn_0_map()
+        with self.assertWarns(DeprecationWarning):
+            self.assertEqual("FF", game_state.WALL, "Expected the wall from the loaded config")
+        with self.assertWarns(DeprecationWarning):
+            self.assertTrue(game_state.is_stationary("DF"), "Expected a turret to be stationary")
+        with self.assertRaises(AttributeError):
+            game_state.NOT_A_UNIT
+        with mock.patch.object(rules, "_RECENT_RULES", collections.deque()), self.assertWarns(DeprecationWarning):
+            with self.assertRaisesRegex(RuntimeError, "config"):
+                game_state.is_stationary("DF")
+            with self.assertRaisesRegex(AttributeError, "config"):
+                game_state.TURRET
+
+    def test_concurrent_configs(self):
+        game = self.make_turn_0_map()
+        state = json.loads(game.serialized_string)
+        configs = []
+        for i in range(4):
+            config = json.loads(json.dumps(game.config))
+            config["unitInformation"][0]["shorthand"] = "W{}".format(i)
+            config["unitInformation"][0]["cost1"] = float(i + 1)
+            configs.append(config)
+        game.attempt_spawn("FF", [[13, 13], [12, 13]])
+        expected_path = game.find_path_to_edge([13, 0])
+
+        def evaluate(worker):
+            config = configs[worker % len(configs)]
+            wall = config["unitInformation"][0]["shorthand"]
+            results = []
+            for _ in range(30):
+                turn = GameState(config, state)
+                turn.suppress_warnings(True)
+                spawned = turn.attempt_spawn(wall, [[13, 13], [12, 13]])
+                results.append((turn.type_cost(wall)[0], spawned, turn.game_map[13, 13][0].unit_type, turn.fork(share_pathfinder=False).find_path_to_edge([13, 0])))
+            return worker, results
+
+        switch_interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)
+        try:
+            with ThreadPoolExecutor(8) as pool:
+                outcomes = list(pool.map(evaluate, range(8)))
+        finally:
+            sys.setswitchinterval(switch_interval)
+        for worker, results in outcomes:
+            expected = (float(worker % len(configs) + 1), 2, "W{}".format(worker % len(configs)), expected_path)
+            for result in results:
+                self.assertEqual(expected, result, "Worker {} saw another config's rules".format(worker))
+
+    def test_unit_stats(self):
+        game = self.make_turn_0_map()
+        turret = GameUnit("DF", game.config, 0, None, 13, 10)
+        other = GameUnit("DF", game.config, 1, None, 14, 20)
+        upgrade_config = game.config["unitInformation"][2]["upgrade"]
+        self.assertIs(turret._stats, other._stats, "Units of one type should share their stats")
+        self.assertFalse(hasattr(turret, "__dict__"), "GameUnit should not have a per-instance __dict__")
+
+        turret.upgrade()
+        self.assertTrue(turret.upgraded, "Expected the turret to be upgraded")
+        self.assertEqual(upgrade_config.get("attackDamageWalker", other.damage_i), turret.damage_i, "Upgrade did not change damage")
+        self.assertEqual([other.cost[0] + upgrade_config.get("cost1", 0), other.cost[1] + upgrade_config.get("cost2", 0)], turret.cost, "Upgrade did not add its cost")
+        self.assertFalse(other.upgraded, "Upgrading one unit changed another")
+        upgraded_cost = turret.cost
+        turret.upgrade()
+        self.assertEqual(upgraded_cost, turret.cost, "Upgrading twice should not add the upgrade cost again")
+        self.assertIs(game.rules.stats["DF", True], turret._stats, "Upgraded units should share the Rules' upgraded stats")
+
+        other.damage_i = 100
+        self.assertEqual(100, other.damage_i, "Stats should stay assignable")
+        self.assertEqual(game.config["unitInformation"][2].get("attackDamageWalker", 0), GameUnit("DF", game.config).damage_i, "Assigning a stat changed the shared record")
+
+    def test_unit_store(self):
+        game = self.make_turn_0_map()
+        state = json.loads(game.serialized_string)
+        state["p1Units"] = [[] for _ in range(8)]
+        state["p2Units"] = [[] for _ in range(8)]
+        state["p1Units"][2] = [[13, 10, 75.0, "7"]]
+        state["p1Units"][3] = [[13, 0, 15.0, "8"], [13, 0, 15.0, "9"]]
+        state["p2Units"][0] = [[14, 20, 60.0, "10"]]
+        state["p1Units"][7] = [[13, 10, 0.0, "7"]]
+        state["p2Units"][6] = [[14, 20, 0.0, "10"]]
+        game = GameState(game.config, json.dumps(state))
+
+        store = UnitStore.from_state(game.config, state)
+        self.assertEqual(4, len(store), "Expected four units in the store")
+        self.assertEqual([3], store.rows(player_index=1), "Expected the enemy wall in the last row")
+        self.assertEqual(2, len(store.rows(unit_type="PI")), "Expected two scouts")
+        self.assertEqual(1, store.upgraded[store.structure_row(13, 10)], "Expected the turret to be upgraded")
+        self.assertEqual(1, store.pending_removal[store.structure_row(14, 20)], "Expected the wall to be pending removal")
+        self.assertEqual(9, store.unit_id[store.rows_at(13, 0)[1]], "Expected the engine unit id")
+        for other in (store, UnitStore.from_game_map(game.game_map)):
+            for location in game.game_map:
+                expected = [str(unit) for unit in game.game_map[location]]
+                self.assertEqual(expected, [str(unit) for unit in other.units_at(*location)], "Store units differ at {}".format(location))
+        self.assertIs(store.get_unit(0), store.get_unit(0), "Views should be cached")
+
+        original = GameState(game.config, json.dumps(dict(state, p1Units=[[] for _ in range(8)], p2Units=[[] for _ in range(8)])))
+        fork = original.fork()
+        token = fork.game_map.checkpoint()
+        store.place_units(fork.game_map, player_index=0)
+        self.assertEqual(2, len(fork.game_map[13, 0]), "Expected the scouts on the fork")
+        self.assertEqual([], fork.game_map[14, 20], "Expected only the first player's units")
+        self.assertEqual([], original.game_map[13, 0], "Placing units on a fork changed the original")
+        fork.game_map.rollback(token)
+        self.assertEqual([], fork.game_map[13, 0], "Rollback did not remove the placed units")
+        store.place_units(fork.game_map)
+        self.assertIsNot(store.get_unit(store.structure_row(13, 10)), fork.game_map._writable_structure(13, 10), "Placed views should be copied before being changed")
+
+        game.game_map.add_unit("DF", [20, 15], 1)
+        game.game_map.add_unit("DF", [5, 12], 0)
+        game.game_map[5, 12][0].upgrade()
+        store = UnitStore.from_game_map(game.game_map)
+        for player_index in (0, 1):
+            self.assertEqual(game.threat_map(player_index), store.threat_map(player_index), "Store threat map differs from the GameState one")
+            self.assertEqual(game.structure_threat_map(player_index), store.threat_map(player_index, "damage_f"), "Store structure threat map differs")
+            with mock.patch("gamelib.unit_store.np", None):
+                self.assertEqual(game.threat_map(player_index), store.threat_map(player_index), "Threat maps differ without NumPy")
+        columns = store.numpy_columns()
+        store.add("FF", 0, 14, 14, 60.0)
+        self.assertNotEqual(len(columns["x"]), len(store), "numpy_columns should be a copy of the columns")
+
     def test_print_unit(self):
         game = self.make_turn_0_map()
 
@@ -264,6 +828,202 @@ class BasicTests(unittest.TestCase):
         expected_string = "Enemy FF, health: 75.0 location: [14, 13] removal:  upgrade: False "
         self.assertEqual(got_string, expected_string, "Expected {} from print_unit test got {} ".format(expected_string, got_string))
 
+    def test_pathfinding(self):
+        game = self.make_turn_0_map()
+        top_right = game.game_map.get_edge_locations(game.game_map.TOP_RIGHT)
+
+        path = game.find_path_to_edge([13, 0])
+        self.assertEqual([13, 0], path[0], "Paths should start at the starting location")
+        self.assertIn(path[-1], top_right, "A unit on an empty board should reach its target edge")
+        self.assertEqual(29, len(path), "Expected the shortest path across an empty board")
+
+        for x in range(10, 18):
+            game.game_map.add_unit("FF", [x, 5])
+        walled_path = game.find_path_to_edge([13, 0])
+        self.assertIn(walled_path[-1], top_right, "The wall should not cut the unit off from its edge")
+        for location in walled_path:
+            self.assertFalse(game.contains_stationary_unit(location), "Path walks through a structure at {}".format(location))
+        for previous, current in zip(walled_path, walled_path[1:]):
+            self.assertEqual(1, abs(previous[0] - current[0]) + abs(previous[1] - current[1]), "Path steps should be adjacent")
+        self.assertIsNone(game.find_path_to_edge([13, 5]), "Pathing from a blocked location should return None")
+
+    def test_path_cache(self):
+        game = self.make_turn_0_map()
+        empty_path = game.find_path_to_edge([13, 0])
+        self.assertEqual(empty_path, game.find_path_to_edge([13, 0]), "A cached path should match the computed path")
+        self.assertEqual((1, 1), (game.path_cache_hits, game.path_cache_misses), "Expected one cache miss then one hit")
+
+        game.game_map.add_unit("FF", [14, 2])
+        blocked_path = game.find_path_to_edge([13, 0])
+        self.assertNotIn([14, 2], blocked_path, "Adding a structure should invalidate cached paths through it")
+        self.assertEqual(2, game.path_cache_misses, "A new structure layout should miss the cache")
+
+        game.game_map.remove_unit([14, 2])
+        self.assertEqual(empty_path, game.find_path_to_edge([13, 0]), "Restoring the layout should restore the path")
+        self.assertEqual(2, game.path_cache_hits, "A previously seen layout should hit the cache")
+
+    def test_incremental_pathing(self):
+        full = self.make_turn_0_map()
+        incremental = self.make_turn_0_map()
+        incremental.enable_incremental_pathing()
+
+        placements = [[14, 2], [15, 3], [16, 4], [13, 4], [12, 5], [15, 3], [11, 6], [14, 2]]
+        for location in placements:
+            for game in (full, incremental):
+                if game.contains_stationary_unit(location):
+                    game.game_map.remove_unit(location)
+                else:
+                    game.game_map.add_unit("FF", location)
+            for start in ([13, 0], [3, 10], [20, 6]):
+                self.assertEqual(full.find_path_to_edge(start), incremental.find_path_to_edge(start),
+                    "Incremental path from {} differs after toggling {}".format(start, location))
+
+    def test_find_paths_to_edge_many(self):
+        game = self.make_turn_0_map()
+        for x in range(6, 22):
+            game.game_map.add_unit("FF", [x, 8])
+        game.game_map.add_unit("FF", [13, 0])
+
+        for player_index, edges in ((0, [game.game_map.BOTTOM_LEFT, game.game_map.BOTTOM_RIGHT]), (1, [game.game_map.TOP_LEFT, game.game_map.TOP_RIGHT])):
+            starts = [location for edge in edges for location in game.game_map.get_edge_locations(edge)]
+            paths = game.find_paths_to_edge_many(player_index=player_index)
+            self.assertEqual(28, len(paths), "Expected a path for every edge spawn location")
+            fresh = self.make_turn_0_map()
+            for x in range(6, 22):
+                fresh.game_map.add_unit("FF", [x, 8])
+            fresh.game_map.add_unit("FF", [13, 0])
+            for start, path in zip(starts, paths):
+                self.assertEqual(fresh.find_path_to_edge(start), path, "Batch path from {} differs from find_path_to_edge".format(start))
+
+    @unittest.skipIf(navigation.np is None, "NumPy is not installed")
+    def test_numpy_pathing_engine(self):
+        python_game = self.make_turn_0_map()
+        numpy_game = self.make_turn_0_map(pathing_engine=navigation.NUMPY_ENGINE)
+        for game in (python_game, numpy_game):
+            for x in range(3, 25):
+                if x != 15:
+                    game.game_map.add_unit("FF", [x, 10])
+            game.game_map.add_unit("FF", [20, 16], 1)
+        self.assertEqual(navigation.NUMPY_ENGINE, numpy_game._shortest_path_finder.engine, "NumPy engine was not selected")
+        for player_index in (0, 1):
+            self.assertEqual(python_game.find_paths_to_edge_many(player_index=player_index), numpy_game.find_paths_to_edge_many(player_index=player_index),
+                "NumPy engine paths differ for player {}".format(player_index))
+
+    def test_threat_map(self):
+        game = self.make_turn_0_map()
+        game.game_map.add_unit("DF", [13, 16], 1)
+        game.game_map.add_unit("DF", [16, 17], 1)
+        game.game_map[16, 17][0].upgrade()
+        game.game_map.add_unit("DF", [13, 11], 0)
+        threat = game.threat_map(0)
+        for location in game.game_map:
+            expected = sum(unit.damage_i for unit in game.get_attackers(location, 0) if unit.stationary)
+            self.assertEqual(expected, threat[location[0]][location[1]], "Wrong threat at {}".format(location))
+        self.assertEqual(0, threat[0][13], "Expected no threat out of range")
+        self.assertEqual(0, game.structure_threat_map(0)[13][13], "Turrets should not threaten structures")
+        self.assertIs(list, type(threat), "Expected a list of lists whether or not NumPy is installed")
+        if navigation.np is not None:
+            self.assertEqual(threat, game.threat_map(0, as_numpy=True).tolist(), "The NumPy threat map should hold the same values")
+
+    def test_get_targets(self):
+        game = self.make_turn_0_map()
+        game.game_map.add_unit("DF", [13, 16], 1)
+        game.game_map.add_unit("FF", [12, 15], 1)
+        game.game_map.add_unit("DF", [13, 11], 0)
+        game.game_map.add_unit("PI", [13, 13], 0)
+        game.game_map.add_unit("PI", [14, 13], 0)
+        game.game_map.add_unit("SI", [12, 14], 0)
+        game.game_map.add_unit("EI", [14, 14], 1)
+        game.game_map[14, 13][0].health = 5
+        targets = game.get_targets()
+        self.assertEqual(6, len(targets), "Expected one entry per unit that can attack")
+        for attacker, target in targets:
+            expected = game.get_target(attacker)
+            self.assertIs(expected, target, "Expected {} to target {}, got {}".format(attacker, expected, target))
+        self.assertEqual([attacker for attacker, _ in game.get_targets(1)], [game.game_map[13, 16][0], game.game_map[14, 14][0]], "Expected only player 1's attackers")
+
+    def test_simulator(self):
+        game = self.make_turn_0_map()
+        game.attempt_spawn("PI", [13, 0], 2)
+        path = game.find_path_to_edge([13, 0])
+        sim = Simulator(game, [["FF", [3, 17], 1]])
+        events = sim.run()
+        moves = [event["move"][0][1] for event in events if event["move"]]
+        self.assertEqual(path[1:], moves, "Expected the scouts to follow find_path_to_edge")
+        self.assertEqual(2, sum(len(event["breach"]) for event in events), "Expected both scouts to breach")
+        self.assertEqual(28, sim.game_state.enemy_health, "Expected each breach to cost the enemy 1 health")
+        self.assertEqual(27, sim.game_state.get_resource(0), "Expected each breach to earn 1 SP")
+        self.assertEqual(30, game.enemy_health, "The simulated GameState should be unchanged")
+        self.assertEqual(2, len(game.game_map[13, 0]), "The simulated GameState should be unchanged")
+        self.assertEqual(1, len(sim.game_state.game_map[3, 17]), "Expected the spawned wall to be on the simulated map")
+
+    def test_simulator_shield(self):
+        game = self.make_turn_0_map()
+        config = copy.deepcopy(game.config)
+        config["unitInformation"][1].update(shieldRange=5.0, shieldPerUnit=3, shieldBonusPerY=0.5)
+        game = GameState(config, game.serialized_string)
+        game.game_map.add_unit("EF", [10, 3], 0)
+        game.attempt_spawn("PI", [13, 0], 2)
+        sim = Simulator(game)
+        support = next(sim_unit for sim_unit in sim.units if sim_unit.unit.unit_type == "EF")
+        scouts = [sim_unit for sim_unit in sim.units if sim_unit.unit.unit_type == "PI"]
+        shields = sim.step()["shield"]
+        #[giver location, target location, shield amount, shielded unit type, giver id, target id, giver player]
+        expected = [[[10, 3], [13, 0], 4.5, 3, support.unit_id, scout.unit_id, 1] for scout in scouts]
+        self.assertEqual(expected, shields, "Expected one shield per scout, shaped like the engine's shield events")
+        self.assertIsInstance(shields[0][2], float, "Shield amounts should be floats like the engine's")
+        self.assertEqual([19.5, 19.5], [scout.unit.health for scout in scouts], "Expected the shield to add health")
+        self.assertEqual(0, sum(len(events["shield"]) for events in sim.run()[1:]), "A support should shield each unit once")
+
+    def test_simulator_replays(self):
+        replay_files = sorted(glob.glob(os.path.join(os.path.dirname(__file__), "..", "..", "replays", "*.replay")))
+        if not replay_files:
+            self.skipTest("No replays to check the simulator against")
+
+        def summary_field(field):
+            #Unit ids are numbered differently, so only their type is compared. Target lists are in no particular order.
+            if isinstance(field, str):
+                return str
+            if isinstance(field, list):
+                items = tuple(map(summary_field, field))
+                return tuple(sorted(items)) if field and isinstance(field[0], list) else items
+            return type(field), field
+
+        def event_summary(events):
+            return collections.Counter(tuple(map(summary_field, event)) for event in events)
+        for replay_file in replay_files:
+            with open(replay_file) as replay:
+                lines = [line for line in replay.read().split("\n") if line.strip()]
+            config = json.loads(lines[0])
+            turns = []
+            for line in lines[1:]:
+                frame = json.loads(line)
+                if frame.get("turnInfo", [None])[0] == 0:
+                    turns.append((line, []))
+                elif frame.get("turnInfo", [None])[0] == 1 and turns:
+                    turns[-1][1].append(frame)
+            for deploy_line, frames in turns:
+                if not frames:
+                    continue
+                game = GameState(config, deploy_line)
+                spawns = [[game.rules.unit_types[event[1]], event[0], event[3] - 1] for event in frames[0]["events"]["spawn"]]
+                sim = Simulator(game, spawns)
+                for frame in frames:
+                    sim.step()
+                    if frame["p1Stats"][0] == -1:
+                        #The engine records crashed games with -1 health
+                        break
+                    expected = collections.Counter((player_index, type_index, x, y, round(health, 3))
+                        for player_index, key in enumerate(("p1Units", "p2Units")) for type_index, units in enumerate(frame[key][:6]) for x, y, health, _ in units)
+                    actual = collections.Counter((sim_unit.unit.player_index, sim_unit.type_index, sim_unit.unit.x, sim_unit.unit.y, round(sim_unit.unit.health, 3))
+                        for sim_unit in sim.units if sim_unit.unit.health > 0)
+                    self.assertEqual(expected, actual, "Units differ from {} turn {}".format(os.path.basename(replay_file), frame["turnInfo"]))
+                    self.assertEqual([frame["p1Stats"][0], frame["p2Stats"][0]], [sim.game_state.my_health, sim.game_state.enemy_health],
+                        "Health differs from {} turn {}".format(os.path.basename(replay_file), frame["turnInfo"]))
+                    for name in ("selfDestruct", "shield"):
+                        self.assertEqual(event_summary(frame["events"][name]), event_summary(sim.events[-1][name]),
+                            "{} events differ from {} turn {}".format(name, os.path.basename(replay_file), frame["turnInfo"]))
+
     def test_future_MP(self):
         game = self.make_turn_0_map()
 
@@ -271,6 +1031,18 @@ class BasicTests(unittest.TestCase):
         self.future_turn_testing_function(game, 11.6, 2)
         self.future_turn_testing_function(game, 13.7, 3)
 
+    def test_future_MP_horizon(self):
+        game = self.make_turn_0_map()
+        game._player_resources[1]['MP'] = 7.5
+        game.turn_number = 8
+        horizon = game.project_future_MP_horizon(25)
+        for player_index in (0, 1):
+            for turns in range(1, 26):
+                expected = game.project_future_MP(turns, player_index)
+                self.assertEqual(horizon[player_index][turns - 1], expected, "Expected player {} to have {} MP in {} turns, got {}".format(player_index, expected, turns, horizon[player_index][turns - 1]))
+        rules = game.rules
+        self.assertEqual(rules.mp_income(250), rules.mp_per_round + rules.mp_growth_rate * (250 // rules.mp_schedule_interval), "mp_income should fall back to the formula past the table")
+
     def future_turn_testing_function(self, game, expected, turns):
         actual = game.project_future_MP(turns)
         self.assertAlmostEqual(actual, expected, 0, "Expected {} MP {} turns from now, got {}".format(expected, turns, actual))
@@ -1,3 +1,6 @@
+from .rules import compile_rules, UnitStats
+
+
 def is_stationary(unit_type, structure_types):
     """
         Args:
@@ -9,6 +12,32 @@ def is_stationary(unit_type, structure_types):
     return unit_type in structure_types
 
 
+
+def unit_stats(unit_type, config, upgraded=False):
+    """Gets the stats of a unit type, from the tables of the config's Rules, shared by every GameUnit
+
+    Args:
+        unit_type: The shorthand of the unit type
+        config: The game config
+        upgraded: If true, get the stats of the upgraded unit
+
+    Returns:
+        An immutable UnitStats record
+
+    """
+    return compile_rules(config).stats[unit_type, upgraded]
+
+
+def _stat_property(name):
+    def get_stat(unit):
+        return getattr(unit._stats, name)
+
+    def set_stat(unit, value):
+        #The record is shared, so the unit gets its own modified copy
+        unit._stats = unit._stats._replace(**{name: value})
+    return property(get_stat, set_stat)
+
+
 class GameUnit:
     """Holds information about a Unit. 
 
@@ -31,7 +60,12 @@ class GameUnit:
         * pending_removal (boolean): If this unit is marked for removal by its owner
         * upgraded (boolean): If this unit is upgraded
 
+    The stats from speed to cost are read from a UnitStats record shared by every unit of the same type
+    and upgrade level, so units are cheap to create and upgrade only swaps the record.
+
     """
+    __slots__ = ("unit_type", "config", "player_index", "pending_removal", "upgraded", "x", "y", "health", "_stats")
+
     def __init__(self, unit_type, config, player_index=None, health=None, x=-1, y=-1):
         """ Initialize unit variables using args passed
 
@@ -43,38 +77,37 @@ class GameUnit:
         self.upgraded = False
         self.x = x
         self.y = y
-        self.__serialize_type()
-        self.health = self.max_health if not health else health
-
-    def __serialize_type(self):
-        from .game_state import STRUCTURE_TYPES, UNIT_TYPE_TO_INDEX, SUPPORT
-        type_config = self.config["unitInformation"][UNIT_TYPE_TO_INDEX[self.unit_type]]
-        self.stationary = type_config["unitCategory"] == 0
-        self.speed = type_config.get("speed", 0)
-        self.damage_f = type_config.get("attackDamageTower", 0)
-        self.damage_i = type_config.get("attackDamageWalker", 0)
-        self.attackRange = type_config.get("attackRange", 0)
-        self.shieldRange = type_config.get("shieldRange", 0)
-        self.max_health = type_config.get("startHealth", 0)
-        self.shieldPerUnit = type_config.get("shieldPerUnit", 0)
-        self.shieldBonusPerY = type_config.get("shieldBonusPerY", 0)
-        self.cost = [type_config.get("cost1", 0), type_config.get("cost2", 0)]
+        self._stats = compile_rules(config).stats[unit_type, False]
+        self.health = self._stats.max_health if not health else health
+
+    stationary = _stat_property("stationary")
+    speed = _stat_property("speed")
+    damage_f = _stat_property("damage_f")
+    damage_i = _stat_property("damage_i")
+    attackRange = _stat_property("attackRange")
+    shieldRange = _stat_property("shieldRange")
+    max_health = _stat_property("max_health")
+    shieldPerUnit = _stat_property("shieldPerUnit")
+    shieldBonusPerY = _stat_property("shieldBonusPerY")
+
+    @property
+    def cost(self):
+        return list(self._stats.cost)
 
+    @cost.setter
+    def cost(self, value):
+        self._stats = self._stats._replace(cost=tuple(value))
 
     def upgrade(self):
-        from .game_state import UNIT_TYPE_TO_INDEX
-        type_config = self.config["unitInformation"][UNIT_TYPE_TO_INDEX[self.unit_type]].get("upgrade", {})
-        self.speed = type_config.get("speed", self.speed)
-        self.damage_f = type_config.get("attackDamageTower", self.damage_f)
-        self.damage_i = type_config.get("attackDamageWalker", self.damage_i)
-        self.attackRange = type_config.get("attackRange", self.attackRange)
-        self.shieldRange = type_config.get("shieldRange", self.shieldRange)
-        self.max_health = type_config.get("startHealth", self.max_health)
-        self.shieldPerUnit = type_config.get("shieldPerUnit", self.shieldPerUnit)
-        self.shieldBonusPerY = type_config.get("shieldBonusPerY", self.shieldBonusPerY)
-        self.cost = [type_config.get("cost1", 0) + self.cost[0], type_config.get("cost2", 0) + self.cost[1]]
+        """Switches the unit to the upgraded stats of its type. Upgrading an upgraded unit changes nothing."""
+        self._stats = compile_rules(self.config).stats[self.unit_type, True]
         self.upgraded = True
 
+    def __copy__(self):
+        unit = GameUnit.__new__(GameUnit)
+        for name in GameUnit.__slots__:
+            setattr(unit, name, getattr(self, name))
+        return unit
 
     def __toString(self):
         owner = "Friendly" if self.player_index == 0 else "Enemy"
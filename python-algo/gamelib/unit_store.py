@@ -0,0 +1,282 @@
+from array import array
+
+from .unit import GameUnit
+from .util import decode_json
+from .rules import compile_rules
+from .game_map import arena_tables, attack_offsets
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+#The typecode and NumPy dtype of each column
+COLUMNS = (
+    ("type_id", "b", "int8"),
+    ("player", "b", "int8"),
+    ("x", "b", "int8"),
+    ("y", "b", "int8"),
+    ("health", "d", "float64"),
+    ("upgraded", "b", "int8"),
+    ("pending_removal", "b", "int8"),
+    ("unit_id", "q", "int64"),
+)
+
+
+class UnitStore:
+    """Holds every unit of a game state as parallel columns instead of one GameUnit per unit
+
+    Row i of every column describes the same unit. Rows are in the order the engine lists units,
+    player 0's units before player 1's. Code that wants objects can get GameUnit views with
+    get_unit and units_at. The views are built on first use and cached, and changing a view does
+    not change the columns.
+
+    Attributes :
+        * config (JSON): Contains information about the current game rules
+        * rules (:obj: Rules): The rules compiled from config
+        * ARENA_SIZE (int): The size of the arena
+        * unit_types (list): The unit type shorthands, indexed by type_id
+        * type_id (array): The index of each unit's type in unit_types
+        * player (array): The player that controls each unit, 0 for you 1 for the enemy
+        * x (array): The x coordinate of each unit
+        * y (array): The y coordinate of each unit
+        * health (array): The health of each unit as sent by the engine
+        * upgraded (array): 1 if the unit is upgraded
+        * pending_removal (array): 1 if the unit is marked for removal by its owner
+        * unit_id (array): The engine's id for each unit, -1 if unknown
+
+    """
+    def __init__(self, config, arena_size=28):
+        """Creates an empty store. Use from_state or from_game_map to fill one.
+
+        Args:
+            config (JSON): Contains information about the game
+            arena_size (int): The size of the arena
+
+        """
+        self.config = config
+        self.rules = compile_rules(config)
+        self.ARENA_SIZE = arena_size
+        self.unit_types = list(self.rules.unit_types)
+        self._type_ids = self.rules.UNIT_TYPE_TO_INDEX
+        self._stationary_types = [unit_type in self.rules.STRUCTURE_TYPES for unit_type in self.unit_types]
+        self._remove_id = self._type_ids[self.rules.REMOVE]
+        self._upgrade_id = self._type_ids[self.rules.UPGRADE]
+        for name, typecode, _ in COLUMNS:
+            setattr(self, name, array(typecode))
+        self._tiles = {}
+        self._views = {}
+
+    @classmethod
+    def from_state(cls, config, state):
+        """Builds a store straight from the engine's game state, without creating GameUnits
+
+        Args:
+            config (JSON): Contains information about the game
+            state: The game state sent by the engine, as a JSON string or the decoded dict
+
+        Returns:
+            A new UnitStore
+
+        """
+        if isinstance(state, str):
+            state = decode_json(state)
+        store = cls(config)
+        store._add_engine_units(state["p1Units"], 0)
+        store._add_engine_units(state["p2Units"], 1)
+        return store
+
+    @classmethod
+    def from_game_map(cls, game_map):
+        """Builds a store from the units on a GameMap
+
+        Args:
+            game_map: The GameMap to copy units from
+
+        Returns:
+            A new UnitStore, with the units in the order GameMap iterates over locations
+
+        """
+        store = cls(game_map.config, game_map.ARENA_SIZE)
+        for location in game_map:
+            for unit in game_map[location]:
+                store.add(unit.unit_type, unit.player_index, unit.x, unit.y, unit.health, unit.upgraded, unit.pending_removal)
+        return store
+
+    def _add_engine_units(self, units, player_index):
+        """Adds one player's units in the engine's format, a list of [x, y, health, id] lists per unit type
+        """
+        for type_id, unit_infos in enumerate(units):
+            for unit_info in unit_infos:
+                x, y = int(unit_info[0]), int(unit_info[1])
+                # This depends on RM and UP always being the last types to be processed, as in GameState
+                if type_id == self._remove_id or type_id == self._upgrade_id:
+                    row = self.structure_row(x, y)
+                    if row is not None:
+                        if type_id == self._remove_id:
+                            self.pending_removal[row] = 1
+                        else:
+                            self.upgraded[row] = 1
+                    continue
+                unit_id = int(unit_info[3]) if len(unit_info) > 3 else -1
+                self.add(self.unit_types[type_id], player_index, x, y, float(unit_info[2]), unit_id=unit_id)
+
+    def add(self, unit_type, player_index, x, y, health, upgraded=False, pending_removal=False, unit_id=-1):
+        """Adds a unit to the end of the columns
+
+        Returns:
+            The row of the new unit
+
+        """
+        row = len(self.type_id)
+        self.type_id.append(self._type_ids[unit_type])
+        self.player.append(player_index)
+        self.x.append(x)
+        self.y.append(y)
+        self.health.append(health if health is not None else 0)
+        self.upgraded.append(1 if upgraded else 0)
+        self.pending_removal.append(1 if pending_removal else 0)
+        self.unit_id.append(unit_id)
+        self._tiles.setdefault(x * self.ARENA_SIZE + y, []).append(row)
+        return row
+
+    def __len__(self):
+        return len(self.type_id)
+
+    def rows_at(self, x, y):
+        """Gets the rows of the units at [x, y]
+
+        Returns:
+            A list of rows, empty if there are no units at the location
+
+        """
+        return list(self._tiles.get(x * self.ARENA_SIZE + y, ()))
+
+    def structure_row(self, x, y):
+        """Gets the row of the structure at [x, y], or None if there is no structure
+        """
+        for row in self._tiles.get(x * self.ARENA_SIZE + y, ()):
+            if self._stationary_types[self.type_id[row]]:
+                return row
+        return None
+
+    def rows(self, player_index=None, unit_type=None, stationary=None):
+        """Gets the rows of units matching every given filter
+
+        Args:
+            player_index: If given, only units controlled by this player
+            unit_type: If given, only units of this type
+            stationary: If given, only structures if True or only mobile units if False
+
+        Returns:
+            A list of rows in ascending order
+
+        """
+        type_id = self._type_ids.get(unit_type, -1) if unit_type is not None else None
+        stationary_types = self._stationary_types
+        return [row for row in range(len(self.type_id))
+            if (player_index is None or self.player[row] == player_index)
+            and (type_id is None or self.type_id[row] == type_id)
+            and (stationary is None or stationary_types[self.type_id[row]] == stationary)]
+
+    def get_unit(self, row):
+        """Gets a GameUnit view of a row, built on first use
+        """
+        unit = self._views.get(row)
+        if unit is None:
+            unit = GameUnit(self.unit_types[self.type_id[row]], self.config, self.player[row], self.health[row], self.x[row], self.y[row])
+            if self.upgraded[row]:
+                unit.upgrade()
+            unit.pending_removal = bool(self.pending_removal[row])
+            self._views[row] = unit
+        return unit
+
+    def units_at(self, x, y):
+        """Gets GameUnit views of the units at [x, y], in the same order as game_map[x, y]
+        """
+        return [self.get_unit(row) for row in self._tiles.get(x * self.ARENA_SIZE + y, ())]
+
+    def place_units(self, game_map, player_index=None):
+        """Adds GameUnit views of the stored units to a GameMap
+
+        The map may be a fork or have a checkpoint open, and rolling the checkpoint back removes the units again.
+
+        Args:
+            game_map: The GameMap to add units to
+            player_index: If given, only add units controlled by this player
+
+        """
+        for index, rows in self._tiles.items():
+            units = [self.get_unit(row) for row in rows if player_index is None or self.player[row] == player_index]
+            if units:
+                game_map._add_units(index // self.ARENA_SIZE, index % self.ARENA_SIZE, units)
+
+    def numpy_columns(self):
+        """Gets copies of the columns as NumPy arrays, for vectorized code
+
+        The arrays are copies, so units added to the store later do not appear in them, and changing them does not change the store.
+
+        Returns:
+            A dict from column name to array. Requires NumPy.
+
+        """
+        if np is None:
+            raise ImportError("numpy_columns requires NumPy")
+        return {name: np.array(getattr(self, name), dtype=dtype) for name, _, dtype in COLUMNS}
+
+    def threat_map(self, player_index, damage_attribute="damage_i", as_numpy=False):
+        """Gets the same map as GameState.threat_map straight from the columns, without creating GameUnits
+
+        With NumPy, each type of attacking structure is placed on a grid, and the grid is added at each offset in its attackRange.
+
+        Args:
+            player_index: The index corresponding to the defending player, 0 for you 1 for the enemy
+            damage_attribute: "damage_i" for the damage mobile units take, or "damage_f" for the damage structures take,
+                as in GameState.structure_threat_map
+            as_numpy: If true, return an ARENA_SIZE x ARENA_SIZE NumPy array of floats. Requires NumPy.
+
+        Returns:
+            An ARENA_SIZE x ARENA_SIZE list of lists indexed as threat[x][y]. Locations off the board are 0.
+
+        """
+        if as_numpy and np is None:
+            raise ImportError("as_numpy requires NumPy")
+        size = self.ARENA_SIZE
+        #The attacking structures, grouped by the stats they attack with
+        groups = {}
+        for row in range(len(self.type_id)):
+            type_id = self.type_id[row]
+            if self.player[row] != player_index and self._stationary_types[type_id]:
+                groups.setdefault((type_id, bool(self.upgraded[row])), []).append(row)
+
+        if np is None:
+            in_arena = arena_tables(size).in_arena
+            threat = [0] * (size * size)
+            for (type_id, upgraded), rows in groups.items():
+                stats = self.rules.stats[self.unit_types[type_id], upgraded]
+                damage = getattr(stats, damage_attribute)
+                if damage <= 0:
+                    continue
+                for row in rows:
+                    x, y = self.x[row], self.y[row]
+                    for dx, dy in attack_offsets(stats.attackRange):
+                        tx, ty = x + dx, y + dy
+                        if 0 <= tx < size and 0 <= ty < size and in_arena[tx * size + ty]:
+                            threat[tx * size + ty] += damage
+            return [threat[x * size:(x + 1) * size] for x in range(size)]
+
+        columns = self.numpy_columns()
+        reach = int(self.rules.max_attack_range) + 1
+        #Padded so every offset of every location can be added without clipping
+        padded = np.zeros((size + 2 * reach, size + 2 * reach))
+        for (type_id, upgraded), rows in groups.items():
+            stats = self.rules.stats[self.unit_types[type_id], upgraded]
+            damage = getattr(stats, damage_attribute)
+            if damage <= 0:
+                continue
+            placed = np.zeros((size, size))
+            np.add.at(placed, (columns["x"][rows], columns["y"][rows]), damage)
+            for dx, dy in attack_offsets(stats.attackRange):
+                padded[reach + dx:reach + dx + size, reach + dy:reach + dy + size] += placed
+        threat = padded[reach:reach + size, reach:reach + size] * np.array(arena_tables(size).in_arena).reshape(size, size)
+        return threat if as_numpy else threat.tolist()
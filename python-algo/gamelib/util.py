@@ -1,4 +1,15 @@
 import sys
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
 
 
 BANNER_TEXT = "---------------- Starting Your Algo --------------------"
@@ -21,6 +32,23 @@ def get_command():
         exit()
     return ret
 
+def decode_json(message):
+    """Decodes a JSON message from the game engine, using orjson or ujson if one is installed
+    since they are several times faster than the json module for large game states.
+
+    Args:
+        message: A JSON string
+
+    Returns:
+        The decoded object
+
+    """
+    if orjson is not None:
+        return orjson.loads(message)
+    if ujson is not None:
+        return ujson.loads(message)
+    return json.loads(message)
+
 def send_command(cmd):
     """Sends your turn to standard output.
     Should usually only be called by 'GameState.submit_turn()'